@@ -0,0 +1,179 @@
+"""
+Tagulous cache helpers
+
+Values are stored in the Django cache named by ``TAGULOUS_CACHE``. Keys for each
+tag model include a version number, so changes to a tag model's tags can invalidate
+all of its cached values at once by bumping the version.
+
+Tags found by name are shared between processes by the name cache backend, an
+instance of the class named by ``TAGULOUS_NAME_CACHE_BACKEND``.
+"""
+
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db import router, transaction
+from django.utils.module_loading import import_string
+
+from . import settings
+
+# Prefix for all cache keys used by Tagulous
+KEY_PREFIX = "tagulous"
+
+
+def get_cache():
+    """
+    Return the cache used by Tagulous, or None if caching is disabled
+    """
+    if settings.CACHE is None:
+        return None
+    return caches[settings.CACHE]
+
+
+def _version_key(tag_model, namespace):
+    return "%s:%s:%s:version" % (KEY_PREFIX, tag_model._meta.label_lower, namespace)
+
+
+def _new_version():
+    # Use the time, so a version which falls out of the cache can't restart at a
+    # number which has been used before
+    return int(time.time() * 1000)
+
+
+def get_version(tag_model, namespace="tags"):
+    """
+    Get the current version of cached values for the tag model, or None if caching
+    is disabled
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+
+    key = _version_key(tag_model, namespace)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, timeout=None):
+            # Another process set it first
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(tag_model, namespace="tags"):
+    """
+    Invalidate all cached values for the tag model in the given namespace
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+
+    key = _version_key(tag_model, namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not in the cache
+        cache.set(key, _new_version(), timeout=None)
+
+
+def make_key(tag_model, namespace, *parts):
+    """
+    Build a versioned cache key for the tag model, or None if caching is disabled
+    """
+    version = get_version(tag_model, namespace)
+    if version is None:
+        return None
+    return ":".join(
+        [KEY_PREFIX, tag_model._meta.label_lower, namespace, str(version)]
+        + [str(part) for part in parts]
+    )
+
+
+class NameCache(object):
+    """
+    Name cache backend to share the rows of tags found by name between
+    processes, using the Django cache
+
+    Rows are stored under versioned keys for the tag model, so are invalidated
+    when a tag is saved or deleted. When a row is not cached, one process
+    loads it while the others wait for it, so they don't all query the
+    database at once.
+    """
+
+    # Seconds to hold the lock while loading a row
+    lock_timeout = 5
+
+    # Seconds to wait between checks for a row another process is loading
+    lock_wait = 0.05
+
+    def get_key(self, tag_model, name):
+        """
+        Return the cache key for a normalised tag name, or None if caching is
+        disabled
+        """
+        # Hash the name so keys are safe for memcached
+        return make_key(
+            tag_model, "tags", "name", hashlib.md5(name.encode("utf-8")).hexdigest()
+        )
+
+    def get_or_load(self, tag_model, name, load):
+        """
+        Return the row for a normalised tag name from the cache, or call load()
+        to get it from the database and cache it when the current transaction
+        commits. If load() raises an exception, nothing is cached and the
+        exception is raised.
+        """
+        cache = get_cache()
+        key = self.get_key(tag_model, name)
+        if cache is None or key is None:
+            return load()
+
+        row = cache.get(key)
+        if row is not None:
+            return row
+
+        lock_key = "%s:lock" % key
+        if cache.add(lock_key, 1, timeout=self.lock_timeout):
+            try:
+                row = load()
+            finally:
+                cache.delete(lock_key)
+
+            # A row loaded in a transaction which is rolled back may not exist,
+            # so only share it when the transaction commits
+            transaction.on_commit(
+                lambda: cache.set(key, row), using=router.db_for_read(tag_model)
+            )
+            return row
+
+        # Another process is loading it
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.lock_wait)
+            row = cache.get(key)
+            if row is not None:
+                return row
+            if cache.get(lock_key) is None:
+                # It finished without caching a row
+                break
+        return load()
+
+
+# Name cache backend, as (setting, instance), managed by get_name_cache_backend
+_name_cache_backend = (None, None)
+
+
+def get_name_cache_backend():
+    """
+    Return the name cache backend, or None if caching is disabled
+
+    The backend is rebuilt if the setting changes.
+    """
+    global _name_cache_backend
+    path = settings.NAME_CACHE_BACKEND
+    if settings.CACHE is None or not path:
+        return None
+
+    if _name_cache_backend[0] != path:
+        _name_cache_backend = (path, import_string(path)())
+    return _name_cache_backend[1]
@@ -1,4 +1,6 @@
-from django.core.checks import Warning, register
+from django.core.checks import Error, Warning, register
+
+from . import constants
 
 SERIALIZATION_MODULES_EXPECTED = {
     "xml": "tagulous.serializers.xml_serializer",
@@ -17,15 +19,105 @@ WARNING_W001 = Warning(
 )
 
 
+ERROR_E001 = Error(
+    "``settings.TAGULOUS_COUNT_MODE`` is not a valid count mode",
+    hint="Valid count modes are: %s" % ", ".join(constants.COUNT_MODES),
+    id="tagulous.E001",
+)
+
+ERROR_E002 = Error(
+    '``settings.TAGULOUS_COUNT_MODE`` is "journal" but the journal is not installed',
+    hint="Add tagulous.contrib.counts to INSTALLED_APPS",
+    id="tagulous.E002",
+)
+
+
+ERROR_E003 = Error(
+    "A tag model has the ``count_shards`` option but count shards are not installed",
+    hint="Add tagulous.contrib.counts to INSTALLED_APPS",
+    id="tagulous.E003",
+)
+
+ERROR_E004 = Error(
+    "A tag model has the ``precompute_similar`` option but similar objects are not "
+    "installed",
+    hint="Add tagulous.contrib.similar to INSTALLED_APPS",
+    id="tagulous.E004",
+)
+
+ERROR_E005 = Error(
+    "A tag model has the ``track_cooccurrence`` option but tag co-occurrence is not "
+    "installed",
+    hint="Add tagulous.contrib.similar to INSTALLED_APPS",
+    id="tagulous.E005",
+)
+
+ERROR_E006 = Error(
+    "A tag model has the ``count_scope_field`` option but scoped counts are not "
+    "installed",
+    hint="Add tagulous.contrib.counts to INSTALLED_APPS",
+    id="tagulous.E006",
+)
+
+ERROR_E007 = Error(
+    "A tag model has the ``track_usage`` option but tag usage is not installed",
+    hint="Add tagulous.contrib.counts to INSTALLED_APPS",
+    id="tagulous.E007",
+)
+
+
+# Tag options which need a contrib app, as (option, app, error), in the order
+# their errors are reported
+OPTION_APPS = [
+    ("count_shards", "tagulous.contrib.counts", ERROR_E003),
+    ("count_scope_field", "tagulous.contrib.counts", ERROR_E006),
+    ("track_usage", "tagulous.contrib.counts", ERROR_E007),
+    ("precompute_similar", "tagulous.contrib.similar", ERROR_E004),
+    ("track_cooccurrence", "tagulous.contrib.similar", ERROR_E005),
+]
+
+
+def _get_tag_models():
+    from django.apps import apps
+
+    from .models.models import BaseTagModel
+
+    return [model for model in apps.get_models() if issubclass(model, BaseTagModel)]
+
+
 def tagulous_check(app_configs, **kwargs):
+    from django.apps import apps
     from django.conf import settings
 
+    from . import settings as tag_settings
+
     errors = []
 
     serialization_modules = getattr(settings, "SERIALIZATION_MODULES", None)
     if serialization_modules != SERIALIZATION_MODULES_EXPECTED:
         errors.append(WARNING_W001)
 
+    if tag_settings.COUNT_MODE not in constants.COUNT_MODES:
+        errors.append(ERROR_E001)
+    elif tag_settings.COUNT_MODE == "journal" and not apps.is_installed(
+        "tagulous.contrib.counts"
+    ):
+        errors.append(ERROR_E002)
+
+    # Find options used by any tag model whose app is missing, in one pass
+    missing = [
+        (option, error)
+        for option, app, error in OPTION_APPS
+        if not apps.is_installed(app)
+    ]
+    if missing:
+        used = set()
+        for model in _get_tag_models():
+            for option, __ in missing:
+                if getattr(model.tag_options, option):
+                    used.add(option)
+        errors.extend(error for option, error in missing if option in used)
+
     return errors
 
 
@@ -9,6 +9,10 @@ MODEL_PREFIX = "Tagulous"
 # %s will be replaced by the field name
 TAGGED_ATTR_MANAGER = "_%s_tagulous"
 
+# Kinds of tag field, for the tag field registry
+FIELD_SINGLETAG = "singletag"
+FIELD_TAG = "tag"
+
 # Constants to improve code legibility
 COMMA = ","
 SPACE = " "
@@ -16,11 +20,30 @@ QUOTE = '"'
 DOUBLE_QUOTE = QUOTE + QUOTE
 TREE = "/"
 
+# Strategies for filtering a TagField by a tag string
+FILTER_STRATEGIES = ("auto", "chain", "group", "exists")
+
+# Ways to score similarly tagged objects
+SIMILARITY_SCORES = ("overlap", "idf", "jaccard")
+
+# Ways to scale tag weights
+WEIGHT_SCALES = ("linear", "log")
+
+# Ways to change tag counts
+COUNT_MODES = ("direct", "journal")
+
 # Default model TagField options
 OPTION_DEFAULTS = {
     "initial": "",
     "protect_initial": True,
     "protect_all": False,
+    "count_shards": 0,
+    "precompute_similar": 0,
+    "track_cooccurrence": False,
+    "count_scope_field": "",
+    "track_usage": False,
+    "cache_names": False,
+    "name_normalised": False,
     "case_sensitive": False,
     "force_lowercase": False,
     "max_count": 0,
@@ -46,5 +69,6 @@ FORM_OPTIONS = [
     "space_delimiter",
     "tree",
     "autocomplete_limit",
+    "autocomplete_view_fulltext",
     "autocomplete_settings",
 ]
@@ -0,0 +1,5 @@
+"""
+Tag count storage
+
+Add ``tagulous.contrib.counts`` to ``INSTALLED_APPS`` to use the count journal
+"""
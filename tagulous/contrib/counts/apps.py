@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+
+
+class TagulousCountsConfig(AppConfig):
+    name = "tagulous.contrib.counts"
+    label = "tagulous_counts"
+    default_auto_field = "django.db.models.BigAutoField"
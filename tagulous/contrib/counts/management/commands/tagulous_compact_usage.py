@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from .....models.usage import compact_usage
+
+
+class Command(BaseCommand):
+    """
+    Merge old recorded tag usage into larger periods, and remove the oldest
+    """
+
+    help = "Merge old recorded tag usage into larger periods, and remove the oldest"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--after",
+            type=int,
+            default=86400,
+            help="Merge usage older than this many seconds",
+        )
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=3600,
+            help="Length in seconds of the periods to merge usage into",
+        )
+        parser.add_argument(
+            "--max-age",
+            type=int,
+            default=None,
+            help=(
+                "Remove usage older than this many seconds; defaults to"
+                " TAGULOUS_USAGE_MAX_AGE, 0 keeps all usage"
+            ),
+        )
+
+    def handle(self, after, size, max_age, **options):
+        merged = compact_usage(after=after, size=size, max_age=max_age)
+        self.stdout.write("Merged %d usage rows\n" % merged)
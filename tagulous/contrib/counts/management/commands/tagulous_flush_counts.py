@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from .....models.counts import flush_counts
+
+
+class Command(BaseCommand):
+    """
+    Apply journalled tag count changes to the tag models
+    """
+
+    help = "Apply journalled tag count changes to the tag models"
+
+    def handle(self, **options):
+        changed = flush_counts()
+        self.stdout.write("Updated counts for %d tags\n" % changed)
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="TagCountJournal",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tag_model", models.CharField(max_length=255)),
+                ("tag_pk", models.CharField(max_length=255)),
+                ("amount", models.IntegerField()),
+            ],
+        ),
+    ]
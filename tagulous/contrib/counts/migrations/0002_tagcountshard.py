@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tagulous_counts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TagCountShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tag_model", models.CharField(max_length=255)),
+                ("tag_pk", models.CharField(max_length=255)),
+                ("shard", models.PositiveSmallIntegerField()),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("tag_model", "tag_pk", "shard"),
+                        name="tagulous_counts_shard_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tagulous_counts", "0002_tagcountshard"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TagScopedCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tag_model", models.CharField(max_length=255)),
+                ("tag_pk", models.CharField(max_length=255)),
+                ("scope", models.CharField(max_length=255)),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("tag_model", "scope", "tag_pk"),
+                        name="tagulous_counts_scoped_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tagulous_counts", "0003_tagscopedcount"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TagUsage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tag_model", models.CharField(max_length=255)),
+                ("tag_pk", models.CharField(max_length=255)),
+                ("bucket", models.DateTimeField(db_index=True)),
+                ("delta", models.IntegerField(default=0)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("tag_model", "tag_pk", "bucket"),
+                        name="tagulous_counts_usage_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tagulous_counts", "0004_tagusage"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="tagusage",
+            index=models.Index(
+                fields=["tag_model", "bucket"], name="tagulous_counts_usage_window"
+            ),
+        ),
+    ]
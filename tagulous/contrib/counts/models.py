@@ -0,0 +1,83 @@
+from django.db import models
+
+
+class TagCountJournal(models.Model):
+    """
+    A change to the count of a tag, waiting to be applied to the tag model by
+    tagulous.models.counts.flush_counts()
+    """
+
+    # Label of the tag model, eg "myapp.Tagulous_MyModel_tags"
+    tag_model = models.CharField(max_length=255)
+    tag_pk = models.CharField(max_length=255)
+    amount = models.IntegerField()
+
+
+class TagCountShard(models.Model):
+    """
+    Part of the count of a tag in a tag model with the count_shards option,
+    waiting to be rolled up into the tag's count by
+    tagulous.models.counts.flush_counts()
+    """
+
+    # Label of the tag model, eg "myapp.Tagulous_MyModel_tags"
+    tag_model = models.CharField(max_length=255)
+    tag_pk = models.CharField(max_length=255)
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tag_model", "tag_pk", "shard"],
+                name="tagulous_counts_shard_unique",
+            )
+        ]
+
+
+class TagScopedCount(models.Model):
+    """
+    The count of a tag in a tag model with the count_scope_field option, for
+    the tagged objects with one value of that field
+    """
+
+    # Label of the tag model, eg "myapp.Tagulous_MyModel_tags"
+    tag_model = models.CharField(max_length=255)
+    tag_pk = models.CharField(max_length=255)
+    scope = models.CharField(max_length=255)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tag_model", "scope", "tag_pk"],
+                name="tagulous_counts_scoped_unique",
+            )
+        ]
+
+
+class TagUsage(models.Model):
+    """
+    The change in use of a tag in a tag model with the track_usage option,
+    during the period starting at bucket
+    """
+
+    # Label of the tag model, eg "myapp.Tagulous_MyModel_tags"
+    tag_model = models.CharField(max_length=255)
+    tag_pk = models.CharField(max_length=255)
+    bucket = models.DateTimeField(db_index=True)
+    delta = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tag_model", "tag_pk", "bucket"],
+                name="tagulous_counts_usage_unique",
+            )
+        ]
+        indexes = [
+            # For the usage of a tag model in a window, for trending()
+            models.Index(
+                fields=["tag_model", "bucket"], name="tagulous_counts_usage_window"
+            )
+        ]
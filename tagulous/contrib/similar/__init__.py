@@ -0,0 +1,6 @@
+"""
+Similar object and tag co-occurrence storage
+
+Add ``tagulous.contrib.similar`` to ``INSTALLED_APPS`` to precompute similar objects
+and related tags
+"""
@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+
+
+class TagulousSimilarConfig(AppConfig):
+    name = "tagulous.contrib.similar"
+    label = "tagulous_similar"
+    default_auto_field = "django.db.models.BigAutoField"
@@ -0,0 +1,54 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from .....models.cooccurrence import build_cooccurrence
+from .....models.models import BaseTagModel
+
+
+class Command(BaseCommand):
+    """
+    Count tag co-occurrence for tag models with the track_cooccurrence option
+    """
+
+    help = "Count tag co-occurrence for tag models with the track_cooccurrence option"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "tag_models",
+            nargs="*",
+            metavar="app_label.model_name",
+            help="Only count these tag models",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of tagged objects to count at once",
+        )
+
+    def handle(self, tag_models, batch_size, **options):
+        for tag_model in self.get_tag_models(tag_models):
+            counted = build_cooccurrence(tag_model, batch_size=batch_size)
+            self.stdout.write(
+                "Counted %s for %d objects\n" % (tag_model._meta.label, counted)
+            )
+
+    def get_tag_models(self, labels):
+        if not labels:
+            return [
+                model
+                for model in apps.get_models()
+                if issubclass(model, BaseTagModel)
+                and model.tag_options.track_cooccurrence
+            ]
+
+        tag_models = []
+        for label in labels:
+            try:
+                model = apps.get_model(label)
+            except (ValueError, LookupError) as e:
+                raise CommandError("Cannot find tag model %s: %s" % (label, e))
+            if not issubclass(model, BaseTagModel):
+                raise CommandError("%s is not a tag model" % label)
+            tag_models.append(model)
+        return tag_models
@@ -0,0 +1,54 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from .....models.fields import TagField
+from .....models.similar import rebuild_similar
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the stored most similar objects for TagFields whose tag models
+    have the precompute_similar option
+    """
+
+    help = (
+        "Rebuild the stored most similar objects for TagFields whose tag models"
+        " have the precompute_similar option"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "fields",
+            nargs="*",
+            metavar="app_label.model_name.field_name",
+            help="Only rebuild these fields",
+        )
+
+    def handle(self, fields, **options):
+        for field in self.get_fields(fields):
+            rebuilt = rebuild_similar(field)
+            self.stdout.write(
+                "Rebuilt %s.%s for %d objects\n"
+                % (field.model._meta.label, field.name, rebuilt)
+            )
+
+    def get_fields(self, names):
+        if not names:
+            return [
+                field
+                for model in apps.get_models()
+                for field in model._meta.get_fields()
+                if isinstance(field, TagField) and field.tag_options.precompute_similar
+            ]
+
+        fields = []
+        for name in names:
+            try:
+                model_label, field_name = name.rsplit(".", 1)
+                field = apps.get_model(model_label)._meta.get_field(field_name)
+            except (ValueError, LookupError) as e:
+                raise CommandError("Cannot find field %s: %s" % (name, e))
+            if not isinstance(field, TagField):
+                raise CommandError("%s is not a TagField" % name)
+            fields.append(field)
+        return fields
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="SimilarObject",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("field", models.CharField(max_length=255)),
+                ("object_pk", models.CharField(max_length=255)),
+                ("similar_pk", models.CharField(max_length=255)),
+                ("similarity", models.PositiveIntegerField()),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("field", "object_pk", "similar_pk"),
+                        name="tagulous_similar_object_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-19 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tagulous_similar", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TagCooccurrence",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tag_model", models.CharField(max_length=255)),
+                ("tag_pk", models.CharField(max_length=255)),
+                ("other_pk", models.CharField(max_length=255)),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("tag_model", "tag_pk", "other_pk"),
+                        name="tagulous_similar_cooccurrence_unique",
+                    )
+                ],
+            },
+        ),
+    ]
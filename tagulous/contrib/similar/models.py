@@ -0,0 +1,47 @@
+from django.db import models
+
+
+class SimilarObject(models.Model):
+    """
+    One of the most similar objects to an object, by the tags in a TagField
+    whose tag model has the precompute_similar option. Maintained by
+    tagulous.models.similar.update_similar()
+    """
+
+    # Label of the tagged model and name of the field, eg "myapp.MyModel.tags"
+    field = models.CharField(max_length=255)
+    object_pk = models.CharField(max_length=255)
+    similar_pk = models.CharField(max_length=255)
+
+    # Number of tags the objects share
+    similarity = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["field", "object_pk", "similar_pk"],
+                name="tagulous_similar_object_unique",
+            )
+        ]
+
+
+class TagCooccurrence(models.Model):
+    """
+    The number of objects which have both of two tags, for a tag model with the
+    track_cooccurrence option. Stored in both directions, and maintained by
+    tagulous.models.cooccurrence.update_cooccurrence()
+    """
+
+    # Label of the tag model, eg "myapp.Tagulous_MyModel_tags"
+    tag_model = models.CharField(max_length=255)
+    tag_pk = models.CharField(max_length=255)
+    other_pk = models.CharField(max_length=255)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tag_model", "tag_pk", "other_pk"],
+                name="tagulous_similar_cooccurrence_unique",
+            )
+        ]
@@ -1,7 +1,9 @@
+import hashlib
 import json
 
 from django import forms
 from django.contrib.admin.widgets import SELECT2_TRANSLATIONS, AutocompleteMixin
+from django.core.exceptions import EmptyResultSet
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models.query import QuerySet
 from django.urls import NoReverseMatch, reverse
@@ -11,7 +13,9 @@ from django.utils.translation import get_language
 from django.utils.translation import gettext as _
 
 from . import settings
+from .cache import get_cache, make_key
 from .models import options
+from .models.counts import batch_counts
 from .models.fields import FakeQuerySet
 from .models.models import BaseTagModel, TagModelQuerySet
 from .utils import parse_tags, render_tags
@@ -51,22 +55,7 @@ class TagWidgetBase(forms.TextInput):
 
         # Otherwise embed them, if provided
         elif self.autocomplete_tags is not None:
-            autocomplete_tags = self.autocomplete_tags
-            # If it's a queryset, make sure it hasn't been consumed, otherwise
-            # changes won't show in the list
-            if isinstance(autocomplete_tags, QuerySet):
-                autocomplete_tags = autocomplete_tags.all()
-
-            attrs["data-tag-list"] = escape(
-                force_str(
-                    json.dumps(
-                        # Call str rather than tag.name directly, in case
-                        # we've been given a list of tag strings
-                        [str(tag) for tag in autocomplete_tags],
-                        cls=DjangoJSONEncoder,
-                    )
-                )
-            )
+            attrs.update(self.get_autocomplete_attrs())
 
         # Merge default autocomplete settings into tag options
         tag_options = self.tag_options.form_items(with_defaults=False)
@@ -92,6 +81,86 @@ class TagWidgetBase(forms.TextInput):
         # Render value
         return super(TagWidgetBase, self).render(name, value, attrs)
 
+    def get_autocomplete_attrs(self):
+        """
+        Return the attributes to embed the autocomplete tags into the field
+
+        If the tags are an unfiltered queryset of a tag model, the result will
+        be cached if ``TAGULOUS_CACHE`` is set. Filtered querysets can depend on
+        other tables, which don't invalidate the cache, so are never cached.
+        """
+        autocomplete_tags = self.autocomplete_tags
+        if not isinstance(autocomplete_tags, QuerySet):
+            return self._build_autocomplete_attrs(autocomplete_tags)
+
+        # If it's a queryset, make sure it hasn't been consumed, otherwise
+        # changes won't show in the list
+        queryset = autocomplete_tags.all()
+        tag_model = queryset.model
+        if (
+            not issubclass(tag_model, BaseTagModel)
+            or get_cache() is None
+            or queryset.query.has_filters()
+            or queryset.query.is_sliced
+        ):
+            return self._build_autocomplete_attrs(queryset, tag_model)
+
+        # Key on the query, so differently ordered querysets are cached separately
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return self._build_autocomplete_attrs(queryset, tag_model)
+        query_hash = hashlib.sha256(("%s %r" % (sql, params)).encode()).hexdigest()
+        key = make_key(tag_model, "tags", "autocomplete", query_hash)
+
+        cache = get_cache()
+        attrs = cache.get(key)
+        if attrs is None:
+            attrs = self._build_autocomplete_attrs(queryset, tag_model)
+            cache.set(key, attrs)
+        return attrs
+
+    def _build_autocomplete_attrs(self, autocomplete_tags, tag_model=None):
+        """
+        Render the autocomplete tags into data-tag-list, or if there are too many
+        tags in a tag model, point data-tag-url at the AUTOCOMPLETE_LIST_VIEW
+
+        The view returns every tag in the tag model, so tags from a filtered
+        queryset are always embedded.
+        """
+        list_max = settings.AUTOCOMPLETE_LIST_MAX
+        if (
+            tag_model is not None
+            and list_max
+            and settings.AUTOCOMPLETE_LIST_VIEW
+            and not autocomplete_tags.query.has_filters()
+            and not autocomplete_tags.query.is_sliced
+        ):
+            # Only load enough to know we're over the limit
+            autocomplete_tags = list(autocomplete_tags[: list_max + 1])
+            if len(autocomplete_tags) > list_max:
+                try:
+                    url = reverse(
+                        settings.AUTOCOMPLETE_LIST_VIEW,
+                        kwargs={"label": tag_model._meta.label_lower},
+                    )
+                except NoReverseMatch as e:
+                    raise ValueError("Invalid autocomplete list view: %s" % e)
+                return {"data-tag-url": url}
+
+        return {
+            "data-tag-list": escape(
+                force_str(
+                    json.dumps(
+                        # Call str rather than tag.name directly, in case
+                        # we've been given a list of tag strings
+                        [str(tag) for tag in autocomplete_tags],
+                        cls=DjangoJSONEncoder,
+                    )
+                )
+            )
+        }
+
 
 class TagWidget(TagWidgetBase):
     """
@@ -363,9 +432,11 @@ class TaggedInlineFormSet(forms.models.BaseInlineFormSet):
 
     def save(self, *args, **kwargs):
         """Saves and updates the tag count, if parent model is a tag model"""
-        obj = super(TaggedInlineFormSet, self).save(*args, **kwargs)
-        if isinstance(self.instance, BaseTagModel):
-            self.instance.update_count()
+        # Update tag counts together once all the forms have been saved
+        with batch_counts(using=self.instance._state.db):
+            obj = super(TaggedInlineFormSet, self).save(*args, **kwargs)
+            if isinstance(self.instance, BaseTagModel):
+                self.instance.update_count()
         return obj
 
     def _construct_form(self, i, **kwargs):
@@ -11,6 +11,7 @@ from .fields import (  # noqa
     BaseTagField,
     SingleTagField,
     TagField,
+    get_tag_field_map,
     singletagfields_from_model,
     tagfields_from_model,
 )
@@ -0,0 +1,243 @@
+"""
+Tag co-occurrence
+
+Tags co-occur when an object has both in a TagField. get_related_tags() finds
+the tags which co-occur most with a tag.
+
+If a tag model has the track_cooccurrence option, the number of objects with
+each pair of tags is stored in tagulous.contrib.similar, and updated by
+update_cooccurrence() when an object's tags change. Existing tags can be
+counted with build_cooccurrence().
+"""
+
+import operator
+from functools import reduce
+
+from django.apps import apps
+from django.db import models
+
+
+def _get_cooccurrence_model():
+    return apps.get_model("tagulous_similar", "TagCooccurrence")
+
+
+def is_tracked(tag_model):
+    """
+    Return True if co-occurrence is stored for the tag model
+    """
+    return bool(tag_model.tag_options.track_cooccurrence) and apps.is_installed(
+        "tagulous.contrib.similar"
+    )
+
+
+def _get_tag_fields(tag_model):
+    """
+    Return a list of TagFields which use the tag model
+    """
+    # Avoid circular import
+    from .fields import TagField
+
+    return [
+        related.field
+        for related in tag_model.get_related_fields()
+        if isinstance(related.field, TagField)
+    ]
+
+
+def _get_pairs(tag_pks, changed_pks):
+    """
+    Return a set of (tag_pk, other_pk) pairs between the changed tags and the
+    tags, in both directions
+    """
+    pairs = set()
+    for changed_pk in changed_pks:
+        for tag_pk in tag_pks:
+            if tag_pk != changed_pk:
+                pairs.add((changed_pk, tag_pk))
+                pairs.add((tag_pk, changed_pk))
+    return pairs
+
+
+def _match_pairs(pairs):
+    """
+    Return a Q object to match co-occurrence rows for a list of
+    (tag_pk, other_pk) pairs, matching by tag then other tags
+    """
+    others = {}
+    for tag_pk, other_pk in pairs:
+        others.setdefault(tag_pk, []).append(other_pk)
+    return reduce(
+        operator.or_,
+        (
+            models.Q(tag_pk=tag_pk, other_pk__in=other_pks)
+            for tag_pk, other_pks in others.items()
+        ),
+    )
+
+
+def _apply_pairs(tag_model, amounts):
+    """
+    Change the stored co-occurrence counts
+
+    Arguments:
+        tag_model   The tag model
+        amounts     A dict of {(tag_pk, other_pk): amount}
+    """
+    amounts = {
+        (str(tag_pk), str(other_pk)): amount
+        for (tag_pk, other_pk), amount in amounts.items()
+        if amount
+    }
+    if not amounts:
+        return
+
+    cooccurrence_model = _get_cooccurrence_model()
+    label = tag_model._meta.label
+    rows = cooccurrence_model._base_manager.filter(tag_model=label)
+
+    # Make sure rows exist for pairs being counted up
+    cooccurrence_model._base_manager.bulk_create(
+        [
+            cooccurrence_model(tag_model=label, tag_pk=tag_pk, other_pk=other_pk)
+            for (tag_pk, other_pk), amount in amounts.items()
+            if amount > 0
+        ],
+        ignore_conflicts=True,
+    )
+
+    # Update the pairs which change by the same amount together
+    pairs_by_amount = {}
+    for pair, amount in amounts.items():
+        pairs_by_amount.setdefault(amount, []).append(pair)
+
+    for amount, pairs in pairs_by_amount.items():
+        rows.filter(_match_pairs(pairs)).update(count=models.F("count") + amount)
+
+    # Remove pairs which were counted down and no longer co-occur
+    removed = [pair for pair, amount in amounts.items() if amount < 0]
+    if removed:
+        rows.filter(_match_pairs(removed), count__lte=0).delete()
+
+
+def update_cooccurrence(tag_model, tags, added, removed):
+    """
+    Update the stored co-occurrence counts after an object's tags change
+
+    Arguments:
+        tag_model   The tag model
+        tags        The tags the object now has
+        added       The tags which were added
+        removed     The tags which were removed
+    """
+    tag_pks = {tag.pk for tag in tags}
+    added_pks = {tag.pk for tag in added}
+    removed_pks = {tag.pk for tag in removed}
+    old_pks = (tag_pks - added_pks) | removed_pks
+
+    amounts = {pair: 1 for pair in _get_pairs(tag_pks, added_pks)}
+    for pair in _get_pairs(old_pks, removed_pks):
+        amounts[pair] = amounts.get(pair, 0) - 1
+    _apply_pairs(tag_model, amounts)
+
+
+def _count_related(tag):
+    """
+    Return a dict of {pk: count} of the tags which co-occur with a tag, from
+    the through tables of the TagFields which use its tag model
+    """
+    counts = {}
+    for tag_field in _get_tag_fields(type(tag)):
+        through = tag_field.remote_field.through
+        source_name = tag_field.m2m_field_name()
+        target_name = tag_field.m2m_reverse_field_name()
+        objects = through._base_manager.filter(**{target_name: tag.pk}).values(
+            source_name
+        )
+        rows = (
+            through._base_manager.filter(**{"%s__in" % source_name: objects})
+            .exclude(**{target_name: tag.pk})
+            .order_by()
+            .values(target_name)
+            .annotate(num=models.Count("pk"))
+            .values_list(target_name, "num")
+        )
+        for pk, num in rows:
+            counts[pk] = counts.get(pk, 0) + num
+    return counts
+
+
+def get_related_tags(tag, limit=None):
+    """
+    Return a queryset of the tags which co-occur most with a tag, annotated
+    with tagulous_cooccurrence, the number of objects which have both, and
+    ordered with the most first
+    """
+    tag_model = type(tag)
+    if is_tracked(tag_model):
+        to_python = tag_model._meta.pk.to_python
+        counts = [
+            (to_python(pk), count)
+            for pk, count in _get_cooccurrence_model()
+            ._base_manager.filter(tag_model=tag_model._meta.label, tag_pk=str(tag.pk))
+            .order_by("-count", "pk")
+            .values_list("other_pk", "count")[:limit]
+        ]
+    else:
+        counts = sorted(
+            _count_related(tag).items(), key=lambda item: item[1], reverse=True
+        )[:limit]
+
+    if not counts:
+        return tag_model.objects.none()
+    return (
+        tag_model.objects.filter(pk__in=[pk for pk, __ in counts])
+        .annotate(
+            tagulous_cooccurrence=models.Case(
+                *[models.When(pk=pk, then=models.Value(count)) for pk, count in counts],
+                output_field=models.IntegerField(),
+            )
+        )
+        .order_by("-tagulous_cooccurrence", "name")
+    )
+
+
+def build_cooccurrence(tag_model, batch_size=500):
+    """
+    Replace the stored co-occurrence counts for a tag model by counting the
+    tags on every object, in batches of objects
+
+    Returns the number of objects counted
+    """
+    _get_cooccurrence_model()._base_manager.filter(
+        tag_model=tag_model._meta.label
+    ).delete()
+
+    counted = 0
+    for tag_field in _get_tag_fields(tag_model):
+        through = tag_field.remote_field.through
+        source_name = tag_field.m2m_field_name()
+        target_name = tag_field.m2m_reverse_field_name()
+        last_pk = None
+        while True:
+            pks = tag_field.model._base_manager.order_by("pk")
+            if last_pk is not None:
+                pks = pks.filter(pk__gt=last_pk)
+            pks = list(pks.values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+
+            tags_by_object = {}
+            for pk, tag_pk in through._base_manager.filter(
+                **{"%s__in" % source_name: pks}
+            ).values_list(source_name, target_name):
+                tags_by_object.setdefault(pk, set()).add(tag_pk)
+
+            amounts = {}
+            for tag_pks in tags_by_object.values():
+                for pair in _get_pairs(tag_pks, tag_pks):
+                    amounts[pair] = amounts.get(pair, 0) + 1
+            _apply_pairs(tag_model, amounts)
+
+            counted += len(pks)
+            last_pk = pks[-1]
+    return counted
@@ -0,0 +1,641 @@
+"""
+Tag counts
+
+Changes to tag counts are applied with change_counts(), which updates several
+tags in a tag model with a single query.
+
+If settings.COUNT_MODE is "journal", changes are instead recorded in the
+journal in tagulous.contrib.counts, and applied later by flush_counts().
+
+Changes made inside batch_counts() are held and applied together at the end.
+
+If a tag model has the count_shards option, changes are spread across that
+many shard rows per tag in tagulous.contrib.counts, and rolled up into the tag
+model's count field by flush_counts().
+
+If a tag model has the count_scope_field option, counts are also kept for each
+value of that field on the tagged models in tagulous.contrib.counts.
+"""
+
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.db import models, router, transaction
+
+from .. import settings
+from ..cache import bump_version
+
+# Number of rows to delete or update at once when flushing
+FLUSH_BATCH_SIZE = 500
+
+# Changes held by batch_counts(), as (using, segments), with a segment for
+# each run of changes in the same savepoint, as (savepoint ids, marker,
+# {tag_model: ({pk: amount}, {pk: [tag]}, {scope: {pk: amount}})})
+_pending_counts = ContextVar("tagulous_pending_counts", default=None)
+
+
+def change_counts(tag_model, changes, scope=None):
+    """
+    Change the counts of tags in a tag model, then try to delete any tags
+    whose counts have reached 0.
+
+    Arguments:
+        tag_model   The tag model
+        changes     An iterable of (tag, amount) pairs, where tag is a saved
+                    instance of the tag model. Amounts for the same tag are
+                    combined.
+        scope       Optional scope value from get_scope(), to also change the
+                    counts of the tags in that scope
+
+    The tag instances are updated with their new counts, unless the change is
+    journalled. Inside batch_counts(), changes are held until the end of the
+    batch.
+    """
+    # Combine amounts by tag, with any held by a batch
+    pending = _get_pending_segment()
+    if pending is None:
+        amounts, tags, scoped = {}, {}, {}
+    else:
+        amounts, tags, scoped = pending.setdefault(tag_model, ({}, {}, {}))
+    scope_amounts = None if scope is None else scoped.setdefault(scope, {})
+
+    for tag, amount in changes:
+        amounts[tag.pk] = amounts.get(tag.pk, 0) + amount
+        tags.setdefault(tag.pk, []).append(tag)
+        if scope_amounts is not None:
+            scope_amounts[tag.pk] = scope_amounts.get(tag.pk, 0) + amount
+
+    if pending is None:
+        _dispatch_counts(tag_model, amounts, tags, scoped)
+
+
+def _dispatch_counts(tag_model, amounts, tags, scoped):
+    """
+    Send combined changes to the counts of tags to the scoped counts, and to
+    the journal, shards or tag model
+    """
+    for scope, scope_amounts in scoped.items():
+        _scope_counts(tag_model, scope, scope_amounts)
+
+    amounts = {pk: amount for pk, amount in amounts.items() if amount}
+    if not amounts:
+        return
+
+    if settings.COUNT_MODE == "journal":
+        _journal_counts(tag_model, amounts)
+    elif tag_model.tag_options.count_shards:
+        _shard_counts(tag_model, amounts, tags)
+    else:
+        _apply_counts(tag_model, amounts, tags)
+
+
+@contextmanager
+def batch_counts(using=None):
+    """
+    Context manager to hold changes to tag counts until the end of the block,
+    then apply them with one update per tag model.
+
+    The block is run in transaction.atomic(using=using), and the counts are
+    updated before the transaction commits. Tags whose counts reach 0 will only
+    be deleted at the end of the block. Nested batches are part of the
+    outermost batch. Changes made in a savepoint which is rolled back, such as
+    a nested batch or atomic block which fails, are discarded.
+    """
+    if _pending_counts.get() is not None:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    segments = []
+    token = _pending_counts.set((using, segments))
+    try:
+        with transaction.atomic(using=using):
+            yield
+            _pending_counts.reset(token)
+            token = None
+
+            # Savepoint rollbacks discard their on_commit callbacks, so only
+            # combine segments whose markers are still registered
+            live = {
+                callback[1]
+                for callback in transaction.get_connection(using).run_on_commit
+            }
+            pending = {}
+            for __, marker, changes in segments:
+                if marker not in live:
+                    continue
+                for tag_model, (amounts, tags, scoped) in changes.items():
+                    _merge_pending(
+                        pending.setdefault(tag_model, ({}, {}, {})),
+                        amounts,
+                        tags,
+                        scoped,
+                    )
+            for tag_model, (amounts, tags, scoped) in pending.items():
+                _dispatch_counts(tag_model, amounts, tags, scoped)
+    finally:
+        if token is not None:
+            _pending_counts.reset(token)
+
+
+def _get_pending_segment():
+    """
+    Return the {tag_model: (amounts, tags, scoped)} held by batch_counts() for
+    the current savepoint, or None outside a batch
+    """
+    pending = _pending_counts.get()
+    if pending is None:
+        return None
+
+    using, segments = pending
+    connection = transaction.get_connection(using)
+    savepoint_ids = list(connection.savepoint_ids)
+    if not segments or segments[-1][0] != savepoint_ids:
+        # Mark the segment with a callback which is discarded if its savepoint
+        # is rolled back
+        def marker():
+            pass
+
+        transaction.on_commit(marker, using=using)
+        segments.append((savepoint_ids, marker, {}))
+    return segments[-1][2]
+
+
+def _merge_pending(into, amounts, tags, scoped):
+    """
+    Add held amounts, tags and scoped amounts for a tag model into another set
+    """
+    into_amounts, into_tags, into_scoped = into
+    for pk, amount in amounts.items():
+        into_amounts[pk] = into_amounts.get(pk, 0) + amount
+    for pk, tag_list in tags.items():
+        into_tags.setdefault(pk, []).extend(tag_list)
+    for scope, scope_amounts in scoped.items():
+        into_scope = into_scoped.setdefault(scope, {})
+        for pk, amount in scope_amounts.items():
+            into_scope[pk] = into_scope.get(pk, 0) + amount
+
+
+def get_counts(tag_model, pks):
+    """
+    Return a dict of {pk: count} for the tags in a tag model, including any
+    changes in shards which have not been rolled up yet
+    """
+    counts = dict(
+        tag_model._base_manager.using(router.db_for_write(tag_model))
+        .filter(pk__in=list(pks))
+        .values_list("pk", "count")
+    )
+    if counts and tag_model.tag_options.count_shards:
+        for pk, total in _get_shard_totals(tag_model, counts):
+            counts[pk] += total
+    return counts
+
+
+def _get_delta(amounts, key="pk"):
+    """
+    Return an expression for the amount to change each row by, from a dict of
+    {key value: amount}
+    """
+    # Group rows by the amount they change by
+    keys_by_amount = {}
+    for value, amount in amounts.items():
+        keys_by_amount.setdefault(amount, []).append(value)
+
+    if len(keys_by_amount) == 1:
+        (amount,) = keys_by_amount
+        return models.Value(amount)
+
+    return models.Case(
+        *[
+            models.When(**{"%s__in" % key: values, "then": models.Value(amount)})
+            for amount, values in keys_by_amount.items()
+        ],
+        default=models.Value(0),
+    )
+
+
+def _apply_counts(tag_model, amounts, tags=None):
+    """
+    Change the counts of tags in the database, then try to delete any tags
+    whose counts have reached 0.
+
+    Arguments:
+        tag_model   The tag model
+        amounts     A dict of {pk: amount}
+        tags        Optional dict of {pk: [tag, ...]} of tag instances to
+                    update with their new counts
+    """
+    # Use DB for write, so we can read back what we've just written
+    using = router.db_for_write(tag_model)
+    tag_qs = tag_model._base_manager.using(using).filter(pk__in=list(amounts))
+    tag_qs.update(count=models.F("count") + _get_delta(amounts))
+
+    # Invalidate again on commit, in case the old counts were cached from
+    # another connection before the transaction committed
+    bump_version(tag_model, "counts")
+    if transaction.get_connection(using).in_atomic_block:
+        transaction.on_commit(lambda: bump_version(tag_model, "counts"), using=using)
+
+    if tags is None:
+        for tag in tag_qs.filter(count=0):
+            tag.try_delete()
+        return
+
+    _reload_counts(tag_model, tags)
+
+
+def _reload_counts(tag_model, tags):
+    """
+    Update tag instances with their counts from the database, then try to
+    delete any tags whose counts, including any shards, have reached 0
+
+    Arguments:
+        tag_model   The tag model
+        tags        A dict of {pk: [tag, ...]}
+    """
+    # Rows of [count, total including shards, protected]
+    current = {
+        pk: [count, count, protected]
+        for pk, count, protected in tag_model._base_manager.using(
+            router.db_for_write(tag_model)
+        )
+        .filter(pk__in=list(tags))
+        .values_list("pk", "count", "protected")
+    }
+    if current and tag_model.tag_options.count_shards:
+        for pk, total in _get_shard_totals(tag_model, current):
+            current[pk][1] += total
+
+    # Any tags which are missing have been deleted elsewhere
+    for pk, (count, total, protected) in current.items():
+        # Instances keep the stored count, so saving them won't write shard
+        # totals which will be rolled up again
+        for tag in tags[pk]:
+            tag.count = count
+            tag.protected = protected
+
+        # Delete when the total reaches 0
+        tag = tags[pk][0]
+        tag.count = total
+        tag.try_delete()
+        tag.count = count
+        if tag.pk is None and tag_model.tag_options.count_shards:
+            # Tag was deleted; its shards are no longer needed
+            _get_shard_model()._base_manager.filter(
+                tag_model=tag_model._meta.label, tag_pk=str(pk)
+            ).delete()
+
+
+# ##############################################################################
+# ###### Count journal
+# ##############################################################################
+
+
+def _get_journal_model():
+    return apps.get_model("tagulous_counts", "TagCountJournal")
+
+
+def _journal_counts(tag_model, amounts):
+    """
+    Record changes to the counts of tags in the journal
+
+    Arguments:
+        tag_model   The tag model
+        amounts     A dict of {pk: amount}
+    """
+    journal_model = _get_journal_model()
+    label = tag_model._meta.label
+    journal_model.objects.bulk_create(
+        [
+            journal_model(tag_model=label, tag_pk=str(pk), amount=amount)
+            for pk, amount in amounts.items()
+        ]
+    )
+
+
+def discard_counts(tag):
+    """
+    Discard any batched, journalled or sharded changes to the count of a tag,
+    because its count is about to be set directly
+    """
+    pending = _pending_counts.get()
+    if pending is not None:
+        for __, __, changes in pending[1]:
+            if type(tag) in changes:
+                amounts, tags, __ = changes[type(tag)]
+                amounts.pop(tag.pk, None)
+                tags.pop(tag.pk, None)
+
+    if settings.COUNT_MODE == "journal":
+        _get_journal_model().objects.filter(
+            tag_model=tag._meta.label, tag_pk=str(tag.pk)
+        ).delete()
+
+    if tag.tag_options.count_shards:
+        _get_shard_model().objects.filter(
+            tag_model=tag._meta.label, tag_pk=str(tag.pk)
+        ).update(count=0)
+
+
+# ##############################################################################
+# ###### Count shards
+# ##############################################################################
+
+
+def _get_shard_model():
+    return apps.get_model("tagulous_counts", "TagCountShard")
+
+
+def _shard_counts(tag_model, amounts, tags):
+    """
+    Change the counts of tags in a random shard, then try to delete any tags
+    whose counts have reached 0.
+
+    Arguments:
+        tag_model   The tag model
+        amounts     A dict of {pk: amount}
+        tags        A dict of {pk: [tag, ...]} of tag instances to update with
+                    their new counts
+    """
+    shard_model = _get_shard_model()
+    label = tag_model._meta.label
+    shard = random.randrange(tag_model.tag_options.count_shards)
+    shard_amounts = {str(pk): amount for pk, amount in amounts.items()}
+
+    # Make sure the shard rows exist, then update them
+    shard_model.objects.bulk_create(
+        [
+            shard_model(tag_model=label, tag_pk=tag_pk, shard=shard)
+            for tag_pk in shard_amounts
+        ],
+        ignore_conflicts=True,
+    )
+    shard_model.objects.filter(
+        tag_model=label, shard=shard, tag_pk__in=list(shard_amounts)
+    ).update(count=models.F("count") + _get_delta(shard_amounts, key="tag_pk"))
+
+    _reload_counts(tag_model, tags)
+
+
+def _get_shard_totals(tag_model, pks):
+    """
+    Generator of (pk, total) pairs for the shards of the given tags
+    """
+    pks_by_str = {str(pk): pk for pk in pks}
+    shards = (
+        _get_shard_model()
+        ._base_manager.filter(
+            tag_model=tag_model._meta.label, tag_pk__in=list(pks_by_str)
+        )
+        .order_by()
+        .values("tag_pk")
+        .annotate(total=models.Sum("count"))
+        .values_list("tag_pk", "total")
+    )
+    for tag_pk, total in shards:
+        yield pks_by_str[tag_pk], total
+
+
+# ##############################################################################
+# ###### Scoped counts
+# ##############################################################################
+
+
+def _get_scoped_model():
+    return apps.get_model("tagulous_counts", "TagScopedCount")
+
+
+def get_scope(tag_model, instance):
+    """
+    Return the value of the count scope field of a tagged instance as a
+    string, or None if the tag model does not have scoped counts or the value
+    is None
+    """
+    field_name = tag_model.tag_options.count_scope_field
+    if not field_name or not apps.is_installed("tagulous.contrib.counts"):
+        return None
+    value = getattr(instance, instance._meta.get_field(field_name).attname)
+    if value is None:
+        return None
+    return str(value)
+
+
+def _scope_counts(tag_model, scope, amounts):
+    """
+    Change the counts of tags in a scope, and remove any which reach 0
+
+    Arguments:
+        tag_model   The tag model
+        scope       The scope value
+        amounts     A dict of {pk: amount}
+    """
+    amounts = {str(pk): amount for pk, amount in amounts.items() if amount}
+    if not amounts:
+        return
+
+    scoped_model = _get_scoped_model()
+    label = tag_model._meta.label
+    scoped_model._base_manager.bulk_create(
+        [
+            scoped_model(tag_model=label, tag_pk=tag_pk, scope=scope)
+            for tag_pk, amount in amounts.items()
+            if amount > 0
+        ],
+        ignore_conflicts=True,
+    )
+    rows = scoped_model._base_manager.filter(
+        tag_model=label, scope=scope, tag_pk__in=list(amounts)
+    )
+    rows.update(count=models.F("count") + _get_delta(amounts, key="tag_pk"))
+    if any(amount < 0 for amount in amounts.values()):
+        rows.filter(count__lte=0).delete()
+
+
+def get_scoped_counts(tag_model, scope):
+    """
+    Return a queryset of the counts of tags in a scope, with the tag pk as a
+    string in tag_pk
+    """
+    return _get_scoped_model()._base_manager.filter(
+        tag_model=tag_model._meta.label, scope=str(scope)
+    )
+
+
+def rebuild_scoped_counts(tag_model):
+    """
+    Replace the scoped counts for a tag model by counting the tags on every
+    object in each scope
+
+    Returns the number of scoped counts
+    """
+    # Avoid circular import
+    from .fields import SingleTagField
+
+    field_name = tag_model.tag_options.count_scope_field
+    counts = {}
+    for related in tag_model.get_related_fields():
+        tag_field = related.field
+        scope_name = tag_field.model._meta.get_field(field_name).attname
+
+        # Count objects by scope and tag
+        if isinstance(tag_field, SingleTagField):
+            rows = tag_field.model._base_manager.exclude(
+                **{"%s__isnull" % tag_field.attname: True}
+            )
+            names = [scope_name, tag_field.attname]
+        else:
+            rows = tag_field.remote_field.through._base_manager.all()
+            names = [
+                "%s__%s" % (tag_field.m2m_field_name(), scope_name),
+                tag_field.m2m_reverse_field_name(),
+            ]
+        rows = (
+            rows.order_by()
+            .values(*names)
+            .annotate(num=models.Count("pk"))
+            .values_list(*names, "num")
+        )
+        for scope, tag_pk, num in rows:
+            if scope is None:
+                continue
+            key = (str(scope), str(tag_pk))
+            counts[key] = counts.get(key, 0) + num
+
+    scoped_model = _get_scoped_model()
+    label = tag_model._meta.label
+    with transaction.atomic(using=router.db_for_write(scoped_model)):
+        scoped_model._base_manager.filter(tag_model=label).delete()
+        scoped_model._base_manager.bulk_create(
+            [
+                scoped_model(tag_model=label, tag_pk=tag_pk, scope=scope, count=count)
+                for (scope, tag_pk), count in counts.items()
+            ],
+            batch_size=FLUSH_BATCH_SIZE,
+        )
+    return len(counts)
+
+
+# ##############################################################################
+# ###### Flushing
+# ##############################################################################
+
+
+def _read_journal(journal):
+    """
+    Sum and delete the entries in the journal, in batches of up to
+    FLUSH_BATCH_SIZE entries
+
+    Each batch is locked, summed by the database and deleted by the pks which
+    were locked, so a flush running at the same time can't apply them again,
+    and entries added while flushing are kept for the next flush.
+
+    Returns a dict of {tag model label: {tag pk: amount}}
+    """
+    amounts_by_model = {}
+    last_pk = journal.aggregate(last_pk=models.Max("pk"))["last_pk"]
+    if last_pk is None:
+        return amounts_by_model
+
+    pending = journal.filter(pk__lte=last_pk).select_for_update().order_by("pk")
+    while True:
+        row_pks = list(pending.values_list("pk", flat=True)[:FLUSH_BATCH_SIZE])
+        if not row_pks:
+            break
+        rows = journal.filter(pk__in=row_pks)
+        for label, tag_pk, amount in (
+            rows.order_by()
+            .values("tag_model", "tag_pk")
+            .annotate(total=models.Sum("amount"))
+            .values_list("tag_model", "tag_pk", "total")
+        ):
+            amounts = amounts_by_model.setdefault(label, {})
+            amounts[tag_pk] = amounts.get(tag_pk, 0) + amount
+        rows.delete()
+    return amounts_by_model
+
+
+def _read_pending(queryset, amount_field):
+    """
+    Read and lock rows of pending count changes
+
+    Returns a dict of {row pk: amount}, and a dict of
+    {tag model label: {tag pk: amount}}
+    """
+    rows = {}
+    amounts_by_model = {}
+    for row_pk, label, tag_pk, amount in (
+        queryset.select_for_update()
+        .order_by("pk")
+        .values_list("pk", "tag_model", "tag_pk", amount_field)
+    ):
+        rows[row_pk] = amount
+        amounts = amounts_by_model.setdefault(label, {})
+        amounts[tag_pk] = amounts.get(tag_pk, 0) + amount
+    return rows, amounts_by_model
+
+
+def _batches(rows):
+    """
+    Generator of dicts of up to FLUSH_BATCH_SIZE rows from a dict of rows
+    """
+    row_pks = list(rows)
+    for i in range(0, len(row_pks), FLUSH_BATCH_SIZE):
+        yield {pk: rows[pk] for pk in row_pks[i : i + FLUSH_BATCH_SIZE]}
+
+
+def _apply_pending(amounts_by_model):
+    """
+    Apply a dict of {tag model label: {tag pk: amount}} to the tag models
+
+    Returns the number of tags changed
+    """
+    changed = 0
+    for label, amounts in amounts_by_model.items():
+        amounts = {pk: amount for pk, amount in amounts.items() if amount}
+        if not amounts:
+            continue
+        try:
+            tag_model = apps.get_model(label)
+        except LookupError:
+            # Tag model has been removed
+            continue
+        _apply_counts(tag_model, amounts)
+        changed += len(amounts)
+    return changed
+
+
+def flush_counts():
+    """
+    Apply the changes in the journal and roll up count shards into the tag
+    models, in one update per tag model, then try to delete any tags whose
+    counts have reached 0.
+
+    Returns the number of tags whose counts were changed.
+    """
+    if not apps.is_installed("tagulous.contrib.counts"):
+        return 0
+
+    journal_model = _get_journal_model()
+    shard_model = _get_shard_model()
+    using = router.db_for_write(journal_model)
+    changed = 0
+
+    with transaction.atomic(using=using):
+        # Journal entries are deleted once applied
+        journal = journal_model._base_manager.using(using)
+        changed += _apply_pending(_read_journal(journal))
+
+        # Shards are kept and their counts reduced by the amounts rolled up; the
+        # rows are locked, so changes waiting for them will be kept
+        shards = shard_model._base_manager.using(using)
+        rows, amounts_by_model = _read_pending(shards.exclude(count=0), "count")
+        for batch in _batches(rows):
+            shards.filter(pk__in=list(batch)).update(
+                count=models.F("count") - _get_delta(batch)
+            )
+        changed += _apply_pending(amounts_by_model)
+
+    return changed
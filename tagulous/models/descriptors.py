@@ -10,9 +10,11 @@ manager instances.
 
 from collections.abc import Iterable
 
-from django.db.models import Q
-
-from .managers import FakeTagRelatedManager, SingleTagManager, TagRelatedManagerMixin
+from .managers import (
+    FakeTagRelatedManager,
+    SingleTagManager,
+    get_tag_related_manager_class,
+)
 
 # ##############################################################################
 # ###### Base class for tag field descriptors
@@ -104,20 +106,8 @@ class SingleTagDescriptor(BaseTagDescriptor):
         if not related:
             return related
 
-        # Add get_similar_objects()
-        field = self.field
-
-        def get_similar_objects():
-            # Start with all objects except the source object
-            qs = field.model.objects.exclude(pk=instance.pk)
-
-            # Find ones which match
-            qs = qs.filter(Q(**{f"{field.name}": getattr(instance, field.name)}))
-
-            return qs
-
-        related.get_similar_objects = get_similar_objects
-
+        # Tell the tag where it came from, for get_similar_objects()
+        related._tagulous_source = manager
         return related
 
 
@@ -186,9 +176,7 @@ class TagDescriptor(BaseTagDescriptor):
         manager = self.descriptor.__get__(instance, instance_type)
 
         # Add in the mixin
-        manager.__class__ = type(
-            str("TagRelatedManager"), (TagRelatedManagerMixin, manager.__class__), {}
-        )
+        manager.__class__ = get_tag_related_manager_class(manager.__class__)
 
         # Manager is already instantiated; initialise tagulous in it
         manager.init_tagulous(self)
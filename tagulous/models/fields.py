@@ -15,6 +15,7 @@ from django.utils.text import capfirst
 from .. import constants
 from .. import settings as tag_settings
 from .descriptors import SingleTagDescriptor, TagDescriptor
+from .lookups import SingleTagAny, SingleTagNone, create_through_model
 from .models import BaseTagModel, TagModel, TagTreeModel
 from .options import TagOptions
 
@@ -206,9 +207,17 @@ class BaseTagField(object):
         self.remote_field.model = self.tag_model
 
         # Contribute to class
+        self.prepare_relation(cls, name)
         super(BaseTagField, self).contribute_to_class(cls, name)
         self.contributed = True
 
+    def prepare_relation(self, cls, name):
+        """
+        Prepare the relation to the tag model before the field is contributed
+        to the class
+        """
+        pass
+
     def formfield(self, form_class, **kwargs):
         """
         Common actions for TagField and SingleTagField to set up a formfield
@@ -381,6 +390,10 @@ class SingleTagField(BaseTagField, models.ForeignKey):
         return super(SingleTagField, self).formfield(form_class=form_class, **kwargs)
 
 
+SingleTagField.register_lookup(SingleTagAny)
+SingleTagField.register_lookup(SingleTagNone)
+
+
 # ##############################################################################
 # ###### Tag field
 # ##############################################################################
@@ -490,6 +503,15 @@ class TagField(BaseTagField, models.ManyToManyField):
         new_descriptor = TagDescriptor(old_descriptor)
         setattr(cls, name, new_descriptor)
 
+    def prepare_relation(self, cls, name):
+        """
+        Create the through model, so it has the TagField lookups
+        """
+        if cls._meta.abstract or cls._meta.swapped:
+            return
+        self.set_attributes_from_name(name)
+        self.remote_field.through = create_through_model(self, cls, name)
+
     def value_from_object(self, obj):
         """
         Tricks django.forms.models.model_to_dict into passing data to the form.
@@ -543,3 +565,26 @@ def singletagfields_from_model(model):
 def tagfields_from_model(model):
     """Get a list of TagField fields from a model class"""
     return [field for field in model._meta.many_to_many if isinstance(field, TagField)]
+
+
+def get_tag_field_map(model):
+    """
+    Get a dict of the tag fields on a model class, mapping field names to
+    ``(field, kind)`` tuples, where kind is ``constants.FIELD_SINGLETAG`` or
+    ``constants.FIELD_TAG``.
+
+    This is built the first time it is requested for a model, which is normally
+    when the model is prepared, and stored on the model's ``_meta``.
+    """
+    try:
+        return model._meta._tagulous_field_map
+    except AttributeError:
+        pass
+
+    tag_field_map = {}
+    for field in singletagfields_from_model(model):
+        tag_field_map[field.name] = (field, constants.FIELD_SINGLETAG)
+    for field in tagfields_from_model(model):
+        tag_field_map[field.name] = (field, constants.FIELD_TAG)
+    model._meta._tagulous_field_map = tag_field_map
+    return tag_field_map
@@ -0,0 +1,237 @@
+"""
+Tag lookup
+
+Tags are found by name with get_tag(), which honours the tag model's
+case_sensitive option. Queries on tag names should use name_filter(), which
+matches names the same way.
+
+If a tag model has a name_normalised field, added by the name_normalised
+option, case-insensitive lookups compare it to the normalised name, so they can
+use its index.
+
+If a tag model has the cache_names option, the pk, name and protected flag of
+the tags found are kept in an LRU cache in each process, of up to
+settings.NAME_CACHE_SIZE names per tag model, and tags found in the cache are
+returned with their other fields deferred. Tags loaded in a transaction are
+only cached when it commits, so tags from a transaction which is rolled back
+are never cached. A tag model's cache is cleared when one of its tags is saved
+or deleted in this process, and again when that change commits, and when its
+version in the Django cache changes, if settings.CACHE is set.
+
+If settings.CACHE is set, tags missing from the process cache are looked up in
+the name cache backend from tagulous.cache, which shares them between
+processes, before the database.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import router, transaction
+from django.db.models import DEFERRED
+
+from .. import settings
+from ..cache import get_name_cache_backend, get_version
+
+# Name caches for each tag model, as {tag_model: ProcessNameCache}
+_name_caches = {}
+
+
+def normalise_name(tag_model, name):
+    """
+    Return the name used to compare tag names in the tag model
+    """
+    if tag_model.tag_options.case_sensitive:
+        return name
+    return name.lower()
+
+
+def has_name_normalised(tag_model):
+    """
+    Return True if the tag model has a name_normalised field
+    """
+    try:
+        tag_model._meta.get_field("name_normalised")
+    except FieldDoesNotExist:
+        return False
+    return True
+
+
+def name_filter(tag_model, name, lookup="exact", prefix=""):
+    """
+    Return a dict of filter arguments to find tags in a tag model by name,
+    matched according to the case_sensitive option
+
+    Arguments:
+        tag_model   The tag model
+        name        The tag name
+        lookup      The lookup: ``exact``, ``startswith`` or ``contains``
+        prefix      Path to the tag model from the model being filtered, eg
+                    ``"tags__"``
+    """
+    if tag_model.tag_options.case_sensitive:
+        return {"%sname__%s" % (prefix, lookup): name}
+
+    if has_name_normalised(tag_model):
+        return {
+            "%sname_normalised__%s" % (prefix, lookup): normalise_name(tag_model, name)
+        }
+    return {"%sname__i%s" % (prefix, lookup): name}
+
+
+def _find_tag(tag_model, name):
+    """
+    Return the tag with a name from the database, or raise DoesNotExist
+    """
+    return tag_model.objects.get(**name_filter(tag_model, name))
+
+
+def _load_row(tag_model, name):
+    """
+    Return the pk, name and protected flag of the tag with a normalised name,
+    from the name cache backend if there is one, otherwise from the database
+    """
+
+    def find_row():
+        tag = _find_tag(tag_model, name)
+        return (tag.pk, tag.name, tag.protected)
+
+    backend = get_name_cache_backend()
+    if backend is None:
+        return find_row()
+    return backend.get_or_load(tag_model, name, find_row)
+
+
+class ProcessNameCache(object):
+    """
+    LRU cache of the rows of a tag model's tags by normalised name
+    """
+
+    def __init__(self, version, size):
+        self.version = version
+        self.size = size
+        self.rows = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        """
+        Return the row for a normalised name, or None if it is not cached
+        """
+        with self.lock:
+            row = self.rows.get(name)
+            if row is not None:
+                self.rows.move_to_end(name)
+        return row
+
+    def set(self, name, row):
+        with self.lock:
+            self.rows[name] = row
+            self.rows.move_to_end(name)
+            while len(self.rows) > self.size:
+                self.rows.popitem(last=False)
+
+
+def _uses_name_cache(tag_model):
+    """
+    Return True if tags in the tag model are looked up through a name cache
+    """
+    return bool(tag_model.tag_options.cache_names) and bool(
+        settings.NAME_CACHE_SIZE or get_name_cache_backend() is not None
+    )
+
+
+def _get_name_cache(tag_model):
+    """
+    Return the process cache for the tag model, or None if it has none
+
+    The cache is rebuilt if the tag model's version or the size setting
+    changes.
+    """
+    size = settings.NAME_CACHE_SIZE
+    if not size:
+        return None
+
+    version = get_version(tag_model)
+    name_cache = _name_caches.get(tag_model)
+    if name_cache is None or name_cache.version != version or name_cache.size != size:
+        name_cache = ProcessNameCache(version, size)
+        _name_caches[tag_model] = name_cache
+    return name_cache
+
+
+def _get_row(tag_model, name):
+    """
+    Return the row of the tag with a normalised name from the name caches, or
+    load it and cache it when the current transaction commits. If the tag is
+    not found, DoesNotExist is raised and nothing is cached.
+    """
+    name_cache = _get_name_cache(tag_model)
+    if name_cache is not None:
+        row = name_cache.get(name)
+        if row is not None:
+            return row
+
+    row = _load_row(tag_model, name)
+    if name_cache is not None:
+
+        def fill():
+            # Skip if the cache was cleared after the row was loaded
+            if _name_caches.get(tag_model) is name_cache:
+                name_cache.set(name, row)
+
+        # A row loaded in a transaction which is rolled back may not exist
+        transaction.on_commit(fill, using=router.db_for_read(tag_model))
+    return row
+
+
+def clear_name_cache(tag_model):
+    """
+    Empty the name cache for a tag model in this process
+    """
+    _name_caches.pop(tag_model, None)
+
+
+def get_tag(tag_model, name):
+    """
+    Return the tag with a name, or raise the tag model's DoesNotExist
+
+    Names are matched according to the case_sensitive option. If the tag model
+    has the cache_names option, the tag may be from the cache with fields
+    other than pk, name and protected deferred.
+    """
+    if not _uses_name_cache(tag_model):
+        return _find_tag(tag_model, name)
+    return _get_cached_tag(tag_model, name)
+
+
+def _get_cached_tag(tag_model, name):
+    pk, tag_name, protected = _get_row(tag_model, normalise_name(tag_model, name))
+    values = {
+        tag_model._meta.pk.attname: pk,
+        "name": tag_name,
+        "protected": protected,
+    }
+
+    # from_db expects a value or DEFERRED for each concrete field, in order
+    fields = tag_model._meta.concrete_fields
+    return tag_model.from_db(
+        router.db_for_read(tag_model),
+        [field.attname for field in fields if field.attname in values],
+        [values.get(field.attname, DEFERRED) for field in fields],
+    )
+
+
+def get_or_create_tag(tag_model, name):
+    """
+    Return the tag with a name, creating it if it does not exist
+    """
+    if _uses_name_cache(tag_model):
+        try:
+            return _get_cached_tag(tag_model, name)
+        except tag_model.DoesNotExist:
+            pass
+
+    tag, __ = tag_model.objects.get_or_create(
+        defaults={"name": name, "protected": False}, **name_filter(tag_model, name)
+    )
+    return tag
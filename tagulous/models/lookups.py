@@ -0,0 +1,279 @@
+"""
+Tag field lookups
+
+These compare tag fields to tag strings in SQL, so unlike the tag string
+arguments handled by TaggedQuerySet they can be used in Q objects, subqueries
+and on querysets which have not been enhanced.
+
+A lookup on a TagField is performed on the join to its through table, so the
+through model's foreign key to the tag model is given the lookups, by creating
+the through model with a TagThroughForeignKey.
+"""
+
+import operator
+from functools import reduce
+
+from django.core.exceptions import EmptyResultSet
+from django.db import models
+from django.db.models.fields.related import lazy_related_operation, resolve_relation
+from django.db.models.lookups import In, IsNull
+from django.db.models.sql.where import OR, WhereNode
+from django.db.models.utils import make_model_tuple
+from django.utils.translation import gettext_lazy as _
+
+from ..utils import parse_tags
+from .lookup import has_name_normalised, normalise_name
+
+
+def tag_ids(tag_model, tags, case_sensitive):
+    """
+    Return a queryset of the pks of the named tags in the tag model
+    """
+    if case_sensitive:
+        q = models.Q(name__in=tags)
+    elif has_name_normalised(tag_model):
+        q = models.Q(
+            name_normalised__in=[normalise_name(tag_model, tag) for tag in tags]
+        )
+    else:
+        q = reduce(operator.or_, (models.Q(name__iexact=tag) for tag in tags))
+    return tag_model._base_manager.filter(q).values("pk")
+
+
+def _compile_in(compiler, col, queryset):
+    """
+    Compile ``col IN (queryset)``, with the queryset as a subquery of the query
+    being compiled
+    """
+    subquery = queryset.query.resolve_expression(query=compiler.query)
+    return compiler.compile(In(col, subquery))
+
+
+class BaseTagLookup(models.Lookup):
+    """
+    Base class for tag lookups, which take a tag string or a list of tags or
+    tag names
+    """
+
+    prepare_rhs = False
+
+    def get_tag_field(self):
+        raise NotImplementedError()  # pragma: no cover
+
+    def get_tag_names(self):
+        tag_options = self.get_tag_field().tag_options
+        if isinstance(self.rhs, str):
+            return parse_tags(self.rhs, space_delimiter=tag_options.space_delimiter)
+        return sorted({str(tag) for tag in self.rhs})
+
+    def get_tag_ids(self, tags):
+        tag_field = self.get_tag_field()
+        return tag_ids(tag_field.tag_model, tags, tag_field.tag_options.case_sensitive)
+
+
+# ##############################################################################
+# ###### TagField lookups
+# ##############################################################################
+
+
+class BaseThroughTagLookup(BaseTagLookup):
+    """
+    Base class for TagField lookups
+
+    The left hand side is a row in the through table; this finds the matching
+    objects with a single grouped subquery on the through table, then only
+    matches one row for each of them so objects are not duplicated.
+    """
+
+    def get_tag_field(self):
+        return self.lhs.output_field.tag_field
+
+    def filter_rows(self, rows, target_name, tags):
+        """
+        Filter the through table rows, grouped by object, to those objects
+        which match the tags
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    def as_sql(self, compiler, connection):
+        tag_fk = self.lhs.output_field
+        through = tag_fk.model
+        source_name = tag_fk.tag_field.m2m_field_name()
+
+        rows = through._base_manager.values(source_name)
+        rows = self.filter_rows(rows, tag_fk.name, self.get_tag_names())
+        rows = rows.annotate(_tagulous_row=models.Min("pk")).values("_tagulous_row")
+
+        col = through._meta.pk.get_col(self.lhs.alias)
+        return _compile_in(compiler, col, rows)
+
+
+class TagAll(BaseThroughTagLookup):
+    """
+    Match objects which have all of the tags
+    """
+
+    lookup_name = "all"
+
+    def filter_rows(self, rows, target_name, tags):
+        if not tags:
+            return rows
+
+        # Names which only differ by case match the same tag, so count them once
+        tag_model = self.get_tag_field().tag_model
+        tag_count = len({normalise_name(tag_model, tag) for tag in tags})
+        return (
+            rows.filter(**{"%s__in" % target_name: self.get_tag_ids(tags)})
+            .annotate(_tagulous_matched=models.Count(target_name, distinct=True))
+            .filter(_tagulous_matched=tag_count)
+        )
+
+
+class TagAny(BaseThroughTagLookup):
+    """
+    Match objects which have any of the tags
+    """
+
+    lookup_name = "any"
+
+    def filter_rows(self, rows, target_name, tags):
+        if not tags:
+            raise EmptyResultSet
+        return rows.filter(**{"%s__in" % target_name: self.get_tag_ids(tags)})
+
+
+class TagNone(BaseThroughTagLookup):
+    """
+    Match objects which have tags, but none of these tags
+    """
+
+    lookup_name = "none"
+
+    def filter_rows(self, rows, target_name, tags):
+        if not tags:
+            return rows
+        return rows.annotate(
+            _tagulous_matched=models.Count(
+                "pk",
+                filter=models.Q(**{"%s__in" % target_name: self.get_tag_ids(tags)}),
+            )
+        ).filter(_tagulous_matched=0)
+
+
+class TagThroughForeignKey(models.ForeignKey):
+    """
+    The foreign key from a TagField's through model to its tag model, with
+    the TagField lookups
+    """
+
+    # The TagField which this is the through foreign key for
+    tag_field = None
+
+
+TagThroughForeignKey.register_lookup(TagAll)
+TagThroughForeignKey.register_lookup(TagAny)
+TagThroughForeignKey.register_lookup(TagNone)
+
+
+def create_through_model(tag_field, cls, name):
+    """
+    Create the through model for a TagField called name on a model
+
+    This is the model Django would auto-create for the TagField, except its
+    foreign key to the tag model is a TagThroughForeignKey, so it has the
+    TagField lookups.
+    """
+
+    def set_managed(model, related, through):
+        through._meta.managed = model._meta.managed or related._meta.managed
+
+    to_model = resolve_relation(cls, tag_field.remote_field.model)
+    through_name = "%s_%s" % (cls._meta.object_name, name)
+    lazy_related_operation(set_managed, cls, to_model, through_name)
+
+    to = make_model_tuple(to_model)[1]
+    from_ = cls._meta.model_name
+    if to == from_:
+        to = "to_%s" % to
+        from_ = "from_%s" % from_
+
+    meta = type(
+        "Meta",
+        (),
+        {
+            "db_table": tag_field._get_m2m_db_table(cls._meta),
+            "auto_created": cls,
+            "app_label": cls._meta.app_label,
+            "db_tablespace": cls._meta.db_tablespace,
+            "unique_together": (from_, to),
+            "verbose_name": _("%(from)s-%(to)s relationship")
+            % {"from": from_, "to": to},
+            "verbose_name_plural": _("%(from)s-%(to)s relationships")
+            % {"from": from_, "to": to},
+            "apps": cls._meta.apps,
+        },
+    )
+    fk_kwargs = {
+        "related_name": "%s+" % through_name,
+        "db_tablespace": tag_field.db_tablespace,
+        "db_constraint": tag_field.remote_field.db_constraint,
+        "on_delete": models.CASCADE,
+    }
+    tag_fk = TagThroughForeignKey(to_model, **fk_kwargs)
+    tag_fk.tag_field = tag_field
+    return type(
+        through_name,
+        (models.Model,),
+        {
+            "Meta": meta,
+            "__module__": cls.__module__,
+            from_: models.ForeignKey(cls, **fk_kwargs),
+            to: tag_fk,
+        },
+    )
+
+
+# ##############################################################################
+# ###### SingleTagField lookups
+# ##############################################################################
+
+
+class BaseSingleTagLookup(BaseTagLookup):
+    """
+    Base class for SingleTagField lookups
+    """
+
+    def get_tag_field(self):
+        return self.lhs.output_field
+
+
+class SingleTagAny(BaseSingleTagLookup):
+    """
+    Match objects whose tag is one of the tags
+    """
+
+    lookup_name = "any"
+
+    def as_sql(self, compiler, connection):
+        tags = self.get_tag_names()
+        if not tags:
+            raise EmptyResultSet
+        return _compile_in(compiler, self.lhs, self.get_tag_ids(tags))
+
+
+class SingleTagNone(BaseSingleTagLookup):
+    """
+    Match objects whose tag is not one of the tags, or which have no tag
+    """
+
+    lookup_name = "none"
+
+    def as_sql(self, compiler, connection):
+        tags = self.get_tag_names()
+        if not tags:
+            where = WhereNode([IsNull(self.lhs, True), IsNull(self.lhs, False)], OR)
+            return compiler.compile(where)
+
+        subquery = self.get_tag_ids(tags).query.resolve_expression(query=compiler.query)
+        not_in = WhereNode([In(self.lhs, subquery)], negated=True)
+        return compiler.compile(WhereNode([IsNull(self.lhs, True), not_in], OR))
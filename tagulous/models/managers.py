@@ -10,11 +10,20 @@ For tag model manager, look in tagulous.models.models
 from django.core import exceptions
 
 from ..utils import parse_tags, render_tags
+from .cooccurrence import is_tracked, update_cooccurrence
+from .counts import change_counts, get_scope
+from .lookup import get_or_create_tag, get_tag
+from .similar import is_precomputed, update_similar
+from .usage import is_tracked as is_usage_tracked
+from .usage import record_usage
 
 # ##############################################################################
 # ###### Manager for SingleTagField
 # ##############################################################################
 
+# Marker for a SingleTagManager which has not loaded its actual value yet
+_NOT_LOADED = object()
+
 
 class SingleTagManager(object):
     """
@@ -25,31 +34,60 @@ class SingleTagManager(object):
     passing them up to the normal FK descriptor on the pre-save signal.
     """
 
+    __slots__ = (
+        "descriptor",
+        "instance",
+        "changed",
+        "tag_cache",
+        "_tag_name",
+        "added_tag",
+        "removed_tag",
+    )
+
     def __init__(self, descriptor, instance):
         # The SingleTagDescriptor and instance this manages
         self.descriptor = descriptor
         self.instance = instance
 
-        # Other vars we need
-        self.tag_model = self.descriptor.tag_model
-        self.field = self.descriptor.field
-        self.tag_options = self.descriptor.tag_options
-
         # Keep track of unsaved changes
         self.changed = False
 
-        # The descriptor stores an unsaved tag string
-        # Load the actual value into the cache, if it exists
+        # The actual value is loaded into the cache on demand by _load_actual
+        self.tag_cache = None
+        self._tag_name = _NOT_LOADED
+
+        # Pre/post save will need to keep track of the new and old tags
+        self.added_tag = None
+        self.removed_tag = None
+
+    # Other vars we need
+    tag_model = property(lambda self: self.descriptor.tag_model)
+    field = property(lambda self: self.descriptor.field)
+    tag_options = property(lambda self: self.descriptor.tag_options)
+
+    def _load_actual(self):
+        """
+        Load the actual value into the cache, and start off the local tag name
+        with the actual tag name
+        """
         # If there is a problem with the actual value, get_actual will fall
         # back to our cache, so make sure it exists first
         self.tag_cache = None
         self.tag_cache = self.get_actual()
+        self._tag_name = self.tag_cache.name if self.tag_cache else None
 
-        # Start off the local tag name with the actual tag name
-        self.tag_name = self.tag_cache.name if self.tag_cache else None
+    @property
+    def tag_name(self):
+        """
+        The local tag name, which starts off as the actual tag name
+        """
+        if self._tag_name is _NOT_LOADED:
+            self._load_actual()
+        return self._tag_name
 
-        # Pre/post save will need to keep track of an old tag
-        self.removed_tag = None
+    @tag_name.setter
+    def tag_name(self, value):
+        self._tag_name = value
 
     def flush_cache(self):
         """
@@ -95,6 +133,12 @@ class SingleTagManager(object):
             # lose anything since we keep our own cache, and pre-save will fill
             # it out in time anyway.
             self.flush_cache()
+
+            # While unchanged, this is also the value to fall back to
+            if not self.changed:
+                self.tag_cache = value
+                if self._tag_name is _NOT_LOADED:
+                    self._tag_name = value.name if value else None
             return value
         return None
 
@@ -120,21 +164,36 @@ class SingleTagManager(object):
             if not self.tag_name:
                 return None
 
+            # The cache is cleared when the tag name changes, so if it holds a
+            # tag from the database it is the one we want
+            if self.tag_cache is not None and self.tag_cache.pk is not None:
+                return self.tag_cache
+
             # Try to look up the tag
             try:
-                if self.tag_options.case_sensitive:
-                    tag = self.tag_model.objects.get(name=self.tag_name)
-                else:
-                    tag = self.tag_model.objects.get(name__iexact=self.tag_name)
+                tag = get_tag(self.tag_model, self.tag_name)
             except self.tag_model.DoesNotExist:
                 # Does not exist yet, create a temporary one (but don't save)
                 if not self.tag_cache:
                     self.tag_cache = self.tag_model(name=self.tag_name, protected=False)
                 tag = self.tag_cache
+            else:
+                self.tag_cache = tag
             return tag
-        else:
-            # Return the response that it should have had (a Tag or None)
-            return self.get_actual()
+
+        # If the cache holds the actual value, use it
+        if self._tag_name is not _NOT_LOADED:
+            attname = self.field.attname
+            if attname in self.instance.__dict__:
+                pk = self.instance.__dict__[attname]
+                if self.tag_cache is None:
+                    if pk is None:
+                        return None
+                elif self.tag_cache.pk == pk:
+                    return self.tag_cache
+
+        # Return the response that it should have had (a Tag or None)
+        return self.get_actual()
 
     def set(self, value):
         """
@@ -166,8 +225,15 @@ class SingleTagManager(object):
         """
         When the model is about to save, update the tag value
         """
-        # Get the new tag
-        new_tag = self.get()
+        # Get the new tag. If changed, look it up again in case the tag cached
+        # by get() has since been deleted. If unchanged, check the actual tag
+        # still exists
+        if self.changed:
+            if self.tag_cache is not None and self.tag_cache.pk is not None:
+                self.tag_cache = None
+            new_tag = self.get()
+        else:
+            new_tag = self.get_actual()
 
         # Logic check to replace standard null/blank model field validation
         if not new_tag and self.field.required:
@@ -180,14 +246,11 @@ class SingleTagManager(object):
         # Store the old tag so we know to decrement it in post_save
         self.removed_tag = self.get_actual()
 
-        # Create or increment the tag object
-        if new_tag:
-            # Ensure it is in the database
-            if not new_tag.pk:
-                new_tag.save()
-
-            # Increment the new tag
-            new_tag.increment()
+        # Ensure the new tag is in the database, and store it so we know to
+        # increment it in post_save
+        if new_tag and not new_tag.pk:
+            new_tag.save()
+        self.added_tag = new_tag
 
         # Set it
         self.set_actual(new_tag)
@@ -197,10 +260,23 @@ class SingleTagManager(object):
 
     def post_save_handler(self):
         """
-        When the model has saved, decrement the old tag
+        When the model has saved, increment the new tag and decrement the old
+        tag in a single update
         """
+        changes = []
+        if self.added_tag:
+            changes.append((self.added_tag, 1))
         if self.removed_tag:
-            self.removed_tag.decrement()
+            changes.append((self.removed_tag, -1))
+        self.added_tag = None
+        self.removed_tag = None
+
+        if changes:
+            if is_usage_tracked(self.tag_model):
+                record_usage(self.tag_model, changes)
+            change_counts(
+                self.tag_model, changes, scope=get_scope(self.tag_model, self.instance)
+            )
 
     def post_delete_handler(self):
         """
@@ -213,7 +289,13 @@ class SingleTagManager(object):
 
         # Try to update the old tag
         try:
-            old_tag.decrement()
+            if is_usage_tracked(self.tag_model):
+                record_usage(self.tag_model, [(old_tag, -1)])
+            change_counts(
+                self.tag_model,
+                [(old_tag, -1)],
+                scope=get_scope(self.tag_model, self.instance),
+            )
         except type(old_tag).DoesNotExist:
             # The tag was just deleted along with the model in the same operation - most
             # likely a cascade delete originated on the tag model
@@ -260,6 +342,7 @@ class BaseTagRelatedManager(object):
         """
         Called directly after the mixin is added to the instantiated manager
         """
+        self.tag_field = descriptor.field
         self.tag_model = descriptor.tag_model
         self.tag_options = descriptor.tag_options
 
@@ -422,10 +505,7 @@ class BaseTagRelatedManager(object):
         for tag_name in cmp_new_names.values():
             # Find or create all new tags
             try:
-                if self.tag_options.case_sensitive:
-                    tag = self.tag_model.objects.get(name=tag_name)
-                else:
-                    tag = self.tag_model.objects.get(name__iexact=tag_name)
+                tag = get_tag(self.tag_model, tag_name)
             except self.tag_model.DoesNotExist:
                 # Don't create it until it's saved
                 tag = self.tag_model(name=tag_name, protected=False)
@@ -537,18 +617,23 @@ class TagRelatedManagerMixin(BaseTagRelatedManager):
         # Add and remove tags as necessary
         new_tags = self._ensure_tags_in_db(self.tags)
         self.reload()
-
-        # Add new tags
-        for new_tag in new_tags:
-            if new_tag not in self.tags:
-                self.add(new_tag, _enforce_max_count=False)
-
-        # Remove old tags
-        for old_tag in self.tags:
-            if old_tag not in new_tags:
-                self.remove(old_tag)
+        add_tags = [tag for tag in new_tags if tag not in self.tags]
+        rm_tags = [tag for tag in self.tags if tag not in new_tags]
+
+        # Change the db, then update counts together
+        if add_tags:
+            super(TagRelatedManagerMixin, self).add(*add_tags)
+        if rm_tags:
+            super(TagRelatedManagerMixin, self).remove(*rm_tags)
         self.tags = new_tags
         self.changed = False
+        if add_tags or rm_tags:
+            self._tags_changed(add_tags, rm_tags)
+        change_counts(
+            self.tag_model,
+            [(tag, 1) for tag in add_tags] + [(tag, -1) for tag in rm_tags],
+            scope=get_scope(self.tag_model, self.instance),
+        )
 
     save.alters_data = True
 
@@ -563,13 +648,7 @@ class TagRelatedManagerMixin(BaseTagRelatedManager):
                 db_tag = tag
             else:
                 # Not in DB - get or create
-                field_lookup = "name"
-                if not self.tag_options.case_sensitive:
-                    field_lookup += "__iexact"
-                db_tag, __ = self.tag_model.objects.get_or_create(
-                    defaults={"name": tag.name, "protected": False},
-                    **{field_lookup: tag.name},
-                )
+                db_tag = get_or_create_tag(self.tag_model, tag.name)
             db_tags.append(db_tag)
         return db_tags
 
@@ -618,9 +697,14 @@ class TagRelatedManagerMixin(BaseTagRelatedManager):
 
         # Add to db, add to cache, and increment
         super(TagRelatedManagerMixin, self).add(*new_tags)
-        for tag in new_tags:
-            self.tags.append(tag)
-            tag.increment()
+        self.tags.extend(new_tags)
+        if new_tags:
+            self._tags_changed(new_tags, [])
+        change_counts(
+            self.tag_model,
+            [(tag, 1) for tag in new_tags],
+            scope=get_scope(self.tag_model, self.instance),
+        )
 
     add.alters_data = True
 
@@ -630,9 +714,12 @@ class TagRelatedManagerMixin(BaseTagRelatedManager):
         for tag in objs:
             if isinstance(tag, str):
                 try:
-                    rm_tags.append(self.tag_model.objects.get(name=tag))
+                    rm_tag = get_tag(self.tag_model, tag)
                 except self.tag_model.DoesNotExist:
                     continue
+                # Only remove tags with exactly this name
+                if rm_tag.name == tag:
+                    rm_tags.append(rm_tag)
             else:
                 rm_tags.append(tag)
 
@@ -647,8 +734,13 @@ class TagRelatedManagerMixin(BaseTagRelatedManager):
 
         # Remove from db and decrement
         super(TagRelatedManagerMixin, self).remove(*self._ensure_tags_in_db(rm_tags))
-        for tag in rm_tags:
-            tag.decrement()
+        if rm_tags:
+            self._tags_changed([], rm_tags)
+        change_counts(
+            self.tag_model,
+            [(tag, -1) for tag in rm_tags],
+            scope=get_scope(self.tag_model, self.instance),
+        )
 
     remove.alters_data = True
 
@@ -658,13 +750,35 @@ class TagRelatedManagerMixin(BaseTagRelatedManager):
 
         # Clear db, then decrement and empty cache
         super(TagRelatedManagerMixin, self).clear()
-        for tag in self.tags:
-            tag.decrement()
+        rm_tags = self.tags
         self.tags = []
+        if rm_tags:
+            self._tags_changed([], rm_tags)
+        change_counts(
+            self.tag_model,
+            [(tag, -1) for tag in rm_tags],
+            scope=get_scope(self.tag_model, self.instance),
+        )
 
     clear.alters_data = True
 
-    def get_similar_objects(self):
+    def _tags_changed(self, added, removed):
+        """
+        Update stored similar objects, tag co-occurrence and tag usage after
+        tags have been added to or removed from the database, before their
+        counts change and any unused tags are deleted
+        """
+        if is_precomputed(self.tag_field):
+            update_similar(self.tag_field, self.instance.pk)
+        if is_tracked(self.tag_model):
+            update_cooccurrence(self.tag_model, self.tags, added, removed)
+        if is_usage_tracked(self.tag_model):
+            record_usage(
+                self.tag_model,
+                [(tag, 1) for tag in added] + [(tag, -1) for tag in removed],
+            )
+
+    def get_similar_objects(self, **kwargs):
         """
         Find similarly tagged objects
 
@@ -678,6 +792,27 @@ class TagRelatedManagerMixin(BaseTagRelatedManager):
         """
         tagged_model = self.source_field.related_model
         similar = tagged_model.objects.similarly_tagged(
-            self.instance, field_name=self.prefetch_cache_name
+            self.instance, field_name=self.prefetch_cache_name, **kwargs
         )
         return similar
+
+
+# TagRelatedManager classes, keyed by the RelatedManager class they extend
+_tag_related_manager_classes = {}
+
+
+def get_tag_related_manager_class(manager_cls):
+    """
+    Get a subclass of TagRelatedManagerMixin and the RelatedManager class
+    manager_cls, creating it the first time it is needed.
+    """
+    try:
+        return _tag_related_manager_classes[manager_cls]
+    except KeyError:
+        pass
+
+    tag_manager_cls = type(
+        str("TagRelatedManager"), (TagRelatedManagerMixin, manager_cls), {}
+    )
+    _tag_related_manager_classes[manager_cls] = tag_manager_cls
+    return tag_manager_cls
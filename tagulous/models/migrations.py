@@ -2,8 +2,9 @@
 Migration support for Django migrations
 """
 
-from django.db import migrations
+from django.db import migrations, models
 
+from .. import settings
 from .models import BaseTagModel, BaseTagTreeModel
 
 # ##############################################################################
@@ -168,3 +169,56 @@ def add_unique_field(model_name, name, field, preserve_default, set_fn):
             preserve_default=preserve_default,
         ),
     ]
+
+
+def add_name_normalised(model_name, case_sensitive=False, max_length=None):
+    """
+    Helper for Django migrations which returns a list of Operations to add the
+    ``name_normalised`` field to an existing tag model with the
+    ``name_normalised`` option, and fill it from the tag names.
+
+    Create a migration, then find the ``name_normalised`` field in it and
+    replace it with a call to this function:
+
+        operations = [
+            migrations.AddField(
+                model_name='tagulous_mymodel_tags',
+                name='name_normalised',
+                field=models.CharField(editable=False, max_length=255, unique=True),
+                preserve_default=False,
+            ),
+        ]
+
+    becomes:
+
+        operations = tagulous.models.migrations.add_name_normalised(
+            model_name='tagulous_mymodel_tags',
+        )
+
+    Migrating will fail if there are tags whose names differ only by case;
+    merge them first.
+
+    Arguments:
+        model_name      As django defines
+        case_sensitive  The tag model's case_sensitive option
+        max_length      The max_length of the tag model's name field, if not
+                        settings.NAME_MAX_LENGTH
+    """
+
+    def set_name_normalised(obj):
+        if case_sensitive:
+            obj.name_normalised = obj.name
+        else:
+            obj.name_normalised = obj.name.lower()
+
+    return add_unique_field(
+        model_name=model_name,
+        name="name_normalised",
+        field=models.CharField(
+            unique=True,
+            max_length=max_length or settings.NAME_MAX_LENGTH,
+            editable=False,
+        ),
+        preserve_default=False,
+        set_fn=set_name_normalised,
+    )
@@ -2,13 +2,23 @@
 Tagulous tag models
 """
 
+import math
+
 from django.db import IntegrityError, models, router, transaction
 from django.db.models import F, Max
-from django.db.models.functions import Floor
+from django.db.models.functions import Cast, Floor, Greatest, Length, Ln
 from django.utils.text import slugify
 
 from .. import constants, settings, utils
+from ..cache import get_cache, make_key
+from .cooccurrence import get_related_tags
+from .counts import change_counts, discard_counts, get_scoped_counts
+from .lookup import has_name_normalised, normalise_name
 from .options import TagOptions
+from .usage import get_trend
+
+# Number of numbered slugs to try when a tag's slug is not unique
+SLUG_UNIQUE_ATTEMPTS = 10
 
 # ##############################################################################
 # ###### TagModel manager and queryset
@@ -16,6 +26,15 @@ from .options import TagOptions
 
 
 class TagModelQuerySet(models.query.QuerySet):
+    # Scope value set by scoped(), or None for global counts. Set on the
+    # instance and copied by _clone().
+    _tagulous_scope = None
+
+    def _clone(self, *args, **kwargs):
+        qs = super(TagModelQuerySet, self)._clone(*args, **kwargs)
+        qs._tagulous_scope = self._tagulous_scope
+        return qs
+
     def initial(self):
         """
         Reduce the queryset to only include initial tags left in the queryset
@@ -35,22 +54,104 @@ class TagModelQuerySet(models.query.QuerySet):
             | models.Q(name__in=self.model.tag_options.initial)
         )
 
-    def weight(self, min=settings.WEIGHT_MIN, max=settings.WEIGHT_MAX):
+    def trending(self, window=86400):
+        """
+        Reduce the queryset to tags used more than they were removed in the
+        recent window, annotated with that change as ``trend``, and order them
+        by it with the greatest first. The tag model must have the track_usage
+        option.
+
+        Arguments:
+            window      The window as a timedelta or number of seconds
+        """
+        pks, trend = get_trend(self.model, window)
+        return self.filter(pk__in=pks).annotate(trend=trend).order_by("-trend", "name")
+
+    def scoped(self, scope):
+        """
+        Reduce the queryset to tags used by objects in the scope, and annotate
+        their counts in the scope as ``scope_count``. The tag model must have
+        the count_scope_field option; the scope is a value of that field.
+
+        weight() will then use the counts in the scope.
+        """
+        scoped_counts = (
+            get_scoped_counts(self.model, scope)
+            .filter(tag_pk=Cast(models.OuterRef("pk"), models.CharField()))
+            .values("count")[:1]
+        )
+        qs = self.annotate(
+            scope_count=models.Subquery(
+                scoped_counts, output_field=models.IntegerField()
+            )
+        ).filter(scope_count__gt=0)
+        qs._tagulous_scope = str(scope)
+        return qs
+
+    def weight(
+        self,
+        min=settings.WEIGHT_MIN,
+        max=settings.WEIGHT_MAX,
+        scale="linear",
+        scope=None,
+    ):
         """
         Add a ``weight`` integer field to objects, weighting the ``count``
         between ``min`` and ``max``.
 
         Suitable for use with a tag cloud
+
+        Arguments:
+            min, max    Bounds of the weight
+            scale       ``linear`` to weight by count, or ``log`` to weight by
+                        the log of the count, so a few popular tags don't
+                        leave the rest at ``min``
+            scope       ``None`` to scale to the highest count in the tag
+                        model, or ``queryset`` to scale to the highest count
+                        in this queryset
+
+        If the queryset is from scoped(), the counts in that scope are used.
         """
         # Ignoring PEP 8 intentionally regarding conflict of min/max keywords -
         # concerns are outweighed by clarity of function argument names.
+        if scale not in constants.WEIGHT_SCALES:
+            raise ValueError("Unknown weight scale %r" % scale)
+        if scope not in (None, "queryset"):
+            raise ValueError("Unknown weight scope %r" % scope)
 
         # Weight is the count scaled to the min/max bounds
         # weight = ( (count * (max - min)) / max_count ) + min
-        scale = int(max) - int(min)
-        max_count = self.model.objects.aggregate(Max("count"))["count__max"] or 1
-        qs = self.annotate(weight=(Floor(F("count") * scale) / max_count) + int(min))
-        return qs
+        spread = int(max) - int(min)
+        count_name = "count" if self._tagulous_scope is None else "scope_count"
+        if scope == "queryset":
+            # Find the max count over the same rows in the same query
+            max_count = Greatest(models.Window(expression=Max(count_name)), 1)
+        elif self._tagulous_scope is not None:
+            max_count = (
+                get_scoped_counts(self.model, self._tagulous_scope).aggregate(
+                    Max("count")
+                )["count__max"]
+                or 1
+            )
+        else:
+            max_count = self.model.get_max_count() or 1
+
+        if scale == "linear":
+            return self.annotate(
+                weight=(Floor(F(count_name) * spread) / max_count) + int(min)
+            )
+
+        # weight = ( (ln(count + 1) * (max - min)) / ln(max_count + 1) ) + min
+        if scope == "queryset":
+            max_log = Ln(max_count + 1)
+        else:
+            max_log = models.Value(math.log(max_count + 1))
+        return self.annotate(
+            weight=Cast(
+                Floor(Ln(F(count_name) + 1) * spread / max_log), models.IntegerField()
+            )
+            + int(min)
+        )
 
     def __str__(self):
         return utils.render_tags(self)
@@ -109,6 +210,22 @@ class TagModelBase(models.base.ModelBase):
         # Assign
         new_cls.tag_options = new_tag_options
 
+        # Add the normalised name field if needed; migrations will already
+        # have it in their model state
+        if (
+            new_tag_options.name_normalised
+            and not new_cls._meta.abstract
+            and not has_name_normalised(new_cls)
+        ):
+            new_cls.add_to_class(
+                "name_normalised",
+                models.CharField(
+                    unique=True,
+                    max_length=new_cls._meta.get_field("name").max_length,
+                    editable=False,
+                ),
+            )
+
         # Check for self-referential tag fields on this model
         fields = new_cls._meta.fields + new_cls._meta.many_to_many
 
@@ -155,6 +272,14 @@ class BaseTagModel(models.Model, metaclass=TagModelBase):
 
     __hash__ = models.Model.__hash__
 
+    def __getstate__(self):
+        """
+        Don't pickle the tagged instance this tag was retrieved from
+        """
+        state = super().__getstate__()
+        state.pop("_tagulous_source", None)
+        return state
+
     def __ne__(self, obj):
         return not self == obj
 
@@ -243,11 +368,58 @@ class BaseTagModel(models.Model, metaclass=TagModelBase):
             data = list(set(data))
         return data
 
+    def get_similar_objects(self):
+        """
+        Get a queryset of other objects which have this tag in the
+        SingleTagField this tag was retrieved from
+
+        Only available on a tag retrieved from a SingleTagField on an instance.
+        """
+        source = getattr(self, "_tagulous_source", None)
+        if source is None:
+            raise AttributeError(
+                "get_similar_objects() is only available on a tag retrieved "
+                "from a SingleTagField"
+            )
+        field = source.field
+        return field.model.objects.exclude(pk=source.instance.pk).filter(
+            **{field.name: self}
+        )
+
+    @classmethod
+    def get_max_count(cls):
+        """
+        Return the highest count in the tag model, or None if there are no tags
+
+        Cached in settings.TAGULOUS_CACHE if set, until a count changes.
+        """
+        key = make_key(cls, "counts", "max_count")
+        if key is None:
+            return cls.objects.aggregate(Max("count"))["count__max"]
+
+        cache = get_cache()
+        max_count = cache.get(key)
+        if max_count is None:
+            max_count = cls.objects.aggregate(Max("count"))["count__max"] or 0
+            cache.set(key, max_count)
+        return max_count or None
+
+    def get_related_tags(self, limit=None):
+        """
+        Get a queryset of the tags which are most often used with this tag in
+        TagFields, annotated with the number of objects which have both as
+        ``tagulous_cooccurrence``, most first
+
+        Uses stored counts if the tag model has the track_cooccurrence option.
+        """
+        return get_related_tags(self, limit=limit)
+
     def update_count(self):
         """
         Count how many SingleTagFields and TagFields refer to this tag, save,
         and try to delete.
         """
+        discard_counts(self)
         self.count = len(self.get_related_objects(flat=True))
         self.save()
         self.try_delete()
@@ -272,18 +444,9 @@ class BaseTagModel(models.Model, metaclass=TagModelBase):
 
     def _change_count(self, amount):
         """
-        Change count by amount
+        Change count by amount, then try to delete
         """
-        self.__class__.objects.filter(pk=self.pk).update(
-            count=models.F("count") + amount
-        )
-
-        # Reload count
-        # Use DB for write because we just updated the value
-        using = router.db_for_write(self.tag_model, instance=self)
-        self.refresh_from_db(using=using)
-
-        self.try_delete()
+        change_counts(self.__class__, [(self, amount)])
 
     def try_delete(self):
         """
@@ -384,11 +547,17 @@ class BaseTagModel(models.Model, metaclass=TagModelBase):
         """
         Automatically generate a unique slug, if one does not exist
         """
-        # Based on django-taggit: don't worry about race conditions when
-        # setting names and slugs, just avoid potential slugify clashes.
-        # We could improve this if race conditions are ever a problem in the
-        # real world, but until Django provides a reliable way to determine
-        # the cause of an IntegrityError, we can never make this perfect.
+        # Based on django-taggit: try the slug, and if it clashes append a
+        # number. Django can't tell us the cause of an IntegrityError, so check
+        # the slug really is taken before trying numbers, and retry if another
+        # process takes the number first.
+
+        # Keep the normalised name in step with the name
+        if has_name_normalised(self.__class__):
+            self.name_normalised = normalise_name(self.__class__, self.name)
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None and "name" in update_fields:
+                kwargs["update_fields"] = list(update_fields) + ["name_normalised"]
 
         # If already in the database and has a slug set, just save as normal
         # Set slug to None to rebuild it
@@ -424,27 +593,53 @@ class BaseTagModel(models.Model, metaclass=TagModelBase):
             # If transaction supports atomic, we need to wrap the save call -
             # otherwise if save throws an exception it'll cause any current
             # queries to roll back
-            with transaction.atomic():
+            with transaction.atomic(using=kwargs["using"]):
                 return super(BaseTagModel, self).save(*args, **kwargs)
-        except IntegrityError:
-            pass
+        except IntegrityError as e:
+            error = e
 
         # Integrity error - something is probably not unique.
-        # Assume it was the slug - make it unique by appending a number.
-        # See which numbers have been used
+        # If it was the slug, make it unique by appending the next number. Another
+        # process may take the same number first, so try again with the next.
         slug_base = slug_base[: slug_max_length - settings.SLUG_TRUNCATE_UNIQUE]
-        based_objects = cls.objects.filter(slug__regex="^%s_[0-9]+$" % slug_base)
-        based_slugs = list(based_objects.values_list("slug", flat=True))
-        if len(based_slugs) == 0:
-            # No numbered version of the slug exists
-            number = 1
-        else:
-            numbers = [int(slug.rsplit("_", 1)[1]) for slug in based_slugs]
-            number = sorted(numbers)[-1] + 1
-
-        self.slug = "%s_%d" % (slug_base, number)
-        self._update_extra()
-        return super(BaseTagModel, self).save(*args, **kwargs)
+        for __ in range(SLUG_UNIQUE_ATTEMPTS):
+            clashes = cls.objects.using(kwargs["using"]).filter(slug=self.slug)
+            if self.pk is not None:
+                clashes = clashes.exclude(pk=self.pk)
+            if not clashes.exists():
+                # Something else is not unique
+                raise error
+
+            self.slug = "%s_%d" % (
+                slug_base,
+                self._next_slug_number(slug_base, kwargs["using"]),
+            )
+            self._update_extra()
+            try:
+                with transaction.atomic(using=kwargs["using"]):
+                    return super(BaseTagModel, self).save(*args, **kwargs)
+            except IntegrityError as e:
+                error = e
+        raise error
+
+    def _next_slug_number(self, slug_base, using):
+        """
+        Return the number after the highest number used to make a slug unique
+        """
+        # Find slugs with the prefix using the slug index, longest first so the
+        # first numbered slug has the highest number
+        prefix = "%s_" % slug_base
+        slugs = (
+            self.__class__.objects.using(using)
+            .filter(slug__startswith=prefix)
+            .order_by(Length("slug").desc(), "-slug")
+            .values_list("slug", flat=True)
+        )
+        for slug in slugs.iterator():
+            suffix = slug[len(prefix) :]
+            if suffix.isascii() and suffix.isdigit():
+                return int(suffix) + 1
+        return 1
 
     save.alters_data = True
 
@@ -0,0 +1,283 @@
+"""
+Similar objects
+
+Objects are similar when they share tags in a TagField. Similarity is found
+from the field's through table, filtered to the tags of the object and grouped
+by the other objects, and scored by get_score().
+
+If a TagField's tag model has the precompute_similar option, that many of each
+object's most similar objects are stored in tagulous.contrib.similar, and
+updated by update_similar() when the object's tags change.
+"""
+
+from django.apps import apps
+from django.db import models
+from django.db.models.functions import Cast, Ln
+
+from ..cache import get_cache, make_key
+
+
+def _get_similar_model():
+    return apps.get_model("tagulous_similar", "SimilarObject")
+
+
+def _get_label(tag_field):
+    return "%s.%s" % (tag_field.model._meta.label, tag_field.name)
+
+
+def is_precomputed(tag_field):
+    """
+    Return True if the most similar objects for the TagField are stored
+    """
+    return bool(tag_field.tag_options.precompute_similar) and apps.is_installed(
+        "tagulous.contrib.similar"
+    )
+
+
+def get_tag_ids(tag_field, pk):
+    """
+    Return a queryset of the pks of the tags an object has in a TagField
+    """
+    through = tag_field.remote_field.through
+    return through._base_manager.filter(**{tag_field.m2m_field_name(): pk}).values(
+        tag_field.m2m_reverse_field_name()
+    )
+
+
+def get_similarity(tag_field, pk):
+    """
+    Return a values queryset of rows of the TagField's through table for the
+    objects which share tags with the object, grouped by object and annotated
+    with tagulous_similarity, the number of tags they share.
+
+    The rows are keyed by the through table's foreign key to the tagged model,
+    tag_field.m2m_field_name().
+    """
+    through = tag_field.remote_field.through
+    source_name = tag_field.m2m_field_name()
+    return (
+        through._base_manager.filter(
+            **{
+                "%s__in" % tag_field.m2m_reverse_field_name(): get_tag_ids(
+                    tag_field, pk
+                )
+            }
+        )
+        .exclude(**{source_name: pk})
+        .order_by()
+        .values(source_name)
+        .annotate(tagulous_similarity=models.Count("pk"))
+    )
+
+
+def get_total(tag_field):
+    """
+    Return the number of objects in the TagField's model
+
+    Cached in settings.TAGULOUS_CACHE if set, until an object with a TagField
+    to the tag model is created or deleted.
+    """
+    key = make_key(tag_field.related_model, "objects", "total", _get_label(tag_field))
+    if key is None:
+        return tag_field.model._base_manager.count()
+
+    cache = get_cache()
+    total = cache.get(key)
+    if total is None:
+        total = tag_field.model._base_manager.count()
+        cache.set(key, total)
+    return total
+
+
+def get_score(tag_field, pk, score):
+    """
+    Return an aggregate expression for the similarity of objects to an object,
+    to annotate a queryset of the tagged model which has been filtered to the
+    object's tags
+
+    Arguments:
+        tag_field   The TagField
+        pk          The pk of the object
+        score       How to score similarity:
+                    ``overlap``     Number of shared tags
+                    ``idf``         Sum of the inverse document frequency of
+                                    shared tags, using the tag counts, so
+                                    common tags score less
+                    ``jaccard``     Number of shared tags over the number of
+                                    tags either object has, from 0 to 1
+    """
+    name = tag_field.name
+    if score == "overlap":
+        return models.Count(name)
+
+    if score == "idf":
+        total = get_total(tag_field)
+        return models.Sum(
+            Ln(models.Value(total + 1.0) / (models.F("%s__count" % name) + 1)),
+            output_field=models.FloatField(),
+        )
+
+    if score == "jaccard":
+        through = tag_field.remote_field.through
+        source_name = tag_field.m2m_field_name()
+        num_tags = get_tag_ids(tag_field, pk).count()
+        other_num_tags = models.Subquery(
+            through._base_manager.filter(**{source_name: models.OuterRef("pk")})
+            .order_by()
+            .values(source_name)
+            .annotate(num=models.Count("pk"))
+            .values("num"),
+            output_field=models.IntegerField(),
+        )
+        shared = models.Count(name)
+        return Cast(shared, models.FloatField()) / (
+            models.Value(num_tags) + other_num_tags - shared
+        )
+
+    raise ValueError("Unknown similarity score %r" % score)
+
+
+def _get_most_similar(tag_field, pk, limit):
+    """
+    Return a dict of {str(pk): similarity} of the most similar objects
+    """
+    source_name = tag_field.m2m_field_name()
+    return {
+        str(similar_pk): similarity
+        for similar_pk, similarity in get_similarity(tag_field, pk)
+        .order_by("-tagulous_similarity", source_name)
+        .values_list(source_name, "tagulous_similarity")[:limit]
+    }
+
+
+def get_similar(tag_field, pk, limit):
+    """
+    Return a list of (pk, similarity) pairs of the precomputed most similar
+    objects to an object, most similar first
+    """
+    to_python = tag_field.model._meta.pk.to_python
+    return [
+        (to_python(similar_pk), similarity)
+        for similar_pk, similarity in _get_similar_model()
+        ._base_manager.filter(field=_get_label(tag_field), object_pk=str(pk))
+        .order_by("-similarity", "pk")
+        .values_list("similar_pk", "similarity")[:limit]
+    ]
+
+
+def _save_similar(tag_field, pk):
+    """
+    Replace the stored most similar objects for an object
+
+    Returns a dict of {str(pk): similarity} of the most similar objects
+    """
+    similar_model = _get_similar_model()
+    label = _get_label(tag_field)
+    object_pk = str(pk)
+    most_similar = _get_most_similar(
+        tag_field, pk, tag_field.tag_options.precompute_similar
+    )
+    similar_model._base_manager.filter(field=label, object_pk=object_pk).delete()
+    similar_model._base_manager.bulk_create(
+        [
+            similar_model(
+                field=label,
+                object_pk=object_pk,
+                similar_pk=similar_pk,
+                similarity=similarity,
+            )
+            for similar_pk, similarity in most_similar.items()
+        ]
+    )
+    return most_similar
+
+
+def update_similar(tag_field, pk):
+    """
+    Update the stored most similar objects for an object whose tags have
+    changed, and its similarity in the stored objects of others.
+
+    Others are only given this object if it is in their most similar objects;
+    those which lose it, or where it is less similar than the rest of theirs,
+    are left with fewer until rebuild_similar() is next run.
+    """
+    similar_model = _get_similar_model()
+    source_name = tag_field.m2m_field_name()
+    label = _get_label(tag_field)
+    object_pk = str(pk)
+    limit = tag_field.tag_options.precompute_similar
+
+    most_similar = _save_similar(tag_field, pk)
+
+    # Update others which have this object, removing it if no longer similar
+    others = similar_model._base_manager.filter(field=label, similar_pk=object_pk)
+    other_pks = set(others.values_list("object_pk", flat=True))
+    scores = {
+        str(other_pk): similarity
+        for other_pk, similarity in get_similarity(tag_field, pk)
+        .filter(**{"%s__in" % source_name: list(other_pks)})
+        .values_list(source_name, "tagulous_similarity")
+    }
+    others.exclude(object_pk__in=list(scores)).delete()
+    pks_by_score = {}
+    for other_pk, similarity in scores.items():
+        pks_by_score.setdefault(similarity, []).append(other_pk)
+    for similarity, pks in pks_by_score.items():
+        others.filter(object_pk__in=pks).update(similarity=similarity)
+
+    # Add this object to the most similar objects which don't have it yet
+    new_pks = [other_pk for other_pk in most_similar if other_pk not in other_pks]
+    if not new_pks:
+        return
+    similar_model._base_manager.bulk_create(
+        [
+            similar_model(
+                field=label,
+                object_pk=other_pk,
+                similar_pk=object_pk,
+                similarity=most_similar[other_pk],
+            )
+            for other_pk in new_pks
+        ],
+        ignore_conflicts=True,
+    )
+
+    # Trim any which now have too many
+    full = (
+        similar_model._base_manager.filter(field=label, object_pk__in=new_pks)
+        .order_by()
+        .values("object_pk")
+        .annotate(num=models.Count("pk"))
+        .filter(num__gt=limit)
+        .values_list("object_pk", flat=True)
+    )
+    for other_pk in full:
+        extra = list(
+            similar_model._base_manager.filter(field=label, object_pk=other_pk)
+            .order_by("-similarity", "pk")
+            .values_list("pk", flat=True)[limit:]
+        )
+        similar_model._base_manager.filter(pk__in=extra).delete()
+
+
+def rebuild_similar(tag_field, batch_size=500):
+    """
+    Rebuild the stored most similar objects for every object with a TagField
+
+    Returns the number of objects rebuilt
+    """
+    tagged_model = tag_field.model
+    rebuilt = 0
+    last_pk = None
+    while True:
+        pks = tagged_model._base_manager.order_by("pk")
+        if last_pk is not None:
+            pks = pks.filter(pk__gt=last_pk)
+        pks = list(pks.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            break
+        for pk in pks:
+            _save_similar(tag_field, pk)
+        rebuilt += len(pks)
+        last_pk = pks[-1]
+    return rebuilt
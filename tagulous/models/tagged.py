@@ -11,16 +11,23 @@ import django
 from django.core.exceptions import FieldDoesNotExist
 from django.db import models, transaction
 
-from .. import utils
-from ..constants import TAGGED_ATTR_MANAGER
+from .. import settings, utils
+from ..constants import (
+    FIELD_SINGLETAG,
+    FIELD_TAG,
+    FILTER_STRATEGIES,
+    SIMILARITY_SCORES,
+    TAGGED_ATTR_MANAGER,
+)
 from .cast import cast_instance
 from .fields import (
     BaseTagField,
-    SingleTagField,
     TagField,
-    singletagfields_from_model,
-    tagfields_from_model,
+    get_tag_field_map,
 )
+from .lookup import name_filter, normalise_name
+from .lookups import tag_ids
+from .similar import get_score, get_similar, get_tag_ids, is_precomputed
 
 
 def _split_kwargs(model, kwargs, lookups=False, with_fields=False):
@@ -36,11 +43,24 @@ def _split_kwargs(model, kwargs, lookups=False, with_fields=False):
 
     For internal use only - likely to change significantly in future versions
 
-    Returns a tuple of safe_fields, singletag_fields, tag_fields
+    Returns a tuple of safe_fields, singletag_fields, tag_fields. If no kwargs
+    name a tag field, safe_fields will be the kwargs dict itself.
 
     If with_fields is True, a fourth argument will be returned - a dict to
     look up Field objects from their names
     """
+    # Fast path if no kwargs name a tag field, in which case kwargs is returned
+    # as safe_fields. With lookups the field name is the part before "__".
+    tag_field_map = get_tag_field_map(model) if kwargs else None
+    if tag_field_map and lookups:
+        names = [name.partition("__")[0] for name in kwargs]
+    else:
+        names = kwargs
+    if not tag_field_map or tag_field_map.keys().isdisjoint(names):
+        if with_fields:
+            return kwargs, {}, {}, {}
+        return kwargs, {}, {}
+
     safe_fields = {}
     singletag_fields = {}
     tag_fields = {}
@@ -52,49 +72,45 @@ def _split_kwargs(model, kwargs, lookups=False, with_fields=False):
             field_name, lookup = field_name.split("__", 1)
 
             # Only one known lookup
-            if lookup == "exact":
-                try:
-                    field = model._meta.get_field(field_name)
-                except FieldDoesNotExist:
-                    # Unknown - pass it on untouched
-                    pass
-                else:
-                    if isinstance(field, TagField):
-                        # Store for later
-                        tag_fields[field_name] = (val, lookup)
-                        field_lookup[field_name] = field
-                        continue
+            if lookup == "exact" and field_name in tag_field_map:
+                field, kind = tag_field_map[field_name]
+                if kind == FIELD_TAG:
+                    # Store for later
+                    tag_fields[field_name] = (val, lookup)
+                    field_lookup[field_name] = field
+                    continue
 
             # Irrelevant lookup - no need to take special actions
             safe_fields[orig_field_name] = val
             continue
 
         # No lookup
-        # Try to look up the field
-        try:
-            field = model._meta.get_field(field_name)
-        except FieldDoesNotExist:
-            # Assume it's something clever and pass it through untouched
+        if field_name not in tag_field_map:
+            # Not a tag field, or something clever - pass it through untouched.
             # If it's invalid, an error will be raised later anyway
             safe_fields[field_name] = val
+            if with_fields:
+                try:
+                    field_lookup[field_name] = model._meta.get_field(field_name)
+                except FieldDoesNotExist:
+                    pass
 
             # Next field
             continue
 
+        field, kind = tag_field_map[field_name]
         field_lookup[field_name] = field
+
         # Take special measures depending on field type
-        if isinstance(field, SingleTagField):
+        if kind == FIELD_SINGLETAG:
             singletag_fields[field_name] = val
 
-        elif isinstance(field, TagField):
+        elif lookups:
             # Store for later
-            if lookups:
-                tag_fields[field_name] = (val, None)
-            else:
-                tag_fields[field_name] = val
+            tag_fields[field_name] = (val, None)
 
         else:
-            safe_fields[field_name] = val
+            tag_fields[field_name] = val
 
     if with_fields:
         return safe_fields, singletag_fields, tag_fields, field_lookup
@@ -112,6 +128,10 @@ class TaggedQuerySet(models.query.QuerySet):
     A QuerySet with support for Tagulous tag fields
     """
 
+    # Strategy set by tag_filter_strategy, or None to use the setting. Set on
+    # the class so querysets which have been cast to this class have a value.
+    _tagulous_filter_strategy = None
+
     def _filter_or_exclude(self, negate, *args, **kwargs):
         """
         Custom lookups for tag fields
@@ -123,19 +143,22 @@ class TaggedQuerySet(models.query.QuerySet):
             elif set(kwargs.keys()) == {"args", "kwargs"}:
                 args, kwargs = kwargs["args"], kwargs["kwargs"]
 
-        # TODO: Replace with custom lookups
         safe_fields, singletag_fields, tag_fields, field_lookup = _split_kwargs(
             self.model, kwargs, lookups=True, with_fields=True
         )
 
         # Look up string values for SingleTagFields by name
         for field_name, val in singletag_fields.items():
-            query_field_name = field_name
             if isinstance(val, str):
-                query_field_name += "__name"
-                if not field_lookup[field_name].tag_options.case_sensitive:
-                    query_field_name += "__iexact"
-            safe_fields[query_field_name] = val
+                safe_fields.update(
+                    name_filter(
+                        field_lookup[field_name].tag_model,
+                        val,
+                        prefix="%s__" % field_name,
+                    )
+                )
+            else:
+                safe_fields[field_name] = val
 
         # Query as normal
         if django.VERSION >= (3, 2):
@@ -176,28 +199,14 @@ class TaggedQuerySet(models.query.QuerySet):
             if negate:
                 subqs = self.__class__(model=self.model, using=self._db)
 
-            # To get an exact match, filter this queryset to only include
-            # items with a tag count that matches the number of specified tags
-            if lookup == "exact":
-                count_name = "_tagulous_count_%s" % field_name
-                subqs = subqs.annotate(**{count_name: models.Count(field_name)}).filter(
-                    **{count_name: len(tags)}
-                )
-                # Explicit order as meta ordering will be ignored
-                subqs = subqs.order_by("name")
-
-            # Prep the field name
-            query_field_name = field_name + "__name"
-            if not tag_options.case_sensitive:
-                query_field_name += "__iexact"
-
-            # Now chain the filters for each tag
-            #
-            # Have to do it this way to create new inner joins for each tag;
-            # ANDing Q objects will do it all on a single inner join, which
-            # will match nothing
-            for tag in tags:
-                subqs = subqs.filter(**{query_field_name: tag})
+            field = field_lookup[field_name]
+            strategy = self._get_tag_filter_strategy(len(tags))
+            if strategy == "group":
+                subqs = self._tag_filter_group(subqs, field, tags, lookup)
+            elif strategy == "exists":
+                subqs = self._tag_filter_exists(subqs, field, tags, lookup)
+            else:
+                subqs = self._tag_filter_chain(subqs, field, tags, lookup)
 
             # Fold subquery back into main query
             if negate:
@@ -209,6 +218,144 @@ class TaggedQuerySet(models.query.QuerySet):
 
         return qs
 
+    def tag_filter_strategy(self, strategy):
+        """
+        Return a clone of this queryset which will use the specified strategy
+        when filtering TagFields by tag string.
+
+        Arguments:
+            strategy    One of ``auto``, ``chain``, ``group`` or ``exists``;
+                        see settings.TAGULOUS_FILTER_STRATEGY
+        """
+        if strategy not in FILTER_STRATEGIES:
+            raise ValueError("Unknown tag filter strategy %r" % strategy)
+        qs = self._chain()
+        qs._tagulous_filter_strategy = strategy
+        return qs
+
+    def _clone(self, *args, **kwargs):
+        qs = super(TaggedQuerySet, self)._clone(*args, **kwargs)
+        qs._tagulous_filter_strategy = self._tagulous_filter_strategy
+        return qs
+
+    def _get_tag_filter_strategy(self, tag_count):
+        """
+        Return the strategy to use when filtering by tag_count tags
+        """
+        strategy = self._tagulous_filter_strategy or settings.FILTER_STRATEGY
+        if strategy not in FILTER_STRATEGIES:
+            raise ValueError("Unknown tag filter strategy %r" % strategy)
+
+        # The other strategies need at least one tag name to match
+        if not tag_count:
+            return "chain"
+
+        if strategy == "auto":
+            if tag_count <= settings.FILTER_CHAIN_MAX:
+                return "chain"
+            return "group"
+        return strategy
+
+    def _tag_filter_chain(self, qs, field, tags, lookup):
+        """
+        Filter the queryset to objects with all the tags, joining the through
+        table once for each tag
+        """
+        field_name = field.name
+
+        # To get an exact match, filter this queryset to only include
+        # items with a tag count that matches the number of specified tags
+        if lookup == "exact":
+            count_name = "_tagulous_count_%s" % field_name
+            qs = qs.annotate(**{count_name: models.Count(field_name)}).filter(
+                **{count_name: len(tags)}
+            )
+            # Explicit order as meta ordering will be ignored
+            qs = qs.order_by("name")
+
+        # Now chain the filters for each tag
+        #
+        # Have to do it this way to create new inner joins for each tag;
+        # ANDing Q objects will do it all on a single inner join, which
+        # will match nothing
+        for tag in tags:
+            qs = qs.filter(
+                **name_filter(field.tag_model, tag, prefix="%s__" % field_name)
+            )
+        return qs
+
+    def _tag_filter_group(self, qs, field, tags, lookup):
+        """
+        Filter the queryset to objects with all the tags, using a single
+        subquery on the through table which is grouped by object and counted
+        """
+        through = field.remote_field.through
+        source_name = field.m2m_field_name()
+        target_name = field.m2m_reverse_field_name()
+        tag_ids = self._tag_filter_ids(field, tags)
+
+        # Names which only differ by case match the same tag, so count them once
+        tag_count = len({normalise_name(field.tag_model, tag) for tag in tags})
+
+        # Find objects which are tagged with all of the tags
+        matches = (
+            through._base_manager.filter(**{"%s__in" % target_name: tag_ids})
+            .values(source_name)
+            .annotate(_tagulous_matched=models.Count(target_name, distinct=True))
+            .filter(_tagulous_matched=tag_count)
+            .values(source_name)
+        )
+        qs = qs.filter(pk__in=matches)
+
+        if lookup == "exact":
+            qs = qs.filter(~self._tag_filter_others(field, tag_ids))
+        return qs
+
+    def _tag_filter_exists(self, qs, field, tags, lookup):
+        """
+        Filter the queryset to objects with all the tags, using an EXISTS
+        subquery on the through table for each tag
+        """
+        through = field.remote_field.through
+        source_name = field.m2m_field_name()
+        target_name = field.m2m_reverse_field_name()
+
+        for tag in tags:
+            qs = qs.filter(
+                models.Exists(
+                    through._base_manager.filter(
+                        models.Q(**{source_name: models.OuterRef("pk")}),
+                        **name_filter(
+                            field.tag_model, tag, prefix="%s__" % target_name
+                        ),
+                    )
+                )
+            )
+
+        if lookup == "exact":
+            qs = qs.filter(
+                ~self._tag_filter_others(field, self._tag_filter_ids(field, tags))
+            )
+        return qs
+
+    def _tag_filter_ids(self, field, tags):
+        """
+        Return a subquery of the pks of the named tags in the field's tag model
+        """
+        return tag_ids(field.tag_model, tags, field.tag_options.case_sensitive)
+
+    def _tag_filter_others(self, field, tag_ids):
+        """
+        Return an EXISTS expression which matches objects with tags which are
+        not in the tag_ids subquery
+        """
+        through = field.remote_field.through
+        return models.Exists(
+            through._base_manager.filter(
+                **{field.m2m_field_name(): models.OuterRef("pk")}
+            ).exclude(**{"%s__in" % field.m2m_reverse_field_name(): tag_ids})
+        )
+
     def create(self, **kwargs):
         # Create object as normal
         safe_fields, singletag_fields, tag_fields = _split_kwargs(self.model, kwargs)
@@ -262,7 +409,9 @@ class TaggedQuerySet(models.query.QuerySet):
         cast_instance(queryset, cls)
         return queryset
 
-    def similarly_tagged(self, instance, field_name):
+    def similarly_tagged(
+        self, instance, field_name, limit=None, score="overlap", min_score=None
+    ):
         """
         Filter the queryset to objects which are similarly tagged to the specified model
         instance.
@@ -270,29 +419,67 @@ class TaggedQuerySet(models.query.QuerySet):
         Arguments:
             instance    Instance of the model whose tags we're comparing to
             field_name  Name of TagField where we're checking similarity
+            limit       Optional maximum number of objects to return. If set,
+                        the queryset is sliced.
+            score       How to score similarity; one of ``overlap``, ``idf``
+                        or ``jaccard`` - see similar.get_score()
+            min_score   Optional minimum score for objects to be returned
+
+        Objects are annotated with their score as ``tagulous_similarity``, and
+        ordered with the most similar first.
         """
-        # Start with a queryset of the tagged model, excluding the instance
-        qs = self.exclude(pk=instance.pk)
+        if score not in SIMILARITY_SCORES:
+            raise ValueError("Unknown similarity score %r" % score)
+
+        field = self.model._meta.get_field(field_name)
+        if limit and score == "overlap" and is_precomputed(field):
+            if limit <= field.tag_options.precompute_similar:
+                return self._similarly_tagged_precomputed(
+                    instance, field, limit, min_score
+                )
 
-        # Annotate with count of similarly tagged
-        q_filter = {f"{field_name}__in": getattr(instance, field_name).all()}
-        similar = qs.annotate(
-            tagulous_similarity=models.Count(
-                field_name,
-                models.Q(**q_filter),
-                distinct=True,
-            )
+        # Only join the through table rows for the instance's tags
+        similar = (
+            self.exclude(pk=instance.pk)
+            .filter(**{f"{field_name}__in": get_tag_ids(field, instance.pk)})
+            .annotate(tagulous_similarity=get_score(field, instance.pk, score))
         )
-
-        # Exclude any zero matches
-        similar = similar.exclude(tagulous_similarity=0)
+        if min_score is not None:
+            similar = similar.filter(tagulous_similarity__gte=min_score)
 
         # Order by similarity with most similar first
         ordering = ["-tagulous_similarity"] + list(similar.model._meta.ordering)
         similar = similar.order_by(*ordering)
 
+        if limit:
+            similar = similar[:limit]
         return similar
 
+    def _similarly_tagged_precomputed(self, instance, field, limit, min_score):
+        """
+        Filter the queryset to the stored most similar objects to the instance
+        """
+        similar = get_similar(field, instance.pk, limit)
+        if min_score is not None:
+            similar = [
+                (pk, similarity)
+                for pk, similarity in similar
+                if similarity >= min_score
+            ]
+        if not similar:
+            return self.none()
+        similar = self.filter(pk__in=[pk for pk, __ in similar]).annotate(
+            tagulous_similarity=models.Case(
+                *[
+                    models.When(pk=pk, then=models.Value(similarity))
+                    for pk, similarity in similar
+                ],
+                output_field=models.IntegerField(),
+            )
+        )
+        ordering = ["-tagulous_similarity"] + list(similar.model._meta.ordering)
+        return similar.order_by(*ordering)[:limit]
+
 
 # ##############################################################################
 # ############################################################## TaggedManager
@@ -335,8 +522,11 @@ class TaggedManager(models.Manager):
         cast_instance(manager, cls)
         return manager
 
-    def similarly_tagged(self, instance, field_name):
-        return self.get_queryset().similarly_tagged(instance, field_name)
+    def similarly_tagged(self, *args, **kwargs):
+        return self.get_queryset().similarly_tagged(*args, **kwargs)
+
+    def tag_filter_strategy(self, strategy):
+        return self.get_queryset().tag_filter_strategy(strategy)
 
 
 # ##############################################################################
@@ -350,7 +540,9 @@ class TaggedModel(models.Model):
     """
 
     def __init__(self, *args, **kwargs):
-        safe_fields, singletag_fields, tag_fields = _split_kwargs(self, kwargs)
+        safe_fields, singletag_fields, tag_fields = _split_kwargs(
+            self.__class__, kwargs
+        )
 
         # Constructor has always been happy with ForeignKeys
         safe_fields.update(singletag_fields)
@@ -389,10 +581,8 @@ class TaggedModel(models.Model):
                     Will only be changed if it has tag fields.
         """
         # See if there are tag fields on this model
-        tag_fields = singletagfields_from_model(model) + tagfields_from_model(model)
-
         # If there are no tag fields skip
-        if not tag_fields:
+        if not get_tag_field_map(model):
             return
 
         # Ensure the model subclasses TaggedModel
@@ -0,0 +1,195 @@
+"""
+Tag usage
+
+If a tag model has the track_usage option, each time its tags are added to or
+removed from objects the change is recorded in tagulous.contrib.counts, in a
+row per tag for each period of settings.USAGE_BUCKET seconds. The tag model
+queryset's trending() ranks tags by their recent change.
+
+Old periods are merged into larger ones, and the oldest removed, by
+compact_usage().
+"""
+
+import datetime
+
+from django.apps import apps
+from django.db import models, router, transaction
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .. import settings
+
+# Number of rows to compact at once
+COMPACT_BATCH_SIZE = 500
+
+
+def _get_usage_model():
+    return apps.get_model("tagulous_counts", "TagUsage")
+
+
+def is_tracked(tag_model):
+    """
+    Return True if usage is recorded for the tag model
+    """
+    return bool(tag_model.tag_options.track_usage) and apps.is_installed(
+        "tagulous.contrib.counts"
+    )
+
+
+def _to_seconds(period):
+    """
+    Return a period given as a timedelta or a number of seconds in seconds
+    """
+    if isinstance(period, datetime.timedelta):
+        return int(period.total_seconds())
+    return int(period)
+
+
+def get_bucket(when, size):
+    """
+    Return the start of the period of size seconds which a datetime is in
+    """
+    start = int(when.timestamp()) // size * size
+    if timezone.is_aware(when):
+        return datetime.datetime.fromtimestamp(start, tz=datetime.timezone.utc)
+    return datetime.datetime.fromtimestamp(start)
+
+
+def _add_usage(tag_model_label, bucket, amounts):
+    """
+    Add amounts to the usage of tags in a period
+
+    Arguments:
+        tag_model_label     The tag model label
+        bucket              The start of the period
+        amounts             A dict of {str(pk): amount}
+    """
+    # Avoid circular import
+    from .counts import _get_delta
+
+    usage_model = _get_usage_model()
+    usage_model._base_manager.bulk_create(
+        [
+            usage_model(tag_model=tag_model_label, tag_pk=tag_pk, bucket=bucket)
+            for tag_pk in amounts
+        ],
+        ignore_conflicts=True,
+    )
+    usage_model._base_manager.filter(
+        tag_model=tag_model_label, bucket=bucket, tag_pk__in=list(amounts)
+    ).update(delta=models.F("delta") + _get_delta(amounts, key="tag_pk"))
+
+
+def record_usage(tag_model, changes):
+    """
+    Record tags being added to or removed from an object
+
+    Arguments:
+        tag_model   The tag model
+        changes     An iterable of (tag, amount) pairs, where tag is a saved
+                    instance of the tag model
+    """
+    amounts = {}
+    for tag, amount in changes:
+        amounts[str(tag.pk)] = amounts.get(str(tag.pk), 0) + amount
+    amounts = {pk: amount for pk, amount in amounts.items() if amount}
+    if not amounts:
+        return
+    _add_usage(
+        tag_model._meta.label,
+        get_bucket(timezone.now(), settings.USAGE_BUCKET),
+        amounts,
+    )
+
+
+def get_trend(tag_model, window):
+    """
+    Return a pair of subqueries for a recent window: the pks of tags used more
+    than they were removed, to filter a queryset of the tag model, and the
+    change in usage of a tag, to annotate it
+
+    The pks are found from the usage rows in the window, so tags which have not
+    been used recently are never read.
+
+    Arguments:
+        tag_model   The tag model
+        window      The window as a timedelta or number of seconds
+    """
+    since = get_bucket(
+        timezone.now() - datetime.timedelta(seconds=_to_seconds(window)),
+        settings.USAGE_BUCKET,
+    )
+    usage = _get_usage_model()._base_manager.filter(
+        tag_model=tag_model._meta.label, bucket__gte=since
+    )
+    pks = (
+        usage.order_by()
+        .values("tag_pk")
+        .annotate(trend=models.Sum("delta"))
+        .filter(trend__gt=0)
+        .values_list(Cast("tag_pk", tag_model._meta.pk), flat=True)
+    )
+    trend = models.Subquery(
+        usage.filter(tag_pk=Cast(models.OuterRef("pk"), models.CharField()))
+        .order_by()
+        .values("tag_pk")
+        .annotate(trend=models.Sum("delta"))
+        .values("trend"),
+        output_field=models.IntegerField(),
+    )
+    return pks, trend
+
+
+def compact_usage(after=86400, size=3600, max_age=None):
+    """
+    Merge recorded usage older than ``after`` seconds into periods of ``size``
+    seconds, and remove usage older than ``max_age`` seconds, which defaults to
+    settings.USAGE_MAX_AGE. Set ``max_age`` to ``0`` to keep all usage.
+
+    Returns the number of rows merged
+    """
+    if max_age is None:
+        max_age = settings.USAGE_MAX_AGE
+    usage_model = _get_usage_model()
+    rows = usage_model._base_manager.all()
+    now = timezone.now()
+
+    if max_age:
+        rows.filter(bucket__lt=now - datetime.timedelta(seconds=max_age)).delete()
+
+    merged = 0
+    cutoff = get_bucket(now - datetime.timedelta(seconds=after), size)
+    last_pk = None
+    while True:
+        batch = rows.filter(bucket__lt=cutoff).order_by("pk")
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(
+            batch.values_list("pk", "tag_model", "tag_pk", "bucket", "delta")[
+                :COMPACT_BATCH_SIZE
+            ]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+
+        # Move rows which are not at the start of a period into that period
+        moved_pks = []
+        amounts = {}
+        for pk, tag_model_label, tag_pk, bucket, delta in batch:
+            target = get_bucket(bucket, size)
+            if target == bucket:
+                continue
+            moved_pks.append(pk)
+            key = (tag_model_label, target)
+            amounts.setdefault(key, {})
+            amounts[key][tag_pk] = amounts[key].get(tag_pk, 0) + delta
+        if not moved_pks:
+            continue
+
+        with transaction.atomic(using=router.db_for_write(usage_model)):
+            rows.filter(pk__in=moved_pks).delete()
+            for (tag_model_label, target), tag_amounts in amounts.items():
+                _add_usage(tag_model_label, target, tag_amounts)
+        merged += len(moved_pks)
+    return merged
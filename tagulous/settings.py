@@ -38,6 +38,28 @@ if _unknown := set(DEFAULT_TAG_OPTIONS) - set(OPTION_DEFAULTS):
     raise ValueError(f"Unexpected TAGULOUS_DEFAULT_TAG_OPTIONS: {', '.join(_unknown)}")
 
 
+#
+# Parser settings
+#
+
+# Number of parsed tag strings to keep in a process-local LRU cache, or 0 to
+# disable the cache
+PARSE_CACHE_SIZE = getattr(settings, "TAGULOUS_PARSE_CACHE_SIZE", 0)
+
+
+#
+# Query settings
+#
+
+# Strategy for TaggedQuerySet to filter TagFields by tag string:
+#   "chain"     join the through table once per tag
+#   "group"     one subquery on the through table, grouped and counted
+#   "exists"    one EXISTS subquery per tag
+#   "auto"      "chain" up to FILTER_CHAIN_MAX tags, otherwise "group"
+FILTER_STRATEGY = getattr(settings, "TAGULOUS_FILTER_STRATEGY", "auto")
+FILTER_CHAIN_MAX = getattr(settings, "TAGULOUS_FILTER_CHAIN_MAX", 2)
+
+
 #
 # Autocomplete settings
 #
@@ -56,6 +78,11 @@ AUTOCOMPLETE_CSS = getattr(
 )
 AUTOCOMPLETE_SETTINGS = getattr(settings, "TAGULOUS_AUTOCOMPLETE_SETTINGS", None)
 
+# Maximum number of tags to embed in a field's data-tag-list. If a tag model has
+# more, the field will use the AUTOCOMPLETE_LIST_VIEW url instead. 0 for no limit.
+AUTOCOMPLETE_LIST_MAX = getattr(settings, "TAGULOUS_AUTOCOMPLETE_LIST_MAX", 0)
+AUTOCOMPLETE_LIST_VIEW = getattr(settings, "TAGULOUS_AUTOCOMPLETE_LIST_VIEW", None)
+
 # Use vendored jquery and select2 for admin
 DEFAULT_ADMIN_AUTOCOMPLETE_JS = (
     "tagulous/tagulous.js",
@@ -74,6 +101,43 @@ ADMIN_AUTOCOMPLETE_SETTINGS = getattr(
 )
 
 
+#
+# Cache settings
+#
+
+# Name of the Django cache for Tagulous to use, or None to disable caching
+CACHE = getattr(settings, "TAGULOUS_CACHE", None)
+
+# Number of tag names to keep in a process-local LRU cache for each tag model
+# with the cache_names option, or 0 to disable the cache
+NAME_CACHE_SIZE = getattr(settings, "TAGULOUS_NAME_CACHE_SIZE", 1000)
+
+# Dotted path to the class which shares the tags found by name between
+# processes in the Django cache named by CACHE, for tag models with the
+# cache_names option, or None to disable it
+NAME_CACHE_BACKEND = getattr(
+    settings, "TAGULOUS_NAME_CACHE_BACKEND", "tagulous.cache.NameCache"
+)
+
+
+#
+# Count settings
+#
+
+# How tag counts are changed: "direct" updates the tag model immediately;
+# "journal" records changes in the tagulous.contrib.counts journal, to be
+# applied by the tagulous_flush_counts management command
+COUNT_MODE = getattr(settings, "TAGULOUS_COUNT_MODE", "direct")
+
+# Length in seconds of the periods tag usage is recorded in, for tag models
+# with the track_usage option
+USAGE_BUCKET = getattr(settings, "TAGULOUS_USAGE_BUCKET", 300)
+
+# Age in seconds after which recorded tag usage is removed by the
+# tagulous_compact_usage management command, or 0 to keep it
+USAGE_MAX_AGE = getattr(settings, "TAGULOUS_USAGE_MAX_AGE", 30 * 24 * 60 * 60)
+
+
 #
 # Tag weighting defaults, for tag model queryset .weight() method
 #
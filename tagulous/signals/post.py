@@ -1,44 +1,81 @@
 """
 Model signal handlers
 
-These are connected in tagulous.apps.TagulousConfig.ready()
+Models are registered as they are prepared, and the handlers are connected to
+each registered model in tagulous.apps.TagulousConfig.ready()
 """
 
-from ..models.fields import SingleTagField, TagField
+from weakref import WeakKeyDictionary
+
+from django.core import exceptions
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+
+from .. import constants
+from ..cache import bump_version
+from ..models.fields import SingleTagField, TagField, get_tag_field_map
+from ..models.lookup import clear_name_cache
+from ..models.models import BaseTagModel
 from ..models.tagged import TaggedModel
 
+# Registry of tagged models, mapped to a tuple of (field, field_type) pairs for
+# their tag fields
+tagged_model_fields = WeakKeyDictionary()
+
+# Registry of tagged models, mapped to a tuple of (field, field_type) pairs for
+# the tag fields which belong to the model rather than a concrete parent
+tagged_model_local_fields = WeakKeyDictionary()
+
+# Registry of tag models
+tag_models = WeakKeyDictionary()
+
+# Signals to connect to registered models, as lists of (signal, handler,
+# dispatch_uid). Populated by register_post_signals()
+_tagged_model_signals = []
+_tag_model_signals = []
+
 
 class TaggedSignalHandler(object):
     """
     Base class handling signals from TaggedModel subclasses
     """
 
-    def __call__(self, sender, instance, **kwargs):
-        if not self.is_relevant(sender):
-            return
+    # If False, fields whose manager has not been created on this instance
+    # are passed to handle_unused_field instead of creating a manager
+    handle_unused = True
 
+    def __call__(self, sender, instance, **kwargs):
+        is_raw = kwargs.get("raw", False)
         for field, field_type in self.get_fields(sender):
+            if (
+                not self.handle_unused
+                and not is_raw
+                and field.get_manager_name() not in instance.__dict__
+            ):
+                self.handle_unused_field(instance, field, field_type)
+                continue
+
             descriptor = getattr(sender, field.name)
             manager = descriptor.get_manager(instance)
 
-            self.handle(manager, field_type, kwargs.get("raw", False))
-
-    def is_relevant(self, sender):
-        return issubclass(sender, TaggedModel)
+            self.handle(manager, field_type, is_raw)
 
     def get_fields(self, sender):
         """
-        Generator which returns (field, field_type) pairs
+        Return a tuple of (field, field_type) pairs
         """
-        for field in sender._meta.get_fields():
-            if isinstance(field, SingleTagField):
-                yield (field, SingleTagField)
-            elif isinstance(field, TagField):
-                yield (field, TagField)
+        return tagged_model_fields.get(sender, ())
 
     def handle(self, manager, field_type, is_raw):
         raise NotImplementedError()  # pragma: no cover
 
+    def handle_unused_field(self, instance, field, field_type):
+        """
+        Handle a field which has not been touched on this instance, so has no
+        changes to save
+        """
+        pass
+
 
 class PreSaveHandler(TaggedSignalHandler):
     """
@@ -49,6 +86,18 @@ class PreSaveHandler(TaggedSignalHandler):
     assign its pk to field_id.
     """
 
+    handle_unused = False
+
+    def handle_unused_field(self, instance, field, field_type):
+        # Logic check to replace standard null/blank model field validation
+        if (
+            field_type == SingleTagField
+            and field.required
+            and field.attname in instance.__dict__
+            and instance.__dict__[field.attname] is None
+        ):
+            raise exceptions.ValidationError(field.error_messages["null"])
+
     def handle(self, manager, field_type, is_raw):
         if field_type != SingleTagField:
             return
@@ -62,6 +111,8 @@ class PostSaveHandler(TaggedSignalHandler):
     Ensure both tag fields' states are saved
     """
 
+    handle_unused = False
+
     def handle(self, manager, field_type, is_raw):
         manager.post_save_handler()
 
@@ -79,13 +130,10 @@ class PostSaveHandler(TaggedSignalHandler):
 class PropagatedSignalMixin(object):
     def get_fields(self, sender):
         """
-        Post delete signal propagates up the class hierarchy, so filter fields
-        returned to those belonging to the model which raised this signal
+        Post delete signal propagates up the class hierarchy, so only return
+        fields belonging to the model which raised this signal
         """
-        for field, field_type in super(PropagatedSignalMixin, self).get_fields(sender):
-            if field.model != sender:
-                continue
-            yield (field, field_type)
+        return tagged_model_local_fields.get(sender, ())
 
 
 class PreDeleteHandler(PropagatedSignalMixin, TaggedSignalHandler):
@@ -114,14 +162,107 @@ class PostDeleteHandler(PropagatedSignalMixin, TaggedSignalHandler):
         manager.post_delete_handler()
 
 
-def register_post_signals():
-    from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+class TagModelChangeHandler(object):
+    """
+    Tag model post-save and post-delete signal handler
+
+    Invalidate cached values for the tag model when a tag is added, changed or
+    removed, and again when the change commits, in case they were cached from
+    the database before it could see the change
+    """
+
+    def __call__(self, sender, instance, using=None, **kwargs):
+        self.invalidate(sender)
+        if transaction.get_connection(using).in_atomic_block:
+            transaction.on_commit(lambda: self.invalidate(sender), using=using)
+
+    def invalidate(self, tag_model):
+        bump_version(tag_model)
+        bump_version(tag_model, "counts")
+        clear_name_cache(tag_model)
+
+
+class TaggedModelTotalHandler(object):
+    """
+    Tagged model post-save and post-delete signal handler
+
+    Invalidate the cached number of tagged objects for the tag models of the
+    TagFields when an object is created or deleted, and again when the change
+    commits
+    """
+
+    def __call__(self, sender, instance, created=True, using=None, **kwargs):
+        # post_delete has no created argument
+        if not created:
+            return
+        tag_models = {
+            field.related_model
+            for field, field_type in tagged_model_fields.get(sender, ())
+            if field_type == TagField
+        }
+        if not tag_models:
+            return
+        self.invalidate(tag_models)
+        if transaction.get_connection(using).in_atomic_block:
+            transaction.on_commit(lambda: self.invalidate(tag_models), using=using)
 
-    pre_save.connect(PreSaveHandler(), weak=False, dispatch_uid="tagulous_pre_save")
-    post_save.connect(PostSaveHandler(), weak=False, dispatch_uid="tagulous_post_save")
-    pre_delete.connect(
-        PreDeleteHandler(), weak=False, dispatch_uid="tagulous_pre_delete"
+    def invalidate(self, tag_models):
+        for tag_model in tag_models:
+            bump_version(tag_model, "objects")
+
+
+def _connect(signals, model):
+    for signal, handler, dispatch_uid in signals:
+        signal.connect(handler, sender=model, weak=False, dispatch_uid=dispatch_uid)
+
+
+def register_model(model):
+    """
+    Register a model with the signal handlers if it is a tagged model or a tag
+    model, so the handlers are only connected to models they apply to.
+
+    Called when a model is prepared; if the handlers have already been
+    connected to other models, they are connected to this model immediately.
+    """
+    if issubclass(model, BaseTagModel):
+        tag_models[model] = True
+        _connect(_tag_model_signals, model)
+
+    if not issubclass(model, TaggedModel):
+        return
+
+    field_types = {
+        constants.FIELD_SINGLETAG: SingleTagField,
+        constants.FIELD_TAG: TagField,
+    }
+    fields = tuple(
+        (field, field_types[kind]) for field, kind in get_tag_field_map(model).values()
     )
-    post_delete.connect(
-        PostDeleteHandler(), weak=False, dispatch_uid="tagulous_post_delete"
+    if not fields:
+        return
+
+    tagged_model_fields[model] = fields
+    tagged_model_local_fields[model] = tuple(
+        (field, field_type) for field, field_type in fields if field.model == model
     )
+    _connect(_tagged_model_signals, model)
+
+
+def register_post_signals():
+    _tagged_model_signals[:] = [
+        (pre_save, PreSaveHandler(), "tagulous_pre_save"),
+        (post_save, PostSaveHandler(), "tagulous_post_save"),
+        (pre_delete, PreDeleteHandler(), "tagulous_pre_delete"),
+        (post_delete, PostDeleteHandler(), "tagulous_post_delete"),
+        (post_save, TaggedModelTotalHandler(), "tagulous_total_post_save"),
+        (post_delete, TaggedModelTotalHandler(), "tagulous_total_post_delete"),
+    ]
+    _tag_model_signals[:] = [
+        (post_save, TagModelChangeHandler(), "tagulous_tag_post_save"),
+        (post_delete, TagModelChangeHandler(), "tagulous_tag_post_delete"),
+    ]
+
+    for model in list(tagged_model_fields.keys()):
+        _connect(_tagged_model_signals, model)
+    for model in list(tag_models.keys()):
+        _connect(_tag_model_signals, model)
@@ -9,19 +9,21 @@ from django.db.models.signals import class_prepared
 
 from .. import settings
 from ..models.tagged import TaggedModel
+from .post import register_model
 
 
 def class_prepared_listener(sender, **kwargs):
     """
     Listen to the class_prepared signal and subclass any model with tag
-    fields
+    fields, then register it with the post signal handlers
     """
-    TaggedModel.cast_class(sender)
+    if settings.ENHANCE_MODELS:
+        TaggedModel.cast_class(sender)
+    register_model(sender)
 
 
 def register_pre_signals():
     """
     Called from tagulous/models/__init__.py
     """
-    if settings.ENHANCE_MODELS:
-        class_prepared.connect(class_prepared_listener, weak=False)
+    class_prepared.connect(class_prepared_listener, weak=False)
@@ -117,6 +117,129 @@
     };
 
 
+    /**
+     * Ajax transport with request cancellation and a client-side result cache
+     *
+     * Each field gets its own transport. Starting a new request aborts any
+     * request still in flight, so a slow response for an old term can never
+     * overwrite the results for the current one.
+     *
+     * Responses are kept in a small LRU cache keyed by page and term. When the
+     * first page for a term said there were no more results, it holds every
+     * match for that term, so it can also answer any longer term which starts
+     * with it - the results are filtered locally instead of asking the server.
+     */
+    function ResultCache(size, options) {
+      this.size = size;
+      this.entries = new Map();
+      this.caseSensitive = options.case_sensitive === true;
+      this.fulltext = options.autocomplete_view_fulltext === true;
+      this.forceLowercase = options.force_lowercase === true;
+    }
+
+    ResultCache.prototype.normalise = function (term) {
+      term = term || '';
+      if (this.forceLowercase || !this.caseSensitive) {
+        term = term.toLowerCase();
+      }
+      return term;
+    };
+
+    ResultCache.prototype.get = function (term, page) {
+      var key = (page || 1) + ':' + this.normalise(term),
+          data = this.entries.get(key);
+      if (data === undefined) {
+        return undefined;
+      }
+      // Move to the end so it is the most recently used
+      this.entries.delete(key);
+      this.entries.set(key, data);
+      return data;
+    };
+
+    ResultCache.prototype.set = function (term, page, data) {
+      var key = (page || 1) + ':' + this.normalise(term);
+      this.entries.delete(key);
+      this.entries.set(key, data);
+      while (this.entries.size > this.size) {
+        // Evict the least recently used
+        this.entries.delete(this.entries.keys().next().value);
+      }
+    };
+
+    ResultCache.prototype.match = function (term, page) {
+      /** Look for an exact match, or filter a complete superset */
+      var exact = this.get(term, page),
+          i, prefix, superset, results, needle;
+      if (exact !== undefined || (page || 1) > 1) {
+        return exact;
+      }
+
+      needle = this.normalise(term);
+      for (i = term.length - 1; i >= 0; i--) {
+        prefix = term.substr(0, i);
+        superset = this.get(prefix, 1);
+        if (superset === undefined) {
+          continue;
+        }
+        if (superset.more) {
+          // Server didn't return every match for this prefix
+          return undefined;
+        }
+        results = [];
+        for (var j = 0; j < superset.results.length; j++) {
+          var name = this.normalise(superset.results[j]);
+          if (this.fulltext ? name.indexOf(needle) !== -1 : name.indexOf(needle) === 0) {
+            results.push(superset.results[j]);
+          }
+        }
+        exact = {results: results, more: false};
+        this.set(term, 1, exact);
+        return exact;
+      }
+      return undefined;
+    };
+
+    function makeTransport(cacheSize, options) {
+      var cache = (cacheSize > 0 && window.Map) ? new ResultCache(cacheSize, options) : null,
+          pending = null
+      ;
+      return function (params, success, failure) {
+        var term = (params.data && params.data.q) || '',
+            page = (params.data && params.data.p) || 1,
+            cached, $request
+        ;
+
+        // Cancel the superseded request
+        if (pending) {
+          pending.abort();
+          pending = null;
+        }
+
+        cached = cache ? cache.match(term, page) : undefined;
+        if (cached !== undefined) {
+          // Copy so processResults can't change the cached response
+          success({results: cached.results.slice(), more: cached.more});
+          return {status: 200, abort: function () {}};
+        }
+
+        $request = $.ajax(params);
+        pending = $request;
+        $request.then(function (data) {
+          if (pending === $request) {
+            pending = null;
+          }
+          if (cache && data && data.results) {
+            cache.set(term, page, {results: data.results.slice(), more: !!data.more});
+          }
+          success(data);
+        });
+        $request.fail(failure);
+        return $request;
+      };
+    }
+
+
     /** Apply select2 to a specified element
 
         Arguments:
@@ -133,11 +256,12 @@
             isSingle = $el.data('tag-type') === "single",
             options = $el.data('tag-options') || {},
             settings = options.autocomplete_settings || {},
-            list = $el.data('tag-list'),
+            tagList = getTagList($el),
+            list = tagList && tagList.list,
             url = $el.data('tag-url'),
 
             // Other values
-            $blank, args, field_args
+            $blank, args, field_args, debounce, cacheSize
         ;
         // See if this is a deferred tag
         if (canDefer && settings.defer) {
@@ -145,6 +269,19 @@
         }
         delete settings.defer;
 
+        // See if this should wait until it is visible or focused
+        if (canDefer && settings.lazy) {
+            initWhenNeeded($el);
+            return $el;
+        }
+        delete settings.lazy;
+
+        // Extract ajax settings which are for us rather than Select2
+        debounce = settings.debounce === undefined ? 250 : settings.debounce;
+        cacheSize = settings.cache === undefined ? 50 : settings.cache;
+        delete settings.debounce;
+        delete settings.cache;
+
         // Clear out first option if it's Django's blank value
         $blank = $el
             .find('option:first[value=""]:contains("---------")')
@@ -181,6 +318,8 @@
             args['ajax'] = {
                 url: url,
                 dataType: 'json',
+                delay: debounce,
+                transport: makeTransport(cacheSize, options),
                 data: function (params) {
                     return {q:params.term, p:params.page};
                 },
@@ -197,7 +336,10 @@
 
         } else if (isSingle) {
             // Make SingleTagField look like a select, set data not tags
-            args['data'] = listToData(list);
+            if (tagList && !tagList.data) {
+                tagList.data = listToData(list);
+            }
+            args['data'] = tagList ? tagList.data : [];
 
             // Add a placeholder to ignore the empty option we're about to add
             args['placeholder'] = $el.prop('placeholder') || "";
@@ -300,6 +442,76 @@
         });
     }
 
+    /**
+     * Parsed data-tag-list values, keyed on the raw attribute
+     *
+     * Fields for the same tag model (eg in each row of a formset) have the same
+     * list, so only parse it once and share it between them. Select2 copies the
+     * items it is given, so the shared lists are never changed.
+     */
+    var tagListCache = {};
+
+    function getTagList($el) {
+        var raw = $el.attr('data-tag-list');
+        if (!raw) {
+            return undefined;
+        }
+        if (!Object.prototype.hasOwnProperty.call(tagListCache, raw)) {
+            tagListCache[raw] = {list: JSON.parse(raw), data: null};
+        }
+        return tagListCache[raw];
+    }
+
+    /**
+     * Lazy initialisation
+     *
+     * When the ``lazy`` autocomplete setting is set, fields aren't initialised
+     * until they are scrolled into view, or focused in browsers without an
+     * IntersectionObserver.
+     */
+    var lazyObserver = null;
+
+    function initLazy(el, focused) {
+        var $el = $(el), $selectCtl;
+        if (!$el.data('tagulous-lazy')) {
+            // Already initialised
+            return;
+        }
+        $el.removeData('tagulous-lazy').off('focus.tagulous');
+        if (lazyObserver) {
+            lazyObserver.unobserve(el);
+        }
+        $selectCtl = apply_select2(el, false);
+        if (focused) {
+            $selectCtl.select2('open');
+        }
+    }
+
+    function initWhenNeeded($el) {
+        var el = $el[0];
+        if ($el.data('tagulous-lazy')) {
+            return;
+        }
+        $el.data('tagulous-lazy', true);
+        $el.one('focus.tagulous', function () {
+            initLazy(el, true);
+        });
+
+        if (!window.IntersectionObserver) {
+            return;
+        }
+        if (!lazyObserver) {
+            lazyObserver = new IntersectionObserver(function (entries) {
+                for (var i = 0; i < entries.length; i++) {
+                    if (entries[i].isIntersecting) {
+                        initLazy(entries[i].target, false);
+                    }
+                }
+            }, {rootMargin: '200px'});
+        }
+        lazyObserver.observe(el);
+    }
+
     function listToData(list) {
         /** Convert a list of tags into an object with tag:tag key/vals */
         var data = [], i;
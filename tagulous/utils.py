@@ -4,8 +4,11 @@ Tag parsing and printing
 Loosely based on django-taggit and django-tagging
 """
 
+from functools import lru_cache
+
 from django.utils.encoding import force_str
 
+from . import settings
 from .constants import COMMA, DOUBLE_QUOTE, QUOTE, SPACE, TREE
 
 # ##############################################################################
@@ -30,6 +33,9 @@ def parse_tags(tag_string: str, max_count=0, space_delimiter=True) -> list[str]:
     If space_delimiter is False, space will never be used as a delimiter.
 
     Tree tags can be further split into their parts with split_tree_name
+
+    If settings.TAGULOUS_PARSE_CACHE_SIZE is set, parsed tag strings are kept
+    in an LRU cache; see parse_cache_info and parse_cache_clear.
     """
     # Empty string easiest case
     if not tag_string:
@@ -37,17 +43,29 @@ def parse_tags(tag_string: str, max_count=0, space_delimiter=True) -> list[str]:
 
     tag_string = force_str(tag_string)
 
-    # Prep variables for the parser
-    tags = []
-    tag = ""
-    delimiter = SPACE
-    in_quote = None
-    chars = False
+    # Parse, using the cache if enabled
+    parse_cache = _get_parse_cache()
+    if parse_cache is None:
+        tags = _parse_tags(tag_string, space_delimiter)
+    else:
+        tags = parse_cache(tag_string, space_delimiter)
 
-    # Disable spaces
-    if not space_delimiter:
-        delimiter = COMMA
+    # Check the count
+    if max_count and len(tags) > max_count:
+        raise ValueError(
+            "This field can only have %s argument%s"
+            % (max_count, "" if max_count == 1 else "s")
+        )
+
+    return list(tags)
 
+
+def _parse_tags(tag_string, space_delimiter):
+    """
+    Parse a tag string into a sorted tuple of unique tag names
+
+    The result is immutable so that it can be shared by the parse cache
+    """
     # Bypass main parser for efficiency if no quotes
     if QUOTE not in tag_string:
         # No quotes - simple split and strip
@@ -63,12 +81,74 @@ def parse_tags(tag_string: str, max_count=0, space_delimiter=True) -> list[str]:
         tags = split_strip(tag_string, delimiter)
 
     else:
-        # Break tag string into list of (index, char)
-        chars = list(enumerate(tag_string))
+        tags = _parse_quoted_tags(tag_string, space_delimiter)
+
+    # Enforce uniqueness and sort
+    return tuple(sorted(set(tags)))
+
+
+# LRU cache wrapper for _parse_tags, managed by _get_parse_cache
+_parse_cache = None
+
+
+def _get_parse_cache():
+    """
+    Return the LRU cache wrapper for _parse_tags, or None if the cache is
+    disabled by settings.TAGULOUS_PARSE_CACHE_SIZE
+
+    The cache is rebuilt if the setting changes.
+    """
+    global _parse_cache
+    size = settings.PARSE_CACHE_SIZE
+    if not size:
+        return None
+
+    if _parse_cache is None or _parse_cache.cache_info().maxsize != size:
+        _parse_cache = lru_cache(maxsize=size)(_parse_tags)
+    return _parse_cache
+
+
+def parse_cache_info():
+    """
+    Return the hits, misses, maxsize and currsize of the parse_tags cache as a
+    named tuple, or None if the cache is disabled
+    """
+    parse_cache = _get_parse_cache()
+    if parse_cache is None:
+        return None
+    return parse_cache.cache_info()
+
+
+def parse_cache_clear():
+    """
+    Empty the parse_tags cache and reset its statistics
+    """
+    if _parse_cache is not None:
+        _parse_cache.cache_clear()
+
+
+def _parse_quoted_tags(tag_string, space_delimiter):
+    """
+    Main tag parser for tag strings which contain quotes
+
+    Walks the string once by index. Each tag is collected as a list of string
+    pieces which is only joined when the tag ends, and the list only ever
+    holds non-empty pieces so it is falsey while the tag is empty.
+
+    Returns a list of tags, which may contain duplicates.
+    """
+    tags = []
+    tag = []
+    delimiter = SPACE if space_delimiter else COMMA
+    in_quote = None
+    length = len(tag_string)
+    pos = 0
 
     # Loop through chars
-    while chars:
-        index, char = chars.pop(0)
+    while pos < length:
+        index = pos
+        char = tag_string[pos]
+        pos += 1
 
         # See if it's a delimiter
         if not in_quote:
@@ -77,47 +157,15 @@ def parse_tags(tag_string: str, max_count=0, space_delimiter=True) -> list[str]:
                 delimiter = COMMA
 
                 # All previous tags were actually just one tag
-                tag = tag_string[0:index].strip()
+                tag = _clean_unquoted_tag(tag_string[0:index].strip())
                 tags = []
 
-                # Strip start/end quotes
-                tag_len = len(tag)
-                tag = tag.lstrip(QUOTE)
-                left_quote_count = tag_len - len(tag)
-                tag_len = len(tag)
-                tag = tag.rstrip(QUOTE)
-                right_quote_count = tag_len - len(tag)
-
-                # Escape inner quotes
-                tag = tag.replace(DOUBLE_QUOTE, QUOTE)
-
-                # Add back escaped start/end quotes
-                tag = (
-                    (QUOTE * int(left_quote_count / 2))
-                    + tag
-                    + (QUOTE * int(right_quote_count / 2))
-                )
-
-                # Add back insignificant unescaped quotes.
-                #
-                # There are only two scenarios where there can be unescaped
-                # quotes at the start, followed by a comma later:
-                #   1. The comma is quoted - but that means in_quote is True,
-                #      in which case we won't be in this code branch
-                #   2. The comma comes after a matching closing unescaped quote
-                #
-                # Therefore there can't be insigificant unescaped quotes on the
-                # left and unescaped quotes on the right are only insignificant
-                # if there are no unescaped quotes on the left
-                if right_quote_count % 2 == 1 and left_quote_count % 2 == 0:
-                    tag += QUOTE
-
             # Found end of tag
             if char == delimiter:
-                tag = tag.rstrip()
-                if tag:
-                    tags.append(tag)
-                    tag = ""
+                name = "".join(tag).rstrip()
+                if name:
+                    tags.append(name)
+                tag = []
                 # Following tested manually due to coverage bug
                 #   See https://bitbucket.org/ned/coveragepy/issues/198
                 continue  # pragma: no cover
@@ -129,14 +177,14 @@ def parse_tags(tag_string: str, max_count=0, space_delimiter=True) -> list[str]:
         # Now either in a quote, or not a delimiter
         # If it's not a quote, add to tag
         if char != QUOTE:
-            tag += char
+            tag.append(char)
             continue
 
         # Char is quote - count how many quotes appear here
-        quote_count = 1
-        while chars and chars[0][1] == QUOTE:
-            quote_count += 1
-            chars.pop(0)
+        while pos < length and tag_string[pos] == QUOTE:
+            pos += 1
+        quote_count = pos - index
+        escaped = QUOTE * (quote_count // 2)
 
         if not tag:
             # Quote at start
@@ -145,62 +193,89 @@ def parse_tags(tag_string: str, max_count=0, space_delimiter=True) -> list[str]:
                 in_quote = True
 
             # Tag starts with escaped quotes
-            tag = QUOTE * int(quote_count / 2)
-        else:
-            # Quote in middle or at end
-            # Add any escaped
-            tag += QUOTE * int(quote_count / 2)
+            tag = [escaped] if escaped else []
+            continue
 
-            # An odd number followed by a delimiter will mean it has ended
-            # Need to look ahead to figure it out
-            if quote_count % 2 == 1:
-                # If it's the last character, it has closed
-                if len(chars) == 0:
-                    in_quote = False
-                    break
-
-                for i2, c2 in chars:
-                    if c2 == SPACE:
-                        if delimiter == SPACE:
-                            # Quotes closed; tag will end next loop
-                            in_quote = False
-                            break
-                        else:
-                            # Spaces are insignificant during whitespace
-                            # Tag may continue, keep checking chars
-                            # Following tested manually due to coverage bug
-                            continue  # pragma: no cover
-                    elif c2 == COMMA:
-                        # Quotes closed; tag will end next loop
-                        # Delimiter doesn't matter, comma always wins
-                        in_quote = False
-                        break
-
-                    # Tag has not ended
-                    # Add odd quote to tag and keep building
-                    tag += QUOTE
-                    break
+        # Quote in middle or at end
+        # Add any escaped
+        if escaped:
+            tag.append(escaped)
+
+        # An odd number followed by a delimiter will mean it has ended
+        if quote_count % 2 == 0:
+            continue
+
+        # If it's the last character, it has closed
+        if pos == length:
+            in_quote = False
+            break
+
+        # Need to look ahead to figure it out
+        ahead = pos
+        if delimiter == COMMA:
+            # Spaces are insignificant during whitespace
+            # Tag may continue, skip to the next significant char
+            while ahead < length and tag_string[ahead] == SPACE:
+                ahead += 1
+            if ahead == length:
+                continue
+
+        if tag_string[ahead] in (SPACE, COMMA):
+            # Quotes closed; tag will end next loop
+            # Comma always wins, space only if it is the delimiter
+            in_quote = False
+        else:
+            # Tag has not ended
+            # Add odd quote to tag and keep building
+            tag.append(QUOTE)
 
     # Chars expended
     if tag:
         # Partial tag remains; add to stack
         if in_quote:
             # Add the quote back to the start - it wasn't significant after all
-            tag = QUOTE + tag
-        tags.append(tag)
+            tag.insert(0, QUOTE)
+        tags.append("".join(tag))
 
-    # Enforce uniqueness and sort
-    tags = list(set(tags))
-    tags.sort()
+    return tags
 
-    # Check the count
-    if max_count and len(tags) > max_count:
-        raise ValueError(
-            "This field can only have %s argument%s"
-            % (max_count, "" if max_count == 1 else "s")
-        )
 
-    return tags
+def _clean_unquoted_tag(tag):
+    """
+    Clean a tag string which has been found to contain no delimiters, once the
+    main parser has switched to comma delimiters.
+
+    Returns the tag as a list of pieces for the main parser
+    """
+    # Strip start/end quotes
+    tag_len = len(tag)
+    tag = tag.lstrip(QUOTE)
+    left_quote_count = tag_len - len(tag)
+    tag_len = len(tag)
+    tag = tag.rstrip(QUOTE)
+    right_quote_count = tag_len - len(tag)
+
+    # Escape inner quotes
+    tag = tag.replace(DOUBLE_QUOTE, QUOTE)
+
+    # Add back escaped start/end quotes
+    tag = (QUOTE * (left_quote_count // 2)) + tag + (QUOTE * (right_quote_count // 2))
+
+    # Add back insignificant unescaped quotes.
+    #
+    # There are only two scenarios where there can be unescaped
+    # quotes at the start, followed by a comma later:
+    #   1. The comma is quoted - but that means in_quote is True,
+    #      in which case we won't be in this code branch
+    #   2. The comma comes after a matching closing unescaped quote
+    #
+    # Therefore there can't be insigificant unescaped quotes on the
+    # left and unescaped quotes on the right are only insignificant
+    # if there are no unescaped quotes on the left
+    if right_quote_count % 2 == 1 and left_quote_count % 2 == 0:
+        tag += QUOTE
+
+    return [tag] if tag else []
 
 
 def split_strip(string, delimiter=","):
@@ -1,9 +1,13 @@
 import json
 
+from django.apps import apps
 from django.contrib.auth.decorators import login_required
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models.query import QuerySet
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
+
+from .models.lookup import name_filter
+from .models.models import BaseTagModel
 
 
 @login_required
@@ -11,6 +15,31 @@ def autocomplete_login(*args, **kwargs):
     return autocomplete(*args, **kwargs)
 
 
+def autocomplete_label(request, label):
+    """
+    Arguments:
+        request
+            The request object from the dispatcher
+        label
+            The label of the tag model, in the form ``app_label.model_name``
+
+    Look up the tag model by its label and pass it to ``autocomplete``. Used by
+    tag fields with more than ``TAGULOUS_AUTOCOMPLETE_LIST_MAX`` tags.
+    """
+    try:
+        tag_model = apps.get_model(label)
+    except (LookupError, ValueError):
+        raise Http404("Unknown tag model")
+    if not issubclass(tag_model, BaseTagModel):
+        raise Http404("Unknown tag model")
+    return autocomplete(request, tag_model)
+
+
+@login_required
+def autocomplete_label_login(*args, **kwargs):
+    return autocomplete_label(*args, **kwargs)
+
+
 def autocomplete(request, tag_model):
     """
     Arguments:
@@ -51,10 +80,7 @@ def autocomplete(request, tag_model):
         else:
             lookup = "startswith"
 
-        if not options.case_sensitive:
-            lookup = f"i{lookup}"
-
-        results = queryset.filter(**{f"name__{lookup}": query})
+        results = queryset.filter(**name_filter(tag_model, query, lookup))
 
     else:
         results = queryset.all()
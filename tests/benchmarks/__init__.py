@@ -0,0 +1,13 @@
+"""
+Tagulous benchmarks
+
+Benchmarks are run as modules from the project root, so set up Django with the
+test settings before they import Tagulous
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+django.setup()
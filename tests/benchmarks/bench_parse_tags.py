@@ -0,0 +1,280 @@
+"""
+Benchmark tag string parsing
+
+Compares ``tagulous.utils.parse_tags`` with the original implementation from
+Tagulous 2.1 on quoted, unquoted and pathological tag strings, after first
+checking that both return the same tags for every input.
+
+Run from the project root with::
+
+    python -m tests.benchmarks.bench_parse_tags
+
+Use ``--number`` to change the number of runs per input, and ``--fuzz`` to
+change the number of random strings compared before timing.
+"""
+
+import argparse
+import random
+import timeit
+
+from django.utils.encoding import force_str
+
+from tagulous.constants import COMMA, DOUBLE_QUOTE, QUOTE, SPACE
+from tagulous.utils import parse_tags, split_strip
+
+
+def legacy_parse_tags(tag_string, max_count=0, space_delimiter=True):
+    """
+    Tag parser
+
+    Rules without quotes:
+        If a comma is present it's used as the delimiter
+        Otherwise space is used as the delimiter
+        Spaces at the start and end of tags are ignored
+
+    Rules with quotes
+        Quotes can be escaped by double quotes, ie ""
+        Commas outside quotes take precedence over spaces as delimiter
+        Unmatched quotes will be left in the string
+
+    If space_delimiter is False, space will never be used as a delimiter.
+
+    Tree tags can be further split into their parts with split_tree_name
+    """
+    # Empty string easiest case
+    if not tag_string:
+        return []
+
+    tag_string = force_str(tag_string)
+
+    # Prep variables for the parser
+    tags = []
+    tag = ""
+    delimiter = SPACE
+    in_quote = None
+    chars = False
+
+    # Disable spaces
+    if not space_delimiter:
+        delimiter = COMMA
+
+    # Bypass main parser for efficiency if no quotes
+    if QUOTE not in tag_string:
+        # No quotes - simple split and strip
+
+        # Normally split on commas
+        delimiter = COMMA
+
+        # But if no commas, split on spaces
+        if COMMA not in tag_string and space_delimiter:
+            delimiter = SPACE
+
+        # Split and strip tags
+        tags = split_strip(tag_string, delimiter)
+
+    else:
+        # Break tag string into list of (index, char)
+        chars = list(enumerate(tag_string))
+
+    # Loop through chars
+    while chars:
+        index, char = chars.pop(0)
+
+        # See if it's a delimiter
+        if not in_quote:
+            # Comma delimiter takes priority
+            if delimiter != COMMA and char == COMMA:
+                delimiter = COMMA
+
+                # All previous tags were actually just one tag
+                tag = tag_string[0:index].strip()
+                tags = []
+
+                # Strip start/end quotes
+                tag_len = len(tag)
+                tag = tag.lstrip(QUOTE)
+                left_quote_count = tag_len - len(tag)
+                tag_len = len(tag)
+                tag = tag.rstrip(QUOTE)
+                right_quote_count = tag_len - len(tag)
+
+                # Escape inner quotes
+                tag = tag.replace(DOUBLE_QUOTE, QUOTE)
+
+                # Add back escaped start/end quotes
+                tag = (
+                    (QUOTE * int(left_quote_count / 2))
+                    + tag
+                    + (QUOTE * int(right_quote_count / 2))
+                )
+
+                # Add back insignificant unescaped quotes.
+                #
+                # There are only two scenarios where there can be unescaped
+                # quotes at the start, followed by a comma later:
+                #   1. The comma is quoted - but that means in_quote is True,
+                #      in which case we won't be in this code branch
+                #   2. The comma comes after a matching closing unescaped quote
+                #
+                # Therefore there can't be insigificant unescaped quotes on the
+                # left and unescaped quotes on the right are only insignificant
+                # if there are no unescaped quotes on the left
+                if right_quote_count % 2 == 1 and left_quote_count % 2 == 0:
+                    tag += QUOTE
+
+            # Found end of tag
+            if char == delimiter:
+                tag = tag.rstrip()
+                if tag:
+                    tags.append(tag)
+                    tag = ""
+                # Following tested manually due to coverage bug
+                #   See https://bitbucket.org/ned/coveragepy/issues/198
+                continue  # pragma: no cover
+
+            # If tag is empty, ignore whitespace
+            if not tag and char == SPACE:
+                continue
+
+        # Now either in a quote, or not a delimiter
+        # If it's not a quote, add to tag
+        if char != QUOTE:
+            tag += char
+            continue
+
+        # Char is quote - count how many quotes appear here
+        quote_count = 1
+        while chars and chars[0][1] == QUOTE:
+            quote_count += 1
+            chars.pop(0)
+
+        if not tag:
+            # Quote at start
+            # If an odd number, now in quote
+            if quote_count % 2 == 1:
+                in_quote = True
+
+            # Tag starts with escaped quotes
+            tag = QUOTE * int(quote_count / 2)
+        else:
+            # Quote in middle or at end
+            # Add any escaped
+            tag += QUOTE * int(quote_count / 2)
+
+            # An odd number followed by a delimiter will mean it has ended
+            # Need to look ahead to figure it out
+            if quote_count % 2 == 1:
+                # If it's the last character, it has closed
+                if len(chars) == 0:
+                    in_quote = False
+                    break
+
+                for i2, c2 in chars:
+                    if c2 == SPACE:
+                        if delimiter == SPACE:
+                            # Quotes closed; tag will end next loop
+                            in_quote = False
+                            break
+                        else:
+                            # Spaces are insignificant during whitespace
+                            # Tag may continue, keep checking chars
+                            # Following tested manually due to coverage bug
+                            continue  # pragma: no cover
+                    elif c2 == COMMA:
+                        # Quotes closed; tag will end next loop
+                        # Delimiter doesn't matter, comma always wins
+                        in_quote = False
+                        break
+
+                    # Tag has not ended
+                    # Add odd quote to tag and keep building
+                    tag += QUOTE
+                    break
+
+    # Chars expended
+    if tag:
+        # Partial tag remains; add to stack
+        if in_quote:
+            # Add the quote back to the start - it wasn't significant after all
+            tag = QUOTE + tag
+        tags.append(tag)
+
+    # Enforce uniqueness and sort
+    tags = list(set(tags))
+    tags.sort()
+
+    # Check the count
+    if max_count and len(tags) > max_count:
+        raise ValueError(
+            "This field can only have %s argument%s"
+            % (max_count, "" if max_count == 1 else "s")
+        )
+
+    return tags
+
+
+def get_inputs():
+    """
+    Return a list of (label, tag_string) tuples to benchmark
+    """
+    words = ["tag%d" % i for i in range(2000)]
+    return [
+        ("unquoted spaces", " ".join(words)),
+        ("unquoted commas", ", ".join(words)),
+        ("quoted", ", ".join('"%s, %s"' % (a, b) for a, b in zip(words, words[1:]))),
+        (
+            "quoted spaces",
+            " ".join('"%s %s"' % (a, b) for a, b in zip(words, words[1:])),
+        ),
+        ("escaped quotes", " ".join('%s""%s' % (a, a) for a in words)),
+        ("late comma", " ".join('"%s"' % word for word in words) + ", end"),
+        ("unclosed quote", '"' + " ".join(words)),
+        ("quote runs", '"' * 10000 + "a" + '"' * 10000),
+        ("space runs", ", ".join('a"' + " " * 50 + "b" for _ in range(500))),
+    ]
+
+
+def fuzz(count, seed=0):
+    """
+    Check both parsers agree on ``count`` random strings
+    """
+    rand = random.Random(seed)
+    alphabet = "ab" + SPACE * 2 + COMMA + QUOTE * 2
+    for _ in range(count):
+        tag_string = "".join(rand.choice(alphabet) for _ in range(rand.randint(1, 16)))
+        for space_delimiter in (True, False):
+            expected = legacy_parse_tags(tag_string, space_delimiter=space_delimiter)
+            actual = parse_tags(tag_string, space_delimiter=space_delimiter)
+            if expected != actual:
+                raise AssertionError(
+                    "Parsers disagree on %r (space_delimiter=%r): %r != %r"
+                    % (tag_string, space_delimiter, expected, actual)
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=5)
+    parser.add_argument("--fuzz", type=int, default=20000)
+    args = parser.parse_args()
+
+    fuzz(args.fuzz)
+    inputs = get_inputs()
+    for label, tag_string in inputs:
+        if legacy_parse_tags(tag_string) != parse_tags(tag_string):
+            raise AssertionError("Parsers disagree on %s input" % label)
+
+    print("%-16s %8s %12s %12s" % ("input", "length", "legacy (ms)", "current (ms)"))
+    for label, tag_string in inputs:
+        results = [
+            min(timeit.repeat(lambda: fn(tag_string), number=1, repeat=args.number))
+            for fn in (legacy_parse_tags, parse_tags)
+        ]
+        print(
+            "%-16s %8d %12.2f %12.2f"
+            % (label, len(tag_string), results[0] * 1000, results[1] * 1000)
+        )
+
+
+if __name__ == "__main__":
+    main()
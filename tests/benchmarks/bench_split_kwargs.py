@@ -0,0 +1,163 @@
+"""
+Benchmark splitting tag fields out of model and queryset kwargs
+
+Compares ``tagulous.models.tagged._split_kwargs`` with the original
+implementation from Tagulous 2.1, measuring the per-object overhead it adds to
+tagged model instantiation and queryset filtering.
+
+Run from the project root with::
+
+    python -m tests.benchmarks.bench_split_kwargs
+"""
+
+import argparse
+import timeit
+from unittest import mock
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management import call_command
+
+from tagulous.models import tagged
+from tagulous.models.fields import SingleTagField, TagField
+from tests.tagulous_tests_app.models import MixedTest
+
+
+def legacy_split_kwargs(model, kwargs, lookups=False, with_fields=False):
+    """
+    Split kwargs into fields which are safe to pass to create, and
+    m2m tag fields, creating SingleTagFields as required.
+
+    If lookups is True, TagFields with tagulous-specific lookups will also be
+    matched, and the returned tag_fields will be a dict of tuples in the
+    format ``(val, lookup)``
+
+    The only tagulous-specific lookup is __exact
+
+    For internal use only - likely to change significantly in future versions
+
+    Returns a tuple of safe_fields, singletag_fields, tag_fields
+
+    If with_fields is True, a fourth argument will be returned - a dict to
+    look up Field objects from their names
+    """
+    safe_fields = {}
+    singletag_fields = {}
+    tag_fields = {}
+    field_lookup = {}
+    for field_name, val in kwargs.items():
+        # Check for lookup
+        if lookups and "__" in field_name:
+            orig_field_name = field_name
+            field_name, lookup = field_name.split("__", 1)
+
+            # Only one known lookup
+            if lookup == "exact":
+                try:
+                    field = model._meta.get_field(field_name)
+                except FieldDoesNotExist:
+                    # Unknown - pass it on untouched
+                    pass
+                else:
+                    if isinstance(field, TagField):
+                        # Store for later
+                        tag_fields[field_name] = (val, lookup)
+                        field_lookup[field_name] = field
+                        continue
+
+            # Irrelevant lookup - no need to take special actions
+            safe_fields[orig_field_name] = val
+            continue
+
+        # No lookup
+        # Try to look up the field
+        try:
+            field = model._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            # Assume it's something clever and pass it through untouched
+            # If it's invalid, an error will be raised later anyway
+            safe_fields[field_name] = val
+
+            # Next field
+            continue
+
+        field_lookup[field_name] = field
+        # Take special measures depending on field type
+        if isinstance(field, SingleTagField):
+            singletag_fields[field_name] = val
+
+        elif isinstance(field, TagField):
+            # Store for later
+            if lookups:
+                tag_fields[field_name] = (val, None)
+            else:
+                tag_fields[field_name] = val
+
+        else:
+            safe_fields[field_name] = val
+
+    if with_fields:
+        return safe_fields, singletag_fields, tag_fields, field_lookup
+
+    return safe_fields, singletag_fields, tag_fields
+
+
+def get_cases():
+    """
+    Return a list of (label, number, function) tuples to benchmark, where the
+    function takes the _split_kwargs implementation to call directly
+    """
+    return [
+        ("split, no kwargs", 100000, lambda split: split(MixedTest, {})),
+        (
+            "split, safe kwargs",
+            100000,
+            lambda split: split(MixedTest, {"name": "Test", "pk": 1}),
+        ),
+        (
+            "split, tag kwargs",
+            100000,
+            lambda split: split(MixedTest, {"name": "Test", "tags": "a, b"}),
+        ),
+        (
+            "split, safe lookups",
+            100000,
+            lambda split: split(
+                MixedTest, {"name__startswith": "T", "pk__gt": 0}, lookups=True
+            ),
+        ),
+        ("init, no kwargs", 10000, lambda split: MixedTest()),
+        ("init, safe kwargs", 10000, lambda split: MixedTest(name="Test")),
+        ("queryset rows", 10, lambda split: list(MixedTest.objects.all())),
+        (
+            "filter, safe kwargs",
+            1000,
+            lambda split: MixedTest.objects.filter(name="Test", pk__gt=0),
+        ),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    MixedTest.objects.bulk_create(
+        [MixedTest(name="Test %d" % i) for i in range(args.rows)]
+    )
+
+    print("%-20s %12s %12s" % ("case", "legacy (us)", "current (us)"))
+    for label, number, fn in get_cases():
+        results = []
+        for split in (legacy_split_kwargs, tagged._split_kwargs):
+            with mock.patch.object(tagged, "_split_kwargs", split):
+                timing = min(
+                    timeit.repeat(lambda: fn(split), number=number, repeat=args.repeat)
+                )
+            results.append(timing / number * 1000000)
+        print("%-20s %12.2f %12.2f" % (label, results[0], results[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,8 @@ INSTALLED_APPS = [
     "django.contrib.contenttypes",
     "django.contrib.messages",
     "tagulous",
+    "tagulous.contrib.counts",
+    "tagulous.contrib.similar",
     "tests",
     "tests.tagulous_tests_app",
     "tests.tagulous_tests_app2",
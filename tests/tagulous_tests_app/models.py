@@ -2,6 +2,8 @@
 Test models
 """
 
+import uuid
+
 from django.db import models
 
 import tagulous
@@ -340,6 +342,103 @@ class SimpleMixedTest(models.Model):
     tags = tagulous.models.TagField(blank=True)
 
 
+class ShardedCountTest(models.Model):
+    """
+    For testing tag count shards
+    """
+
+    name = models.CharField(max_length=10)
+    singletag = tagulous.models.SingleTagField(blank=True, count_shards=4)
+    tags = tagulous.models.TagField(blank=True, count_shards=4)
+
+
+class PrecomputedSimilarTest(models.Model):
+    """
+    For testing precomputed similar objects
+    """
+
+    name = models.CharField(max_length=10)
+    tags = tagulous.models.TagField(blank=True, precompute_similar=2)
+
+
+class CooccurrenceTest(models.Model):
+    """
+    For testing tracked tag co-occurrence
+    """
+
+    name = models.CharField(max_length=10)
+    tags = tagulous.models.TagField(blank=True, track_cooccurrence=True)
+
+
+class ScopedCountTest(models.Model):
+    """
+    For testing scoped tag counts
+    """
+
+    name = models.CharField(max_length=10)
+    tenant = models.CharField(max_length=10, blank=True, null=True)
+    singletag = tagulous.models.SingleTagField(blank=True, count_scope_field="tenant")
+    tags = tagulous.models.TagField(blank=True, count_scope_field="tenant")
+
+
+class UsageTest(models.Model):
+    """
+    For testing recorded tag usage
+    """
+
+    name = models.CharField(max_length=10)
+    singletag = tagulous.models.SingleTagField(blank=True, track_usage=True)
+    tags = tagulous.models.TagField(blank=True, track_usage=True)
+
+
+class NameCacheTagModel(tagulous.models.TagModel):
+    """
+    A tag model which caches tag names
+    """
+
+    class TagMeta:
+        cache_names = True
+
+
+class NameCachePkTagModel(tagulous.models.TagModel):
+    """
+    A tag model which caches tag names and has its own primary key
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+
+    class TagMeta:
+        cache_names = True
+
+
+class NameCacheTest(models.Model):
+    """
+    For testing the tag name cache
+    """
+
+    name = models.CharField(max_length=10)
+    singletag = tagulous.models.SingleTagField(
+        NameCacheTagModel, blank=True, related_name="name_cache_singletag"
+    )
+    tags = tagulous.models.TagField(
+        NameCacheTagModel, blank=True, related_name="name_cache_tags"
+    )
+    cased = tagulous.models.TagField(blank=True, cache_names=True, case_sensitive=True)
+    custom_pk = tagulous.models.TagField(
+        NameCachePkTagModel, blank=True, related_name="name_cache_custom_pk"
+    )
+
+
+class NameNormalisedTest(models.Model):
+    """
+    For testing the name_normalised option
+    """
+
+    name = models.CharField(max_length=10)
+    singletag = tagulous.models.SingleTagField(blank=True, name_normalised=True)
+    tags = tagulous.models.TagField(blank=True, name_normalised=True)
+
+
 class MixedTestTagModel(tagulous.models.TagModel):
     class TagMeta:
         def get_absolute_url(self):
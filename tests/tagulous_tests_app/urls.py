@@ -78,6 +78,16 @@ urlpatterns = [
                     {"tag_model": tagged_model.case_sensitive_true.tag_model},
                     name="tagulous_tests_app-case_sensitive_true",
                 ),
+                re_path(
+                    r"^autocomplete/label/(?P<label>[\w.]+)/$",
+                    tagulous.views.autocomplete_label,
+                    name="tagulous_tests_app-label",
+                ),
+                re_path(
+                    r"^autocomplete/label_login/(?P<label>[\w.]+)/$",
+                    tagulous.views.autocomplete_label_login,
+                    name="tagulous_tests_app-label-login",
+                ),
             ]
         ),
     ),
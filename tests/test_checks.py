@@ -1,6 +1,20 @@
+from unittest import mock
+
 from django.test import TestCase, override_settings
 
-from tagulous.checks import SERIALIZATION_MODULES_EXPECTED, WARNING_W001, tagulous_check
+from tagulous import settings as tag_settings
+from tagulous.checks import (
+    ERROR_E001,
+    ERROR_E002,
+    ERROR_E003,
+    ERROR_E004,
+    ERROR_E005,
+    ERROR_E006,
+    ERROR_E007,
+    SERIALIZATION_MODULES_EXPECTED,
+    WARNING_W001,
+    tagulous_check,
+)
 
 
 class CheckTest(TestCase):
@@ -16,3 +30,43 @@ class CheckTest(TestCase):
         expected_errors = []
         errors = tagulous_check(app_configs=None)
         self.assertEqual(errors, expected_errors)
+
+    @override_settings(SERIALIZATION_MODULES=SERIALIZATION_MODULES_EXPECTED)
+    @mock.patch.object(tag_settings, "COUNT_MODE", "invalid")
+    def test_count_mode_invalid__check_raises_error(self):
+        errors = tagulous_check(app_configs=None)
+        self.assertEqual(errors, [ERROR_E001])
+
+    @override_settings(SERIALIZATION_MODULES=SERIALIZATION_MODULES_EXPECTED)
+    @mock.patch.object(tag_settings, "COUNT_MODE", "journal")
+    def test_count_mode_journal__installed__check_raises_no_error(self):
+        errors = tagulous_check(app_configs=None)
+        self.assertEqual(errors, [])
+
+    @override_settings(SERIALIZATION_MODULES=SERIALIZATION_MODULES_EXPECTED)
+    @mock.patch.object(tag_settings, "COUNT_MODE", "journal")
+    def test_count_mode_journal__not_installed__check_raises_error(self):
+        with mock.patch(
+            "django.apps.apps.is_installed",
+            side_effect=lambda name: name != "tagulous.contrib.counts",
+        ):
+            errors = tagulous_check(app_configs=None)
+        self.assertEqual(errors, [ERROR_E002, ERROR_E003, ERROR_E006, ERROR_E007])
+
+    @override_settings(SERIALIZATION_MODULES=SERIALIZATION_MODULES_EXPECTED)
+    def test_count_shards__not_installed__check_raises_error(self):
+        with mock.patch(
+            "django.apps.apps.is_installed",
+            side_effect=lambda name: name != "tagulous.contrib.counts",
+        ):
+            errors = tagulous_check(app_configs=None)
+        self.assertEqual(errors, [ERROR_E003, ERROR_E006, ERROR_E007])
+
+    @override_settings(SERIALIZATION_MODULES=SERIALIZATION_MODULES_EXPECTED)
+    def test_precompute_similar__not_installed__check_raises_error(self):
+        with mock.patch(
+            "django.apps.apps.is_installed",
+            side_effect=lambda name: name != "tagulous.contrib.similar",
+        ):
+            errors = tagulous_check(app_configs=None)
+        self.assertEqual(errors, [ERROR_E004, ERROR_E005])
@@ -6,8 +6,11 @@ Modules tested:
     tagulous.forms.TagField
 """
 
+from unittest import mock
+
 import django
 from django import forms
+from django.core.cache import caches
 from django.test import TestCase
 
 from tagulous import forms as tag_forms
@@ -387,6 +390,86 @@ class ModelFormTagFieldTest(TagTestManager, TestCase):
             ),
         )
 
+    def test_render_tag_list_cached(self):
+        "Check data-tag-list is cached and invalidated when tags change"
+        self.tag_model.objects.create(name="red")
+        self.tag_model.objects.create(name="blue")
+        with mock.patch.object(tag_settings, "CACHE", "default"):
+            caches["default"].clear()
+            with self.assertNumQueries(1):
+                html1 = str(self.form()["tags"])
+            with self.assertNumQueries(0):
+                html2 = str(self.form()["tags"])
+            self.assertEqual(html1, html2)
+            self.assertIn("[&quot;blue&quot;, &quot;red&quot;]", html2)
+
+            # Adding a tag invalidates the cache
+            self.tag_model.objects.create(name="yellow")
+            with self.assertNumQueries(1):
+                html3 = str(self.form()["tags"])
+            self.assertIn(
+                "[&quot;blue&quot;, &quot;red&quot;, &quot;yellow&quot;]", html3
+            )
+
+            # Deleting a tag invalidates the cache
+            self.tag_model.objects.get(name="red").delete()
+            html4 = str(self.form()["tags"])
+            self.assertIn("[&quot;blue&quot;, &quot;yellow&quot;]", html4)
+
+    def test_render_tag_list_filtered_not_cached(self):
+        "Check data-tag-list is not cached for a filtered queryset"
+        self.tag_model.objects.create(name="red")
+        self.tag_model.objects.create(name="blue")
+        with mock.patch.object(tag_settings, "CACHE", "default"):
+            caches["default"].clear()
+            for __ in range(2):
+                form = self.form()
+                form.fields["tags"].autocomplete_tags = self.tag_model.objects.exclude(
+                    name="red"
+                )
+                with self.assertNumQueries(1):
+                    html = str(form["tags"])
+                self.assertIn("[&quot;blue&quot;]", html)
+
+    def test_render_tag_list_max(self):
+        "Check widget switches to data-tag-url when there are too many tags"
+        self.tag_model.objects.create(name="red")
+        self.tag_model.objects.create(name="blue")
+        with mock.patch.multiple(
+            tag_settings,
+            AUTOCOMPLETE_LIST_MAX=2,
+            AUTOCOMPLETE_LIST_VIEW="tagulous_tests_app-label",
+        ):
+            html = str(self.form()["tags"])
+            self.assertIn("data-tag-list", html)
+
+            self.tag_model.objects.create(name="yellow")
+            html = str(self.form()["tags"])
+            self.assertNotIn("data-tag-list", html)
+            self.assertIn(
+                'data-tag-url="/tagulous_tests_app/autocomplete/label/%s/"'
+                % self.tag_model._meta.label_lower,
+                html,
+            )
+
+    def test_render_tag_list_max_filtered(self):
+        "Check widget embeds filtered autocomplete tags when there are too many"
+        self.tag_model.objects.create(name="red")
+        self.tag_model.objects.create(name="blue")
+        self.tag_model.objects.create(name="yellow")
+        form = self.form()
+        form.fields["tags"].autocomplete_tags = self.tag_model.objects.exclude(
+            name="yellow"
+        )
+        with mock.patch.multiple(
+            tag_settings,
+            AUTOCOMPLETE_LIST_MAX=1,
+            AUTOCOMPLETE_LIST_VIEW="tagulous_tests_app-label",
+        ):
+            html = str(form["tags"])
+        self.assertNotIn("data-tag-url", html)
+        self.assertIn("[&quot;blue&quot;, &quot;red&quot;]", html)
+
     def test_initial_string(self):
         "Check initial tag string"
         form = test_forms.TagFieldForm(initial={"tags": "red, blue"})
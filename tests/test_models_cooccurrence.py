@@ -0,0 +1,154 @@
+"""
+Tagulous test: Tag co-occurrence
+
+Modules tested:
+    tagulous.models.cooccurrence
+    tagulous.contrib.similar
+"""
+
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from tagulous.contrib.similar.models import TagCooccurrence
+from tagulous.models.cooccurrence import build_cooccurrence
+from tests.lib import TagTestManager
+from tests.tagulous_tests_app import models as test_models
+
+
+class RelatedTagsTest(TagTestManager, TestCase):
+    """
+    Test get_related_tags() without stored co-occurrence
+    """
+
+    manage_models = [test_models.SimpleMixedTest]
+
+    def setUpExtra(self):
+        self.model = test_models.SimpleMixedTest
+        self.tag_model = self.model.tags.tag_model
+        self.create(self.model, name="t1", tags="red, green, blue")
+        self.create(self.model, name="t2", tags="red, green")
+        self.create(self.model, name="t3", tags="red, yellow")
+
+    def test_related(self):
+        "Check tags are ordered by the number of objects which have both"
+        red = self.tag_model.objects.get(name="red")
+        related = red.get_related_tags()
+        self.assertEqual(
+            [(tag.name, tag.tagulous_cooccurrence) for tag in related],
+            [("green", 2), ("blue", 1), ("yellow", 1)],
+        )
+
+    def test_limit(self):
+        "Check the number of tags can be limited"
+        red = self.tag_model.objects.get(name="red")
+        self.assertEqual([tag.name for tag in red.get_related_tags(limit=1)], ["green"])
+
+    def test_none(self):
+        "Check a tag used alone has no related tags"
+        self.create(self.model, name="t4", tags="purple")
+        purple = self.tag_model.objects.get(name="purple")
+        self.assertEqual(list(purple.get_related_tags()), [])
+
+
+class TrackedCooccurrenceTest(TagTestManager, TestCase):
+    """
+    Test stored tag co-occurrence
+    """
+
+    manage_models = [test_models.CooccurrenceTest]
+
+    def setUpExtra(self):
+        self.model = test_models.CooccurrenceTest
+        self.tag_model = self.model.tags.tag_model
+        self.t1 = self.create(self.model, name="t1", tags="red, green, blue")
+        self.t2 = self.create(self.model, name="t2", tags="red, green")
+
+    def get_stored(self):
+        names = dict(self.tag_model.objects.values_list("pk", "name"))
+        return sorted(
+            (names[int(tag_pk)], names[int(other_pk)], count)
+            for tag_pk, other_pk, count in TagCooccurrence.objects.values_list(
+                "tag_pk", "other_pk", "count"
+            )
+        )
+
+    def get_related(self, name):
+        tag = self.tag_model.objects.get(name=name)
+        return [(tag.name, tag.tagulous_cooccurrence) for tag in tag.get_related_tags()]
+
+    def test_stored(self):
+        "Check pairs are counted in both directions when tags are saved"
+        self.assertEqual(
+            self.get_stored(),
+            [
+                ("blue", "green", 1),
+                ("blue", "red", 1),
+                ("green", "blue", 1),
+                ("green", "red", 2),
+                ("red", "blue", 1),
+                ("red", "green", 2),
+            ],
+        )
+
+    def test_related(self):
+        "Check related tags are read from the stored counts"
+        red = self.tag_model.objects.get(name="red")
+        with self.assertNumQueries(2):
+            related = list(red.get_related_tags())
+        self.assertEqual(
+            [(tag.name, tag.tagulous_cooccurrence) for tag in related],
+            [("green", 2), ("blue", 1)],
+        )
+
+    def test_add_remove(self):
+        "Check adding and removing tags updates the counts"
+        self.t2.tags.add("blue")
+        self.assertEqual(self.get_related("red"), [("blue", 2), ("green", 2)])
+        self.t1.tags.remove("blue")
+        self.assertEqual(self.get_related("red"), [("green", 2), ("blue", 1)])
+        self.assertEqual(self.get_related("blue"), [("green", 1), ("red", 1)])
+
+    def test_remove_deletes_changed(self):
+        "Check removing tags only deletes the pairs which were counted down"
+        red = self.tag_model.objects.get(name="red")
+        green = self.tag_model.objects.get(name="green")
+        TagCooccurrence.objects.filter(tag_pk=red.pk, other_pk=green.pk).update(count=0)
+        self.t1.tags.remove("blue")
+        self.assertEqual(
+            self.get_stored(),
+            [("green", "red", 2), ("red", "green", 0)],
+        )
+
+    def test_save(self):
+        "Check changing the tag string updates the counts"
+        self.t1.tags = "red, yellow"
+        self.t1.save()
+        self.assertEqual(self.get_related("red"), [("green", 1), ("yellow", 1)])
+        self.assertFalse(self.tag_model.objects.filter(name="blue").exists())
+        self.assertNotIn("blue", [pair[0] for pair in self.get_stored()])
+
+    def test_delete(self):
+        "Check deleting an object removes its pairs"
+        self.t1.delete()
+        self.assertEqual(self.get_stored(), [("green", "red", 1), ("red", "green", 1)])
+
+    def test_build(self):
+        "Check building replaces the stored counts"
+        expected = self.get_stored()
+        TagCooccurrence.objects.update(count=10)
+        self.assertEqual(build_cooccurrence(self.tag_model, batch_size=1), 2)
+        self.assertEqual(self.get_stored(), expected)
+
+    def test_command(self):
+        "Check the management command builds the stored counts"
+        expected = self.get_stored()
+        TagCooccurrence.objects.all().delete()
+        out = StringIO()
+        call_command("tagulous_build_cooccurrence", stdout=out)
+        self.assertEqual(
+            out.getvalue(),
+            "Counted %s for 2 objects\n" % self.tag_model._meta.label,
+        )
+        self.assertEqual(self.get_stored(), expected)
@@ -0,0 +1,588 @@
+"""
+Tagulous test: Tag counts
+
+Modules tested:
+    tagulous.models.counts
+    tagulous.contrib.counts
+"""
+
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from tagulous import settings as tag_settings
+from tagulous.contrib.counts.models import (
+    TagCountJournal,
+    TagCountShard,
+    TagScopedCount,
+)
+from tagulous.models import counts
+from tagulous.models.counts import (
+    batch_counts,
+    change_counts,
+    flush_counts,
+    get_counts,
+    get_scoped_counts,
+    rebuild_scoped_counts,
+)
+from tests.lib import TagTestManager
+from tests.tagulous_tests_app import models as test_models
+
+
+class ChangeCountsTest(TagTestManager, TestCase):
+    """
+    Test change_counts()
+    """
+
+    manage_models = [test_models.SimpleMixedTest]
+
+    def setUpExtra(self):
+        self.model = test_models.SimpleMixedTest
+        self.tag_model = test_models.SimpleMixedTest.singletag.tag_model
+        self.t1 = self.create(self.model, name="Test 1", singletag="Mr")
+        self.t2 = self.create(self.model, name="Test 2", singletag="Mrs")
+
+    def get_tag(self, name):
+        return self.tag_model.objects.get(name=name)
+
+    def count_updates(self, queries):
+        table = self.tag_model._meta.db_table
+        return len(
+            [q for q in queries if q["sql"].startswith("UPDATE") and table in q["sql"]]
+        )
+
+    def test_single_update(self):
+        "Check several tags are changed with one update"
+        mr = self.get_tag("Mr")
+        mrs = self.get_tag("Mrs")
+        with CaptureQueriesContext(connection) as ctx:
+            change_counts(self.tag_model, [(mr, 2), (mrs, 1)])
+        self.assertEqual(self.count_updates(ctx.captured_queries), 1)
+        self.assertEqual(mr.count, 3)
+        self.assertEqual(mrs.count, 2)
+        self.assertTagModel(self.tag_model, {"Mr": 3, "Mrs": 2})
+
+    def test_mixed_amounts(self):
+        "Check tags can be incremented and decremented in one update"
+        mr = self.get_tag("Mr")
+        mrs = self.get_tag("Mrs")
+        with CaptureQueriesContext(connection) as ctx:
+            change_counts(self.tag_model, [(mr, 1), (mrs, -1)])
+        self.assertEqual(self.count_updates(ctx.captured_queries), 1)
+        self.assertEqual(mr.count, 2)
+        self.assertEqual(mrs.count, 0)
+
+        # Mrs is still referenced by t2, so is not deleted
+        self.assertTagModel(self.tag_model, {"Mr": 2, "Mrs": 0})
+
+    def test_combined_amounts(self):
+        "Check amounts for the same tag are combined"
+        mr = self.get_tag("Mr")
+        mr2 = self.get_tag("Mr")
+        change_counts(self.tag_model, [(mr, 3), (mr2, -1)])
+        self.assertEqual(mr.count, 3)
+        self.assertEqual(mr2.count, 3)
+        self.assertTagModel(self.tag_model, {"Mr": 3, "Mrs": 1})
+
+    def test_no_change(self):
+        "Check no queries are made when amounts cancel out"
+        mr = self.get_tag("Mr")
+        with self.assertNumQueries(0):
+            change_counts(self.tag_model, [(mr, 1), (mr, -1)])
+        with self.assertNumQueries(0):
+            change_counts(self.tag_model, [])
+
+    def test_protected_not_deleted(self):
+        "Check a protected tag is not deleted when its count reaches 0"
+        mr = self.get_tag("Mr")
+        mr.protected = True
+        mr.save()
+        change_counts(self.tag_model, [(mr, -1)])
+        self.assertTagModel(self.tag_model, {"Mr": 0, "Mrs": 1})
+
+    def test_deleted_tag_skipped(self):
+        "Check a tag deleted elsewhere is skipped"
+        mr = self.get_tag("Mr")
+        mrs = self.get_tag("Mrs")
+        self.tag_model.objects.filter(pk=mr.pk).delete()
+        change_counts(self.tag_model, [(mr, -1), (mrs, 1)])
+        self.assertEqual(mrs.count, 2)
+        self.assertTagModel(self.tag_model, {"Mrs": 2})
+
+    def test_singletagfield_swap(self):
+        "Check changing a SingleTagField updates both counts in one update"
+        self.t1.singletag = "Mrs"
+        with CaptureQueriesContext(connection) as ctx:
+            self.t1.save()
+        self.assertEqual(self.count_updates(ctx.captured_queries), 1)
+        self.assertTagModel(self.tag_model, {"Mrs": 2})
+
+    def test_singletagfield_swap_new(self):
+        "Check changing a SingleTagField to a new tag"
+        self.t1.singletag = "Miss"
+        self.t1.save()
+        self.assertTagModel(self.tag_model, {"Miss": 1, "Mrs": 1})
+
+    def test_singletagfield_save_twice(self):
+        "Check saving again after a change does not change counts again"
+        self.t1.singletag = "Mrs"
+        self.t1.save()
+        self.t1.save()
+        self.assertTagModel(self.tag_model, {"Mrs": 2})
+
+    def test_tagfield_add(self):
+        "Check adding several tags to a TagField updates counts in one update"
+        self.t1.tags = "red, green"
+        self.t1.save()
+        self.t2.tags = "red"
+        self.t2.save()
+        tag_model = self.model.tags.tag_model
+        with CaptureQueriesContext(connection) as ctx:
+            self.t2.tags.add("green", "blue")
+        table = tag_model._meta.db_table
+        self.assertEqual(
+            len(
+                [
+                    q
+                    for q in ctx.captured_queries
+                    if q["sql"].startswith("UPDATE") and table in q["sql"]
+                ]
+            ),
+            1,
+        )
+        self.assertTagModel(tag_model, {"red": 2, "green": 2, "blue": 1})
+
+
+class BatchCountsTest(TagTestManager, TestCase):
+    """
+    Test batch_counts()
+    """
+
+    manage_models = [test_models.SimpleMixedTest]
+
+    def setUpExtra(self):
+        self.model = test_models.SimpleMixedTest
+        self.tag_model = test_models.SimpleMixedTest.singletag.tag_model
+        self.t1 = self.create(self.model, name="Test 1", singletag="Mr")
+        self.t2 = self.create(self.model, name="Test 2", singletag="Mrs")
+
+    def get_tag(self, name):
+        return self.tag_model.objects.get(name=name)
+
+    def count_updates(self, queries):
+        table = self.tag_model._meta.db_table
+        return len(
+            [q for q in queries if q["sql"].startswith("UPDATE") and table in q["sql"]]
+        )
+
+    def test_held_until_exit(self):
+        "Check changes are applied with one update at the end of the batch"
+        mr = self.get_tag("Mr")
+        mrs = self.get_tag("Mrs")
+        with CaptureQueriesContext(connection) as ctx:
+            with batch_counts():
+                change_counts(self.tag_model, [(mr, 1)])
+                change_counts(self.tag_model, [(mrs, 2)])
+                change_counts(self.tag_model, [(mr, 1)])
+                self.assertEqual(self.count_updates(ctx.captured_queries), 0)
+                self.assertTagModel(self.tag_model, {"Mr": 1, "Mrs": 1})
+        self.assertEqual(self.count_updates(ctx.captured_queries), 1)
+        self.assertEqual(mr.count, 3)
+        self.assertEqual(mrs.count, 3)
+        self.assertTagModel(self.tag_model, {"Mr": 3, "Mrs": 3})
+
+    def test_cancel_out(self):
+        "Check changes which cancel out make no update"
+        mr = self.get_tag("Mr")
+        with CaptureQueriesContext(connection) as ctx:
+            with batch_counts():
+                change_counts(self.tag_model, [(mr, 1)])
+                change_counts(self.tag_model, [(mr, -1)])
+        self.assertEqual(self.count_updates(ctx.captured_queries), 0)
+        self.assertTagModel(self.tag_model, {"Mr": 1, "Mrs": 1})
+
+    def test_swaps(self):
+        "Check SingleTagField changes which cancel out make no update"
+        with CaptureQueriesContext(connection) as ctx:
+            with batch_counts():
+                self.t1.singletag = "Mrs"
+                self.t1.save()
+                self.t2.singletag = "Mr"
+                self.t2.save()
+        self.assertEqual(self.count_updates(ctx.captured_queries), 0)
+        self.assertTagModel(self.tag_model, {"Mr": 1, "Mrs": 1})
+
+    def test_delete_at_exit(self):
+        "Check a tag whose count reaches 0 is deleted at the end of the batch"
+        with batch_counts():
+            self.t1.singletag = "Mrs"
+            self.t1.save()
+            self.assertTagModel(self.tag_model, {"Mr": 1, "Mrs": 1})
+        self.assertTagModel(self.tag_model, {"Mrs": 2})
+
+    def test_nested(self):
+        "Check a nested batch is applied at the end of the outer batch"
+        mr = self.get_tag("Mr")
+        with batch_counts():
+            with batch_counts():
+                change_counts(self.tag_model, [(mr, 1)])
+            self.assertTagModel(self.tag_model, {"Mr": 1, "Mrs": 1})
+        self.assertTagModel(self.tag_model, {"Mr": 2, "Mrs": 1})
+
+    def test_nested_rollback(self):
+        "Check changes in a nested batch which fails are discarded"
+        mr = self.get_tag("Mr")
+        mrs = self.get_tag("Mrs")
+        with batch_counts():
+            change_counts(self.tag_model, [(mr, 1)])
+            with self.assertRaises(ValueError):
+                with batch_counts():
+                    change_counts(self.tag_model, [(mr, 1), (mrs, 1)])
+                    raise ValueError()
+        self.assertTagModel(self.tag_model, {"Mr": 2, "Mrs": 1})
+
+    def test_savepoint_rollback(self):
+        "Check changes in an atomic block which fails are discarded"
+        mr = self.get_tag("Mr")
+        mrs = self.get_tag("Mrs")
+        with batch_counts():
+            change_counts(self.tag_model, [(mr, 1)])
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    change_counts(self.tag_model, [(mr, 1), (mrs, 1)])
+                    raise ValueError()
+            change_counts(self.tag_model, [(mrs, 2)])
+        self.assertTagModel(self.tag_model, {"Mr": 2, "Mrs": 3})
+
+    def test_rollback(self):
+        "Check changes are discarded if the batch fails"
+        mr = self.get_tag("Mr")
+        with self.assertRaises(ValueError):
+            with batch_counts():
+                change_counts(self.tag_model, [(mr, 5)])
+                raise ValueError()
+        self.assertTagModel(self.tag_model, {"Mr": 1, "Mrs": 1})
+
+        # Changes after the batch are applied immediately
+        change_counts(self.tag_model, [(mr, 1)])
+        self.assertTagModel(self.tag_model, {"Mr": 2, "Mrs": 1})
+
+    def test_update_count_discards(self):
+        "Check update_count discards changes held by the batch"
+        mr = self.get_tag("Mr")
+        with batch_counts():
+            change_counts(self.tag_model, [(mr, 5)])
+            mr.update_count()
+        self.assertTagModel(self.tag_model, {"Mr": 1, "Mrs": 1})
+
+    def test_in_transaction(self):
+        "Check counts are updated within an enclosing transaction"
+        mr = self.get_tag("Mr")
+        with transaction.atomic():
+            with batch_counts():
+                change_counts(self.tag_model, [(mr, 1)])
+            self.assertTagModel(self.tag_model, {"Mr": 2, "Mrs": 1})
+
+
+@mock.patch.object(tag_settings, "COUNT_MODE", "journal")
+class CountJournalTest(TagTestManager, TestCase):
+    """
+    Test journalled tag counts
+    """
+
+    manage_models = [test_models.SimpleMixedTest]
+
+    def setUpExtra(self):
+        self.model = test_models.SimpleMixedTest
+        self.tag_model = test_models.SimpleMixedTest.singletag.tag_model
+        self.t1 = self.create(self.model, name="Test 1", singletag="Mr")
+        self.t2 = self.create(self.model, name="Test 2", singletag="Mr")
+        flush_counts()
+
+    def test_change_journalled(self):
+        "Check changes are written to the journal, not the tag"
+        self.t1.singletag = "Mrs"
+        self.t1.save()
+        self.assertTagModel(self.tag_model, {"Mr": 2, "Mrs": 0})
+        self.assertEqual(
+            sorted(TagCountJournal.objects.values_list("tag_pk", "amount")),
+            sorted(
+                [
+                    (str(self.tag_model.objects.get(name="Mr").pk), -1),
+                    (str(self.tag_model.objects.get(name="Mrs").pk), 1),
+                ]
+            ),
+        )
+
+    def test_flush(self):
+        "Check flushing applies the changes and empties the journal"
+        self.t1.singletag = "Mrs"
+        self.t1.save()
+        self.t2.singletag = "Mrs"
+        self.t2.save()
+        self.assertEqual(flush_counts(), 2)
+        self.assertTagModel(self.tag_model, {"Mrs": 2})
+        self.assertFalse(TagCountJournal.objects.exists())
+
+    def test_flush_single_update(self):
+        "Check flushing updates each tag model once"
+        self.t1.singletag = "Mrs"
+        self.t1.save()
+        with CaptureQueriesContext(connection) as ctx:
+            flush_counts()
+        table = self.tag_model._meta.db_table
+        self.assertEqual(
+            len(
+                [
+                    q
+                    for q in ctx.captured_queries
+                    if q["sql"].startswith("UPDATE") and table in q["sql"]
+                ]
+            ),
+            1,
+        )
+
+    def test_flush_batches(self):
+        "Check flushing sums the journal in the database, in batches"
+        self.t1.singletag = "Mrs"
+        self.t1.save()
+        self.t2.singletag = "Mrs"
+        self.t2.save()
+        with mock.patch.object(counts, "FLUSH_BATCH_SIZE", 1):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(flush_counts(), 2)
+        self.assertTagModel(self.tag_model, {"Mrs": 2})
+        self.assertFalse(TagCountJournal.objects.exists())
+        journal_table = TagCountJournal._meta.db_table
+        self.assertEqual(
+            len(
+                [
+                    q
+                    for q in ctx.captured_queries
+                    if "SUM(" in q["sql"] and journal_table in q["sql"]
+                ]
+            ),
+            4,
+        )
+
+    def test_flush_empty(self):
+        "Check flushing an empty journal does nothing"
+        self.assertEqual(flush_counts(), 0)
+
+    def test_flush_deleted_tag(self):
+        "Check changes to deleted tags are discarded"
+        mr = self.tag_model.objects.get(name="Mr")
+        change_counts(self.tag_model, [(mr, 1)])
+        self.tag_model.objects.filter(pk=mr.pk).delete()
+        flush_counts()
+        self.assertFalse(TagCountJournal.objects.exists())
+
+    def test_update_count_discards(self):
+        "Check update_count discards journalled changes to the tag"
+        mr = self.tag_model.objects.get(name="Mr")
+        change_counts(self.tag_model, [(mr, 5)])
+        mr.update_count()
+        flush_counts()
+        self.assertTagModel(self.tag_model, {"Mr": 2})
+
+    def test_command(self):
+        "Check the management command flushes the journal"
+        self.t1.singletag = "Mrs"
+        self.t1.save()
+        out = StringIO()
+        call_command("tagulous_flush_counts", stdout=out)
+        self.assertEqual(out.getvalue(), "Updated counts for 2 tags\n")
+        self.assertTagModel(self.tag_model, {"Mr": 1, "Mrs": 1})
+
+
+class CountShardTest(TagTestManager, TestCase):
+    """
+    Test tag count shards
+    """
+
+    manage_models = [test_models.ShardedCountTest]
+
+    def setUpExtra(self):
+        self.model = test_models.ShardedCountTest
+        self.tag_model = test_models.ShardedCountTest.singletag.tag_model
+        self.t1 = self.create(self.model, name="Test 1", singletag="Mr")
+        self.t2 = self.create(self.model, name="Test 2", singletag="Mr")
+
+    def get_tag(self, name):
+        return self.tag_model.objects.get(name=name)
+
+    def test_change_sharded(self):
+        "Check changes are written to the shards, not the tag"
+        self.assertTagModel(self.tag_model, {"Mr": 0})
+        mr = self.get_tag("Mr")
+        self.assertEqual(get_counts(self.tag_model, [mr.pk]), {mr.pk: 2})
+        self.assertEqual(
+            TagCountShard.objects.filter(
+                tag_model=self.tag_model._meta.label, tag_pk=str(mr.pk)
+            ).aggregate(total=Sum("count"))["total"],
+            2,
+        )
+
+    def test_shards_bounded(self):
+        "Check changes are spread across no more than count_shards rows"
+        mr = self.get_tag("Mr")
+        for i in range(20):
+            change_counts(self.tag_model, [(mr, 1)])
+        self.assertEqual(get_counts(self.tag_model, [mr.pk]), {mr.pk: 22})
+        self.assertLessEqual(
+            TagCountShard.objects.filter(
+                tag_model=self.tag_model._meta.label, tag_pk=str(mr.pk)
+            ).count(),
+            4,
+        )
+
+    def test_instance_count(self):
+        "Check tag instances keep the stored count, so saving them is safe"
+        self.t1.tags = "foo"
+        self.t1.save()
+        self.t2.tags.add("foo")
+        foo = self.t2.tags.get(name="foo")
+        self.assertEqual(foo.count, 0)
+        foo.protected = True
+        foo.save()
+        flush_counts()
+        foo.refresh_from_db()
+        self.assertEqual(foo.count, 2)
+
+    def test_flush(self):
+        "Check flushing rolls the shards up into the tag count"
+        self.t1.singletag = "Mrs"
+        self.t1.save()
+        flush_counts()
+        self.assertTagModel(self.tag_model, {"Mr": 1, "Mrs": 1})
+        self.assertFalse(TagCountShard.objects.exclude(count=0).exists())
+        mr = self.get_tag("Mr")
+        self.assertEqual(get_counts(self.tag_model, [mr.pk]), {mr.pk: 1})
+
+    def test_delete_at_zero(self):
+        "Check a tag is deleted when the total reaches 0"
+        self.t1.singletag = "Mrs"
+        self.t1.save()
+        mrs = self.get_tag("Mrs")
+        self.t1.singletag = "Mr"
+        self.t1.save()
+        self.assertFalse(self.tag_model.objects.filter(name="Mrs").exists())
+        self.assertFalse(TagCountShard.objects.filter(tag_pk=str(mrs.pk)).exists())
+
+    def test_update_count_discards(self):
+        "Check update_count replaces the shards"
+        flush_counts()
+        mr = self.get_tag("Mr")
+        change_counts(self.tag_model, [(mr, 5)])
+        mr.update_count()
+        self.assertEqual(get_counts(self.tag_model, [mr.pk]), {mr.pk: 2})
+
+    def test_tagfield(self):
+        "Check TagField counts are sharded"
+        self.t1.tags = "red, blue"
+        self.t1.save()
+        self.t2.tags = "red"
+        self.t2.save()
+        tag_model = self.model.tags.tag_model
+        self.assertTagModel(tag_model, {"red": 0, "blue": 0})
+        flush_counts()
+        self.assertTagModel(tag_model, {"red": 2, "blue": 1})
+
+
+class ScopedCountTest(TagTestManager, TestCase):
+    """
+    Test counts per scope with the count_scope_field option
+    """
+
+    manage_models = [test_models.ScopedCountTest]
+
+    def setUpExtra(self):
+        self.model = test_models.ScopedCountTest
+        self.tag_model = self.model.tags.tag_model
+        self.t1 = self.create(self.model, name="Test 1", tenant="a", tags="red, blue")
+        self.t2 = self.create(self.model, name="Test 2", tenant="a", tags="red")
+        self.t3 = self.create(self.model, name="Test 3", tenant="b", tags="red")
+
+    def assertScoped(self, tag_model, scope, expected):
+        counts = {
+            tag_model.objects.get(pk=tag_pk).name: count
+            for tag_pk, count in get_scoped_counts(tag_model, scope).values_list(
+                "tag_pk", "count"
+            )
+        }
+        self.assertEqual(counts, expected)
+
+    def test_tagfield_add(self):
+        "Check TagField counts are kept per scope"
+        self.assertTagModel(self.tag_model, {"red": 3, "blue": 1})
+        self.assertScoped(self.tag_model, "a", {"red": 2, "blue": 1})
+        self.assertScoped(self.tag_model, "b", {"red": 1})
+
+    def test_tagfield_remove(self):
+        "Check scoped counts are removed when they reach 0"
+        self.t1.tags = "red"
+        self.t1.save()
+        self.assertScoped(self.tag_model, "a", {"red": 2})
+        self.t3.tags.clear()
+        self.assertScoped(self.tag_model, "b", {})
+        self.assertFalse(TagScopedCount.objects.filter(scope="b").exists())
+
+    def test_singletag(self):
+        "Check SingleTagField counts are kept per scope"
+        tag_model = self.model.singletag.tag_model
+        self.t1.singletag = "Mr"
+        self.t1.save()
+        self.t3.singletag = "Mr"
+        self.t3.save()
+        self.assertScoped(tag_model, "a", {"Mr": 1})
+        self.assertScoped(tag_model, "b", {"Mr": 1})
+        self.t1.delete()
+        self.assertScoped(tag_model, "a", {})
+        self.assertScoped(tag_model, "b", {"Mr": 1})
+
+    def test_no_scope(self):
+        "Check objects without a scope only change the global count"
+        self.create(self.model, name="Test 4", tags="blue")
+        self.assertTagModel(self.tag_model, {"red": 3, "blue": 2})
+        self.assertEqual(TagScopedCount.objects.filter(count__gt=0).count(), 3)
+
+    def test_batch(self):
+        "Check scoped counts are batched"
+        with batch_counts():
+            self.t2.tags = "blue"
+            self.t2.save()
+            self.t3.tags = "blue"
+            self.t3.save()
+            self.assertScoped(self.tag_model, "a", {"red": 2, "blue": 1})
+        self.assertScoped(self.tag_model, "a", {"red": 1, "blue": 2})
+        self.assertScoped(self.tag_model, "b", {"blue": 1})
+
+    def test_scoped_queryset(self):
+        "Check scoped() limits tags to the scope and annotates their counts"
+        tags = self.tag_model.objects.scoped("b")
+        self.assertEqual(
+            list(tags.values_list("name", "count", "scope_count")), [("red", 3, 1)]
+        )
+
+    def test_scoped_weight(self):
+        "Check weight() on a scoped queryset uses the scoped counts"
+        self.create(self.model, name="Test 4", tenant="b", tags="blue")
+        self.create(self.model, name="Test 5", tenant="b", tags="blue")
+        weights = dict(
+            self.tag_model.objects.scoped("b")
+            .weight(min=1, max=5)
+            .values_list("name", "weight")
+        )
+        self.assertEqual(weights, {"red": 3, "blue": 5})
+
+    def test_rebuild(self):
+        "Check rebuild_scoped_counts recounts every scope"
+        self.model.objects.filter(pk=self.t2.pk).update(tenant="b")
+        self.assertEqual(rebuild_scoped_counts(self.tag_model), 3)
+        self.assertScoped(self.tag_model, "a", {"red": 1, "blue": 1})
+        self.assertScoped(self.tag_model, "b", {"red": 2})
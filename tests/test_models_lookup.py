@@ -0,0 +1,438 @@
+"""
+Tagulous test: Tag lookup by name
+
+Modules tested:
+    tagulous.models.lookup
+    tagulous.models.migrations.add_name_normalised
+    tagulous.cache
+"""
+
+import json
+from unittest import mock
+
+from django.apps import apps
+from django.core.cache import caches
+from django.db import IntegrityError, connection, migrations, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from tagulous import settings as tag_settings
+from tagulous import views
+from tagulous.cache import NameCache, bump_version, get_name_cache_backend
+from tagulous.models.lookup import (
+    _get_name_cache,
+    clear_name_cache,
+    get_or_create_tag,
+    get_tag,
+)
+from tagulous.models.migrations import add_name_normalised
+from tests.lib import TagTestManager
+from tests.tagulous_tests_app import models as test_models
+
+
+class NameCacheTest(TagTestManager, TransactionTestCase):
+    """
+    Test the tag name cache for tag models with the cache_names option
+
+    Use a TransactionTestCase so tags are cached when their transaction commits
+    """
+
+    manage_models = [test_models.NameCacheTest]
+
+    def setUpExtra(self):
+        self.model = test_models.NameCacheTest
+        self.tag_model = test_models.NameCacheTagModel
+        self.cased_model = self.model.cased.tag_model
+        self.red = self.tag_model.objects.create(name="Red", protected=True)
+        clear_name_cache(self.tag_model)
+        clear_name_cache(self.cased_model)
+
+    def test_option(self):
+        "Check the option is set from TagMeta"
+        self.assertTrue(self.tag_model.tag_options.cache_names)
+
+    def test_cached(self):
+        "Check a tag is only loaded from the database once"
+        with self.assertNumQueries(1):
+            tag = get_tag(self.tag_model, "red")
+        with self.assertNumQueries(0):
+            cached = get_tag(self.tag_model, "RED")
+        self.assertEqual(cached, tag)
+        self.assertEqual(cached.name, "Red")
+        self.assertTrue(cached.protected)
+
+    def test_deferred_fields(self):
+        "Check other fields of a cached tag are loaded when used"
+        get_tag(self.tag_model, "Red")
+        tag = get_tag(self.tag_model, "Red")
+        self.assertEqual(tag.get_deferred_fields(), {"slug", "count"})
+        with self.assertNumQueries(1):
+            self.assertEqual(tag.slug, "red")
+
+    def test_case_sensitive(self):
+        "Check names are matched exactly when the tag model is case sensitive"
+        self.cased_model.objects.create(name="Red")
+        self.assertEqual(get_tag(self.cased_model, "Red").name, "Red")
+        with self.assertRaises(self.cased_model.DoesNotExist):
+            get_tag(self.cased_model, "red")
+
+    def test_misses_not_cached(self):
+        "Check a tag which is not found is looked up again"
+        with self.assertRaises(self.tag_model.DoesNotExist):
+            get_tag(self.tag_model, "blue")
+        self.tag_model.objects.create(name="Blue")
+        self.assertEqual(get_tag(self.tag_model, "blue").name, "Blue")
+
+    def test_delete_clears(self):
+        "Check deleting a tag clears the cache"
+        get_tag(self.tag_model, "red")
+        self.red.delete()
+        with self.assertRaises(self.tag_model.DoesNotExist):
+            get_tag(self.tag_model, "red")
+
+    def test_rename_clears(self):
+        "Check saving a tag clears the cache"
+        get_tag(self.tag_model, "red")
+        self.red.name = "Crimson"
+        self.red.save()
+        with self.assertRaises(self.tag_model.DoesNotExist):
+            get_tag(self.tag_model, "red")
+
+    def test_shared_version_clears(self):
+        "Check a change to the version in the Django cache clears the cache"
+        with mock.patch.object(tag_settings, "CACHE", "default"):
+            caches["default"].clear()
+            get_tag(self.tag_model, "red")
+            with self.assertNumQueries(0):
+                get_tag(self.tag_model, "red")
+            bump_version(self.tag_model)
+            with self.assertNumQueries(1):
+                get_tag(self.tag_model, "red")
+
+    def test_size(self):
+        "Check the cache holds no more than NAME_CACHE_SIZE names"
+        self.tag_model.objects.create(name="Blue")
+        with mock.patch.object(tag_settings, "NAME_CACHE_SIZE", 1):
+            get_tag(self.tag_model, "red")
+            get_tag(self.tag_model, "blue")
+            with self.assertNumQueries(1):
+                get_tag(self.tag_model, "red")
+
+    def test_get_or_create(self):
+        "Check get_or_create_tag uses the cache and creates missing tags"
+        get_tag(self.tag_model, "red")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_or_create_tag(self.tag_model, "RED"), self.red)
+        blue = get_or_create_tag(self.tag_model, "Blue")
+        self.assertEqual(blue.name, "Blue")
+        self.assertFalse(blue.protected)
+
+    def test_custom_pk(self):
+        "Check cached tags are loaded correctly when the tag model has its own pk"
+        pk_model = test_models.NameCachePkTagModel
+        clear_name_cache(pk_model)
+        blue = pk_model.objects.create(name="Blue", protected=True)
+        get_tag(pk_model, "blue")
+        with self.assertNumQueries(0):
+            tag = get_tag(pk_model, "blue")
+        self.assertEqual(tag.pk, blue.pk)
+        self.assertEqual(tag.name, "Blue")
+        self.assertTrue(tag.protected)
+
+        t1 = self.create(self.model, name="Test 1", custom_pk="blue")
+        self.assertEqual([tag.pk for tag in t1.custom_pk.tags], [blue.pk])
+        self.assertTagModel(pk_model, {"Blue": 1})
+
+    def test_managers(self):
+        "Check tag fields use the cache"
+        self.create(self.model, name="Test 1", singletag="red", tags="red")
+        t2 = self.model(name="Test 2")
+        with self.assertNumQueries(0):
+            t2.singletag = "RED"
+            self.assertEqual(t2.singletag.pk, self.red.pk)
+            t2.tags = "red"
+            self.assertEqual([tag.pk for tag in t2.tags.tags], [self.red.pk])
+        t2.save()
+        self.assertTagModel(self.tag_model, {"Red": 4})
+
+    def test_remove_exact(self):
+        "Check removing a tag by name still needs the exact name"
+        t1 = self.create(self.model, name="Test 1", tags="Red")
+        t1.tags.remove("red")
+        self.assertEqual(t1.tags, "Red")
+        t1.tags.remove("Red")
+        self.assertEqual(t1.tags, "")
+
+    def test_transaction_commit(self):
+        "Check a tag loaded in a transaction is cached when it commits"
+        with transaction.atomic():
+            get_tag(self.tag_model, "red")
+            with self.assertNumQueries(1):
+                get_tag(self.tag_model, "red")
+        with self.assertNumQueries(0):
+            get_tag(self.tag_model, "red")
+
+    def test_transaction_rollback(self):
+        "Check a tag created in a transaction which is rolled back is not cached"
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.model.objects.create(name="Test 1", tags="ghost")
+                self.model.objects.create(name="Test 2", tags="ghost")
+                raise ValueError("Roll back")
+        t3 = self.model.objects.create(name="Test 3", tags="ghost")
+        self.assertEqual(t3.tags, "ghost")
+        self.assertTagModel(self.tag_model, {"Red": 0, "ghost": 1})
+
+    def test_transaction_change_clears(self):
+        "Check a tag cached while a change is in progress is cleared on commit"
+        with transaction.atomic():
+            self.red.name = "Crimson"
+            self.red.save()
+            # Another thread caches the tag before the change commits
+            _get_name_cache(self.tag_model).set("red", (self.red.pk, "Red", True))
+        with self.assertRaises(self.tag_model.DoesNotExist):
+            get_tag(self.tag_model, "red")
+
+
+class RecordingNameCache(NameCache):
+    """
+    Name cache backend which records the names it is asked for
+    """
+
+    names = []
+
+    def get_or_load(self, tag_model, name, load):
+        self.names.append(name)
+        return super().get_or_load(tag_model, name, load)
+
+
+class SharedNameCacheTest(TagTestManager, TransactionTestCase):
+    """
+    Test the name cache backend shares tags between processes
+
+    Use a TransactionTestCase so tags are cached when their transaction commits
+    """
+
+    manage_models = [test_models.NameCacheTest]
+
+    def setUpExtra(self):
+        self.tag_model = test_models.NameCacheTagModel
+        self.red = self.tag_model.objects.create(name="Red", protected=True)
+        self.cache = caches["default"]
+        self.cache.clear()
+        patcher = mock.patch.object(tag_settings, "CACHE", "default")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.cache.clear)
+        self.backend = get_name_cache_backend()
+        clear_name_cache(self.tag_model)
+
+    def test_shared(self):
+        "Check a process with an empty name cache uses the shared cache"
+        get_tag(self.tag_model, "red")
+        clear_name_cache(self.tag_model)
+        with self.assertNumQueries(0):
+            tag = get_tag(self.tag_model, "RED")
+        self.assertEqual(tag.pk, self.red.pk)
+        self.assertEqual(tag.name, "Red")
+
+    def test_no_process_cache(self):
+        "Check the shared cache is used without a process cache"
+        with mock.patch.object(tag_settings, "NAME_CACHE_SIZE", 0):
+            get_tag(self.tag_model, "red")
+            with self.assertNumQueries(0):
+                get_tag(self.tag_model, "red")
+
+    def test_invalidated(self):
+        "Check saving a tag invalidates the shared cache"
+        get_tag(self.tag_model, "red")
+        self.red.name = "Crimson"
+        self.red.save()
+        with self.assertRaises(self.tag_model.DoesNotExist):
+            get_tag(self.tag_model, "red")
+
+    def test_transaction_rollback(self):
+        "Check a tag loaded in a transaction which is rolled back is not shared"
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.tag_model.objects.create(name="Ghost")
+                get_tag(self.tag_model, "ghost")
+                raise ValueError("Roll back")
+        key = self.backend.get_key(self.tag_model, "ghost")
+        self.assertIsNone(self.cache.get(key))
+        self.assertIsNone(self.cache.get("%s:lock" % key))
+        with self.assertRaises(self.tag_model.DoesNotExist):
+            get_tag(self.tag_model, "ghost")
+
+    def test_transaction_change_invalidates(self):
+        "Check a tag shared while a change is in progress is invalidated on commit"
+        with transaction.atomic():
+            self.red.name = "Crimson"
+            self.red.save()
+            # Another process loads the tag before the change commits
+            key = self.backend.get_key(self.tag_model, "red")
+            self.cache.set(key, (self.red.pk, "Red", True))
+        with self.assertRaises(self.tag_model.DoesNotExist):
+            get_tag(self.tag_model, "red")
+
+    def test_misses_not_cached(self):
+        "Check a tag which is not found is not cached"
+        with self.assertRaises(self.tag_model.DoesNotExist):
+            get_tag(self.tag_model, "blue")
+        key = self.backend.get_key(self.tag_model, "blue")
+        self.assertIsNone(self.cache.get(key))
+        self.assertIsNone(self.cache.get("%s:lock" % key))
+
+    def test_wait_for_loader(self):
+        "Check a process waits for another which is loading the tag"
+        key = self.backend.get_key(self.tag_model, "red")
+        self.cache.add("%s:lock" % key, 1)
+
+        def sleep(seconds):
+            # The other process caches the row
+            self.cache.set(key, (self.red.pk, "Red", True))
+
+        with mock.patch("tagulous.cache.time.sleep", side_effect=sleep) as mock_sleep:
+            with self.assertNumQueries(0):
+                tag = get_tag(self.tag_model, "red")
+        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertEqual(tag.pk, self.red.pk)
+
+    def test_loader_failed(self):
+        "Check a waiting process loads the tag if the loader releases the lock"
+        key = self.backend.get_key(self.tag_model, "red")
+        self.cache.add("%s:lock" % key, 1)
+
+        def sleep(seconds):
+            self.cache.delete("%s:lock" % key)
+
+        with mock.patch("tagulous.cache.time.sleep", side_effect=sleep):
+            with self.assertNumQueries(1):
+                tag = get_tag(self.tag_model, "red")
+        self.assertEqual(tag.pk, self.red.pk)
+
+    def test_backend_setting(self):
+        "Check the backend class can be changed"
+        with mock.patch.object(
+            tag_settings,
+            "NAME_CACHE_BACKEND",
+            "tests.test_models_lookup.RecordingNameCache",
+        ):
+            self.assertIsInstance(get_name_cache_backend(), RecordingNameCache)
+            get_tag(self.tag_model, "Red")
+        self.assertEqual(RecordingNameCache.names, ["red"])
+        self.assertNotIsInstance(get_name_cache_backend(), RecordingNameCache)
+
+    def test_backend_disabled(self):
+        "Check the backend is not used without TAGULOUS_CACHE"
+        with mock.patch.object(tag_settings, "CACHE", None):
+            self.assertIsNone(get_name_cache_backend())
+
+
+class NameNormalisedTest(TagTestManager, TestCase):
+    """
+    Test the name_normalised option
+    """
+
+    manage_models = [test_models.NameNormalisedTest]
+
+    def setUpExtra(self):
+        self.model = test_models.NameNormalisedTest
+        self.tag_model = self.model.tags.tag_model
+        self.t1 = self.create(self.model, name="Test 1", singletag="Mr", tags="Red")
+        self.t2 = self.create(self.model, name="Test 2", tags="Red, Blue")
+
+    def assertUsesNormalised(self, ctx):
+        self.assertTrue(ctx.captured_queries)
+        for query in ctx.captured_queries:
+            self.assertIn("name_normalised", query["sql"])
+            self.assertNotIn("LIKE", query["sql"])
+
+    def test_field(self):
+        "Check the field is added and set from the name"
+        field = self.tag_model._meta.get_field("name_normalised")
+        self.assertTrue(field.unique)
+        red = self.tag_model.objects.get(name="Red")
+        self.assertEqual(red.name_normalised, "red")
+        red.name = "Crimson"
+        red.save(update_fields=["name"])
+        red.refresh_from_db()
+        self.assertEqual(red.name_normalised, "crimson")
+
+    def test_not_added(self):
+        "Check the field is only added with the option"
+        with self.assertRaises(Exception):
+            test_models.SimpleMixedTest.tags.tag_model._meta.get_field(
+                "name_normalised"
+            )
+
+    def test_unique(self):
+        "Check names differing only by case are rejected by the database"
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                self.tag_model.objects.create(name="RED")
+
+    def test_get_tag(self):
+        "Check tags are found by their normalised name"
+        with CaptureQueriesContext(connection) as ctx:
+            tag = get_tag(self.tag_model, "RED")
+        self.assertEqual(tag.name, "Red")
+        self.assertUsesNormalised(ctx)
+
+    def test_set_tags(self):
+        "Check setting tags by name finds existing tags by normalised name"
+        self.t1.tags = "RED, BLUE"
+        self.t1.save()
+        self.assertTagModel(self.tag_model, {"Red": 2, "Blue": 2})
+
+    def test_filter_tagfield(self):
+        "Check filtering a TagField uses the normalised name"
+        with CaptureQueriesContext(connection) as ctx:
+            names = list(
+                self.model.objects.filter(tags="BLUE").values_list("name", flat=True)
+            )
+        self.assertEqual(names, ["Test 2"])
+        self.assertUsesNormalised(ctx)
+        for strategy in ("chain", "group", "exists"):
+            qs = self.model.objects.tag_filter_strategy(strategy).filter(
+                tags__all="RED, blue"
+            )
+            self.assertEqual(list(qs.values_list("name", flat=True)), ["Test 2"])
+
+    def test_filter_singletag(self):
+        "Check filtering a SingleTagField uses the normalised name"
+        with CaptureQueriesContext(connection) as ctx:
+            names = list(
+                self.model.objects.filter(singletag="MR").values_list("name", flat=True)
+            )
+        self.assertEqual(names, ["Test 1"])
+        self.assertUsesNormalised(ctx)
+
+    def test_autocomplete(self):
+        "Check the autocomplete view uses the normalised name"
+        request = RequestFactory().get("/", {"q": "RE"})
+        with CaptureQueriesContext(connection) as ctx:
+            response = views.autocomplete(request, self.tag_model)
+        self.assertEqual(json.loads(response.content)["results"], ["Red"])
+        self.assertIn("name_normalised", ctx.captured_queries[0]["sql"])
+
+    def test_migration_helper(self):
+        "Check the migration helper fills the field from the tag names"
+        operations = add_name_normalised("Tagulous_NameNormalisedTest_tags")
+        self.assertEqual(len(operations), 3)
+        self.assertIsInstance(operations[0], migrations.AddField)
+        self.assertIsInstance(operations[1], migrations.RunPython)
+        self.assertIsInstance(operations[2], migrations.AlterField)
+        self.assertTrue(operations[0].field.null)
+        self.assertFalse(operations[0].field.unique)
+        self.assertTrue(operations[2].field.unique)
+
+        for pk in self.tag_model.objects.values_list("pk", flat=True):
+            self.tag_model.objects.filter(pk=pk).update(name_normalised="x%d" % pk)
+        set_values = operations[1].code
+        set_values.app_label = "tagulous_tests_app"
+        set_values(apps, None)
+        self.assertEqual(
+            sorted(self.tag_model.objects.values_list("name_normalised", flat=True)),
+            ["blue", "red"],
+        )
@@ -0,0 +1,170 @@
+"""
+Tagulous test: Tag field lookups
+
+Modules tested:
+    tagulous.models.lookups
+"""
+
+from django.db import models
+from django.test import TestCase
+
+from tagulous.models.lookups import TagThroughForeignKey
+from tests.lib import TagTestManager
+from tests.tagulous_tests_app import models as test_models
+
+
+class ModelTagFieldLookupTest(TagTestManager, TestCase):
+    """
+    Test lookups on TagFields
+    """
+
+    manage_models = [test_models.MixedTest]
+
+    def setUpExtra(self):
+        self.test_model = test_models.MixedTest
+        self.o1 = self.test_model.objects.create(name="Test 1", tags="red, green, blue")
+        self.o2 = self.test_model.objects.create(name="Test 2", tags="red, green")
+        self.o3 = self.test_model.objects.create(name="Test 3", tags="yellow")
+        self.o4 = self.test_model.objects.create(name="Test 4")
+
+    def assertNames(self, qs, names):
+        self.assertEqual(sorted(obj.name for obj in qs), names)
+
+    def test_all(self):
+        qs = self.test_model.objects.filter(tags__all="red, blue")
+        self.assertNames(qs, ["Test 1"])
+
+    def test_all_no_duplicates(self):
+        qs = self.test_model.objects.filter(tags__all="red, green")
+        self.assertNames(qs, ["Test 1", "Test 2"])
+
+    def test_all_case_insensitive(self):
+        qs = self.test_model.objects.filter(tags__all="RED, Blue")
+        self.assertNames(qs, ["Test 1"])
+
+    def test_all_case_variants(self):
+        qs = self.test_model.objects.filter(tags__all="Red, red, blue")
+        self.assertNames(qs, ["Test 1"])
+
+    def test_all_missing_tag(self):
+        qs = self.test_model.objects.filter(tags__all="red, purple")
+        self.assertNames(qs, [])
+
+    def test_all_empty(self):
+        qs = self.test_model.objects.filter(tags__all="")
+        self.assertNames(qs, ["Test 1", "Test 2", "Test 3"])
+
+    def test_all_exclude(self):
+        qs = self.test_model.objects.exclude(tags__all="red, blue")
+        self.assertNames(qs, ["Test 2", "Test 3", "Test 4"])
+
+    def test_any(self):
+        qs = self.test_model.objects.filter(tags__any="blue, yellow")
+        self.assertNames(qs, ["Test 1", "Test 3"])
+
+    def test_any_no_duplicates(self):
+        qs = self.test_model.objects.filter(tags__any="red, green")
+        self.assertNames(qs, ["Test 1", "Test 2"])
+
+    def test_any_list(self):
+        tag = self.test_model.tags.tag_model.objects.get(name="yellow")
+        qs = self.test_model.objects.filter(tags__any=["blue", tag])
+        self.assertNames(qs, ["Test 1", "Test 3"])
+
+    def test_any_empty(self):
+        qs = self.test_model.objects.filter(tags__any="")
+        self.assertNames(qs, [])
+
+    def test_any_exclude(self):
+        qs = self.test_model.objects.exclude(tags__any="red")
+        self.assertNames(qs, ["Test 3", "Test 4"])
+
+    def test_none(self):
+        qs = self.test_model.objects.filter(tags__none="blue")
+        self.assertNames(qs, ["Test 2", "Test 3"])
+
+    def test_none_exclude(self):
+        qs = self.test_model.objects.exclude(tags__none="blue")
+        self.assertNames(qs, ["Test 1", "Test 4"])
+
+    def test_q(self):
+        qs = self.test_model.objects.filter(
+            models.Q(tags__all="red, blue") | models.Q(name="Test 3")
+        )
+        self.assertNames(qs, ["Test 1", "Test 3"])
+
+    def test_subquery(self):
+        subqs = self.test_model.objects.filter(tags__any="yellow").values("pk")
+        qs = self.test_model.objects.filter(pk__in=models.Subquery(subqs))
+        self.assertNames(qs, ["Test 3"])
+
+    def test_base_manager(self):
+        "Check lookups work on querysets which are not enhanced"
+        qs = self.test_model._base_manager.filter(tags__all="red, blue")
+        self.assertNames(qs, ["Test 1"])
+
+    def test_through_model(self):
+        "Check the through model is auto-created with a TagThroughForeignKey"
+        field = self.test_model._meta.get_field("tags")
+        through = field.remote_field.through
+        self.assertEqual(through._meta.auto_created, self.test_model)
+        tag_fk = through._meta.get_field(field.m2m_reverse_field_name())
+        self.assertIs(type(tag_fk), TagThroughForeignKey)
+        self.assertIs(tag_fk.tag_field, field)
+        self.assertIs(
+            type(through._meta.get_field(field.m2m_field_name())), models.ForeignKey
+        )
+
+
+class ModelTagFieldLookupOptionsTest(TagTestManager, TestCase):
+    """
+    Test tag options on TagField lookups
+    """
+
+    manage_models = [test_models.TagFieldOptionsModel]
+
+    def setUpExtra(self):
+        self.test_model = test_models.TagFieldOptionsModel
+        self.test_model.objects.create(name="Test 1", case_sensitive_true="Adam")
+        self.test_model.objects.create(name="Test 2", case_sensitive_true="adam")
+
+    def test_case_sensitive(self):
+        qs = self.test_model.objects.filter(case_sensitive_true__any="adam")
+        self.assertEqual([obj.name for obj in qs], ["Test 2"])
+
+
+class ModelSingleTagFieldLookupTest(TagTestManager, TestCase):
+    """
+    Test lookups on SingleTagFields
+    """
+
+    manage_models = [test_models.MixedTest]
+
+    def setUpExtra(self):
+        self.test_model = test_models.MixedTest
+        self.test_model.objects.create(name="Test 1", singletag="Mr")
+        self.test_model.objects.create(name="Test 2", singletag="Mrs")
+        self.test_model.objects.create(name="Test 3")
+
+    def assertNames(self, qs, names):
+        self.assertEqual(sorted(obj.name for obj in qs), names)
+
+    def test_any(self):
+        qs = self.test_model.objects.filter(singletag__any="mr, dr")
+        self.assertNames(qs, ["Test 1"])
+
+    def test_any_empty(self):
+        qs = self.test_model.objects.filter(singletag__any="")
+        self.assertNames(qs, [])
+
+    def test_any_exclude(self):
+        qs = self.test_model.objects.exclude(singletag__any="mrs")
+        self.assertNames(qs, ["Test 1", "Test 3"])
+
+    def test_none(self):
+        qs = self.test_model.objects.filter(singletag__none="mr")
+        self.assertNames(qs, ["Test 2", "Test 3"])
+
+    def test_none_empty(self):
+        qs = self.test_model.objects.filter(singletag__none="")
+        self.assertNames(qs, ["Test 1", "Test 2", "Test 3"])
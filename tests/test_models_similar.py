@@ -0,0 +1,104 @@
+"""
+Tagulous test: Similar objects
+
+Modules tested:
+    tagulous.models.similar
+    tagulous.contrib.similar
+"""
+
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from tagulous.contrib.similar.models import SimilarObject
+from tagulous.models.similar import get_similar, rebuild_similar
+from tests.lib import TagTestManager
+from tests.tagulous_tests_app import models as test_models
+
+
+class PrecomputedSimilarTest(TagTestManager, TestCase):
+    """
+    Test precomputed similar objects
+    """
+
+    manage_models = [test_models.PrecomputedSimilarTest]
+
+    def setUpExtra(self):
+        self.model = test_models.PrecomputedSimilarTest
+        self.field = self.model._meta.get_field("tags")
+        self.t1 = self.create(self.model, name="t1", tags="one, two, three")
+        self.t2 = self.create(self.model, name="t2", tags="one, two")
+        self.t3 = self.create(self.model, name="t3", tags="three")
+        self.t4 = self.create(self.model, name="t4", tags="four")
+
+    def get_similar(self, obj):
+        return [
+            (self.model.objects.get(pk=pk).name, similarity)
+            for pk, similarity in get_similar(self.field, obj.pk, 10)
+        ]
+
+    def test_stored(self):
+        "Check the most similar objects are stored when tags are saved"
+        self.assertEqual(self.get_similar(self.t1), [("t2", 2), ("t3", 1)])
+        self.assertEqual(self.get_similar(self.t2), [("t1", 2)])
+        self.assertEqual(self.get_similar(self.t3), [("t1", 1)])
+        self.assertEqual(self.get_similar(self.t4), [])
+
+    def test_limited(self):
+        "Check no more than precompute_similar objects are stored"
+        self.create(self.model, name="t5", tags="one, two, three")
+        self.assertEqual(
+            SimilarObject.objects.filter(object_pk=str(self.t1.pk)).count(), 2
+        )
+        self.assertEqual(self.get_similar(self.t1), [("t5", 3), ("t2", 2)])
+
+    def test_updated_on_change(self):
+        "Check others are updated when an object's tags change"
+        self.t3.tags.add("one")
+        self.assertEqual(self.get_similar(self.t3), [("t1", 2), ("t2", 1)])
+        self.assertEqual(self.get_similar(self.t1), [("t2", 2), ("t3", 2)])
+
+        self.t3.tags = "four"
+        self.t3.save()
+        self.assertEqual(self.get_similar(self.t3), [("t4", 1)])
+        self.assertEqual(self.get_similar(self.t1), [("t2", 2)])
+        self.assertEqual(self.get_similar(self.t4), [("t3", 1)])
+
+    def test_removed_on_delete(self):
+        "Check a deleted object is removed from others"
+        pk = self.t3.pk
+        self.t3.delete()
+        self.assertEqual(self.get_similar(self.t1), [("t2", 2)])
+        self.assertFalse(SimilarObject.objects.filter(object_pk=str(pk)).exists())
+
+    def test_queryset(self):
+        "Check similarly_tagged uses the stored objects when limited"
+        with self.assertNumQueries(2):
+            similar = list(self.model.objects.similarly_tagged(self.t1, "tags", 2))
+        self.assertEqual(similar, [self.t2, self.t3])
+        self.assertEqual(similar[0].tagulous_similarity, 2)
+
+    def test_queryset_over_limit(self):
+        "Check similarly_tagged is not limited by the stored objects"
+        self.create(self.model, name="t5", tags="three")
+        similar = self.model.objects.similarly_tagged(self.t1, "tags", 3)
+        self.assertEqual([obj.name for obj in similar], ["t2", "t3", "t5"])
+
+    def test_rebuild(self):
+        "Check rebuilding restores the stored objects"
+        SimilarObject.objects.all().delete()
+        self.assertEqual(rebuild_similar(self.field, batch_size=3), 4)
+        self.assertEqual(self.get_similar(self.t1), [("t2", 2), ("t3", 1)])
+        self.assertEqual(self.get_similar(self.t4), [])
+
+    def test_command(self):
+        "Check the management command rebuilds the stored objects"
+        SimilarObject.objects.all().delete()
+        out = StringIO()
+        call_command("tagulous_rebuild_similar", stdout=out)
+        self.assertEqual(
+            out.getvalue(),
+            "Rebuilt tagulous_tests_app.PrecomputedSimilarTest.tags for 4 objects\n",
+        )
+        self.assertEqual(self.get_similar(self.t1), [("t2", 2), ("t3", 1)])
@@ -10,8 +10,9 @@ Modules tested:
 """
 
 from django.core import exceptions
-from django.db import models
+from django.db import connection, models
 from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
 from tagulous import models as tag_models
 from tests.lib import TagTestManager, skip_if_mysql
@@ -44,6 +45,78 @@ class ModelSingleTagFieldTest(TagTestManager, TestCase):
         self.assertInstanceEqual(t1, name="Test", title=None)
         self.assertTagModel(self.tag_model, {})
 
+    def test_manager_lazy(self):
+        "Check the manager does not load the tag until it is needed"
+        self.create(self.test_model, name="Test", title="Mr")
+        t1 = self.test_model.objects.get(name="Test")
+        with self.assertNumQueries(0):
+            manager = self.tag_field.get_manager(t1)
+        with self.assertNumQueries(1):
+            self.assertEqual(manager.tag_name, "Mr")
+
+    def test_get_cached(self):
+        "Check the tag is only loaded once when it is read repeatedly"
+        self.create(self.test_model, name="Test", title="Mr")
+        t1 = self.test_model.objects.get(name="Test")
+        with self.assertNumQueries(1):
+            self.assertEqual(t1.title.name, "Mr")
+            self.assertEqual(t1.title.name, "Mr")
+        self.assertIs(t1.title, t1.title)
+
+    def test_get_cached_after_assign(self):
+        "Check an assigned tag is only looked up once before it is saved"
+        self.create(self.test_model, name="Test 1", title="Mr")
+        t2 = self.test_model(name="Test 2", title="Mr")
+        with self.assertNumQueries(1):
+            self.assertEqual(t2.title.name, "Mr")
+            self.assertEqual(t2.title.name, "Mr")
+        t2.save()
+        self.assertTagModel(self.tag_model, {"Mr": 2})
+
+    def test_get_cached_deleted(self):
+        "Check an assigned tag deleted before the instance is saved is recreated"
+        self.tag_model.objects.create(name="Mrs")
+        t1 = self.test_model(name="Test 1", title="Mrs")
+        self.assertTrue(t1.title.pk)
+        self.tag_model.objects.get(name="Mrs").delete()
+        t1.save()
+        self.assertTagModel(self.tag_model, {"Mrs": 1})
+        t1.refresh_from_db()
+        self.assertEqual(t1.title.name, "Mrs")
+
+    def test_get_cached_name_change(self):
+        "Check the cached tag is replaced when the tag name changes"
+        t1 = self.create(self.test_model, name="Test", title="Mr")
+        self.assertEqual(t1.title.name, "Mr")
+        t1.title = "Mrs"
+        self.assertEqual(t1.title.name, "Mrs")
+        t1.title = "Mr"
+        self.assertEqual(t1.title.name, "Mr")
+        self.assertTrue(t1.title.pk)
+
+    def test_get_cached_fk_change(self):
+        "Check the cached tag is not used if the foreign key is changed"
+        t1 = self.create(self.test_model, name="Test 1", title="Mr")
+        t2 = self.create(self.test_model, name="Test 2", title="Mrs")
+        self.assertEqual(t1.title.name, "Mr")
+        t1.title_id = t2.title_id
+        self.assertEqual(t1.title.name, "Mrs")
+
+    def test_save_untouched(self):
+        "Check saving an instance without touching its tag does no tag work"
+        self.create(self.test_model, name="Test", title="Mr")
+        t1 = self.test_model.objects.get(name="Test")
+        manager_name = self.tag_field.field.get_manager_name()
+
+        t1.name = "Changed"
+        with CaptureQueriesContext(connection) as ctx:
+            t1.save()
+        self.assertNotIn(manager_name, t1.__dict__)
+        tag_table = self.tag_model._meta.db_table
+        self.assertFalse([q for q in ctx.captured_queries if tag_table in q["sql"]])
+        self.assertInstanceEqual(t1, name="Changed", title="Mr")
+        self.assertTagModel(self.tag_model, {"Mr": 1})
+
     def test_tag_assign_in_constructor(self):
         "Check a tag string can be set in the constructor"
         t1 = self.test_model(name="Test", title="Mr")
@@ -493,6 +566,14 @@ class ModelSingleTagFieldRequiredTest(TagTestManager, TestCase):
             test_models.SingleTagFieldRequiredModel.objects.create(name="Test")
         self.assertEqual(cm.exception.messages[0], "This field cannot be null.")
 
+    def test_required_save_untouched(self):
+        "Check a required SingleTagField with a tag saves without touching it"
+        test_models.SingleTagFieldRequiredModel.objects.create(name="Test", tag="Mr")
+        t1 = test_models.SingleTagFieldRequiredModel.objects.get(name="Test")
+        t1.name = "Changed"
+        t1.save()
+        self.assertEqual(t1.tag.name, "Mr")
+
 
 # ##############################################################################
 # ###### Test multiple SingleTagFields on a model
@@ -9,8 +9,9 @@ Modules tested:
     tagulous.models.fields.TagField
 """
 
-from django.db import models
+from django.db import connection, models
 from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
 from tagulous import models as tag_models
 from tests.lib import TagTestManager, skip_if_mysql
@@ -51,6 +52,35 @@ class ModelTagFieldTest(TagTestManager, TestCase):
         # Check it also has a reference to the correct model
         self.assertEqual(t1.tags.tag_model, self.tag_model)
 
+    def test_manager_class_cached(self):
+        "Check the TagRelatedManager class is only created once"
+        t1 = self.create(self.test_model, name="Test 1")
+        t2 = self.create(self.test_model, name="Test 2")
+        self.assertIs(t1.tags.__class__, t2.tags.__class__)
+
+    def test_save_untouched(self):
+        "Check saving an instance without touching its tags does no tag work"
+        self.create(self.test_model, name="Test", tags="blue, red")
+        t1 = self.test_model.objects.get(name="Test")
+        manager_name = self.tag_field.field.get_manager_name()
+
+        t1.name = "Changed"
+        with CaptureQueriesContext(connection) as ctx:
+            t1.save()
+        self.assertNotIn(manager_name, t1.__dict__)
+        tag_tables = (
+            self.tag_model._meta.db_table,
+            self.tag_field.field.remote_field.through._meta.db_table,
+        )
+        self.assertFalse(
+            [
+                q
+                for q in ctx.captured_queries
+                if any(table in q["sql"] for table in tag_tables)
+            ]
+        )
+        self.assertTagModel(self.tag_model, {"blue": 1, "red": 1})
+
     def test_tag_assign_before_save(self):
         """
         Check a tag string can be assigned to an instance which hasn't yet
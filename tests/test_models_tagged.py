@@ -9,13 +9,17 @@ Modules tested:
 
 import inspect
 import pickle
+from unittest import mock
 
 from django.core.exceptions import MultipleObjectsReturned
 from django.db import models
+from django.db.models.signals import post_save, pre_delete, pre_save
 from django.test import TestCase
 
 from tagulous import models as tag_models
+from tagulous import settings as tag_settings
 from tagulous.models.tagged import _split_kwargs
+from tagulous.signals import post as post_signals
 from tests.lib import TagTestManager, skip_if_mysql
 from tests.tagulous_tests_app import models as test_models
 
@@ -71,6 +75,54 @@ class ModelTaggedTest(TagTestManager, TestCase):
         self.assertEqual(str(t2.tags), "blue, red")
 
 
+# ##############################################################################
+# ###### Test signal registry
+# ##############################################################################
+
+
+class ModelTaggedSignalRegistryTest(TagTestManager, TestCase):
+    """
+    Test tagged models are registered with the post signal handlers
+    """
+
+    def test_tagged_model_registered(self):
+        "Check a tagged model maps to its tag fields"
+        self.assertEqual(
+            post_signals.tagged_model_fields[test_models.MixedTest],
+            (
+                (test_models.MixedTest.singletag.field, tag_models.SingleTagField),
+                (test_models.MixedTest.tags.field, tag_models.TagField),
+            ),
+        )
+
+    def test_concrete_inheritance_local_fields(self):
+        "Check inherited fields are not local to a concrete subclass"
+        model = test_models.TagFieldConcreteInheritanceModel
+        self.assertEqual(
+            post_signals.tagged_model_fields[model],
+            ((model.tags.field, tag_models.TagField),),
+        )
+        self.assertEqual(post_signals.tagged_model_local_fields[model], ())
+        self.assertEqual(
+            post_signals.tagged_model_local_fields[test_models.TagFieldModel],
+            ((test_models.TagFieldModel.tags.field, tag_models.TagField),),
+        )
+
+    def test_untagged_model_not_registered(self):
+        "Check a model without tag fields has no tag signal handlers"
+        model = test_models.NonTagRefTest
+        self.assertNotIn(model, post_signals.tagged_model_fields)
+        self.assertFalse(pre_save.has_listeners(model))
+        self.assertFalse(pre_delete.has_listeners(model))
+
+    def test_tag_model_registered(self):
+        "Check a tag model has the tag model signal handlers"
+        tag_model = test_models.MixedTest.singletag.tag_model
+        self.assertIn(tag_model, post_signals.tag_models)
+        self.assertNotIn(tag_model, post_signals.tagged_model_fields)
+        self.assertTrue(post_save.has_listeners(tag_model))
+
+
 # ##############################################################################
 # ###### Test _split_kwargs
 # ##############################################################################
@@ -166,6 +218,31 @@ class SplitKwargsText(TagTestManager, TestCase):
         self.assertEqual(len(tag_fields), 1)
         self.assertEqual(tag_fields["tags"], ("red", None))
 
+    def test_no_tag_fields(self):
+        "Kwargs without tag fields are returned as safe without copying"
+        kwargs = {"name__startswith": "Ad", "pk__gt": 0}
+        safe_fields, singletag_fields, tag_fields = _split_kwargs(
+            self.test_model, kwargs, lookups=True
+        )
+        self.assertIs(safe_fields, kwargs)
+        self.assertEqual(singletag_fields, {})
+        self.assertEqual(tag_fields, {})
+
+    def test_tag_field_map(self):
+        "Tag fields are found once and cached on the model"
+        tag_field_map = tag_models.get_tag_field_map(self.test_model)
+        self.assertEqual(
+            tag_field_map,
+            {
+                "singletag": (
+                    self.test_model._meta.get_field("singletag"),
+                    "singletag",
+                ),
+                "tags": (self.test_model._meta.get_field("tags"), "tag"),
+            },
+        )
+        self.assertIs(tag_models.get_tag_field_map(self.test_model), tag_field_map)
+
     def test_lookups_unknown(self):
         "Unknown fields in lookups passed as safe"
         safe_fields, singletag_fields, tag_fields = _split_kwargs(
@@ -492,6 +569,116 @@ class ModelTaggedQuerysetTest(TagTestManager, TestCase):
         self.assertEqual(str(unpickled_qs[2].tags), "green, red")
 
 
+class ModelTaggedQuerysetGroupTest(ModelTaggedQuerysetTest):
+    """
+    Test enhanced tagged model querysets with the group filter strategy
+    """
+
+    strategy = "group"
+
+    def setUpExtra(self):
+        patcher = mock.patch.object(tag_settings, "FILTER_STRATEGY", self.strategy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUpExtra()
+
+    def test_strategy_sql(self):
+        "Check the strategy is used for the query"
+        qs1 = self.test_model.objects.filter(tags="red, blue")
+        sql = str(qs1.query)
+        self.assertIn("GROUP BY", sql)
+        self.assertNotIn("EXISTS", sql)
+
+
+class ModelTaggedQuerysetExistsTest(ModelTaggedQuerysetGroupTest):
+    """
+    Test enhanced tagged model querysets with the exists filter strategy
+    """
+
+    strategy = "exists"
+
+    def test_strategy_sql(self):
+        "Check the strategy is used for the query"
+        qs1 = self.test_model.objects.filter(tags="red, blue")
+        sql = str(qs1.query)
+        self.assertEqual(sql.count("EXISTS"), 2)
+        self.assertNotIn("GROUP BY", sql)
+
+
+class ModelTaggedQuerysetStrategyTest(TagTestManager, TestCase):
+    """
+    Test selecting the filter strategy for tagged model querysets
+    """
+
+    manage_models = [test_models.MixedTest]
+
+    def setUpExtra(self):
+        self.test_model = test_models.MixedTest
+        self.o1 = self.test_model.objects.create(name="Test 1", tags="a, b, c, d")
+        self.o2 = self.test_model.objects.create(name="Test 2", tags="a, b, c")
+
+    def test_auto_chain(self):
+        "Check auto strategy chains joins up to the limit"
+        qs1 = self.test_model.objects.filter(tags="a, b")
+        self.assertNotIn("GROUP BY", str(qs1.query))
+        self.assertEqual(qs1.count(), 2)
+
+    def test_auto_group(self):
+        "Check auto strategy groups once over the limit"
+        qs1 = self.test_model.objects.filter(tags="a, b, d")
+        self.assertIn("GROUP BY", str(qs1.query))
+        self.assertEqual(list(qs1), [self.o1])
+
+    def test_auto_limit_setting(self):
+        "Check auto strategy limit can be changed"
+        with mock.patch.object(tag_settings, "FILTER_CHAIN_MAX", 4):
+            qs1 = self.test_model.objects.filter(tags="a, b, d")
+            self.assertNotIn("GROUP BY", str(qs1.query))
+        self.assertEqual(list(qs1), [self.o1])
+
+    def test_queryset_strategy(self):
+        "Check the strategy can be set on the queryset and survives cloning"
+        qs1 = self.test_model.objects.tag_filter_strategy("exists")
+        qs1 = qs1.exclude(name="Test 3").filter(tags="a, b")
+        self.assertIn("EXISTS", str(qs1.query))
+        self.assertEqual(qs1.count(), 2)
+
+    def test_queryset_strategy_overrides_setting(self):
+        "Check the strategy on the queryset overrides the setting"
+        with mock.patch.object(tag_settings, "FILTER_STRATEGY", "group"):
+            qs1 = self.test_model.objects.tag_filter_strategy("chain").filter(
+                tags="a, b, c, d"
+            )
+            self.assertNotIn("GROUP BY", str(qs1.query))
+        self.assertEqual(list(qs1), [self.o1])
+
+    def test_queryset_strategy_invalid(self):
+        "Check an unknown strategy raises a ValueError"
+        with self.assertRaises(ValueError) as cm:
+            self.test_model.objects.tag_filter_strategy("invalid")
+        self.assertEqual(str(cm.exception), "Unknown tag filter strategy 'invalid'")
+
+    def test_case_variants(self):
+        "Check names which only differ by case match the same tag in each strategy"
+        for strategy in ("chain", "group", "exists"):
+            qs1 = self.test_model.objects.tag_filter_strategy(strategy)
+            self.assertEqual(
+                list(qs1.filter(tags="A, a, d").order_by("pk")), [self.o1], strategy
+            )
+
+    def test_group_exact(self):
+        "Check group strategy only matches exact tag sets"
+        qs1 = self.test_model.objects.tag_filter_strategy("group")
+        self.assertEqual(list(qs1.filter(tags__exact="a, b, c")), [self.o2])
+        self.assertEqual(list(qs1.exclude(tags__exact="a, b, c")), [self.o1])
+
+    def test_exists_exact(self):
+        "Check exists strategy only matches exact tag sets"
+        qs1 = self.test_model.objects.tag_filter_strategy("exists")
+        self.assertEqual(list(qs1.filter(tags__exact="a, b, c")), [self.o2])
+        self.assertEqual(list(qs1.exclude(tags__exact="a, b, c")), [self.o1])
+
+
 @skip_if_mysql
 class ModelTaggedQuerysetOptionsSingleTest(TagTestManager, TestCase):
     """
@@ -600,3 +787,16 @@ class ModelTaggedQuerysetOptionsTest(TagTestManager, TestCase):
         "Check case insensitive matches"
         qs1 = self.test_model.objects.exclude(case_sensitive_false="adam")
         self.assertEqual(qs1.count(), 0)
+
+
+class ModelTaggedQuerysetOptionsGroupTest(ModelTaggedQuerysetOptionsTest):
+    """
+    Test tag options on tagged model querysets, for TagField with the group
+    filter strategy
+    """
+
+    def setUpExtra(self):
+        patcher = mock.patch.object(tag_settings, "FILTER_STRATEGY", "group")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUpExtra()
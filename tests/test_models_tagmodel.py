@@ -9,10 +9,15 @@ Modules tested:
     tagulous.models.models.TagModelQuerySet
 """
 
+import math
+import pickle
 from string import punctuation
+from unittest import mock
 
-from django.db import IntegrityError
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 import tagulous.settings as tagulous_settings
 from tagulous import models as tag_models
@@ -444,6 +449,47 @@ class TagModelTest(TagTestManager, TestCase):
         for i in range(1, num_clashes):
             self.assertEqual(tests[i].slug, f"one-and-two_{i}")
 
+    def test_slug_clash__highest_number(self):
+        "Check slug clash avoidance follows the highest number, not the count"
+        self.tag_model.objects.create(name="one and two")
+        t2 = self.tag_model.objects.create(name="One and Two!")
+        self.tag_model.objects.filter(pk=t2.pk).update(slug="one-and-two_10")
+        t3 = self.tag_model.objects.create(name="One and Two?")
+        self.assertEqual(t3.slug, "one-and-two_11")
+
+    def test_slug_clash__ignores_other_suffixes(self):
+        "Check slugs with the same prefix but no number are ignored"
+        self.tag_model.objects.create(name="one and two")
+        t2 = self.tag_model.objects.create(name="One and Two!")
+        self.tag_model.objects.filter(pk=t2.pk).update(slug="one-and-two_99x")
+        with CaptureQueriesContext(connection) as ctx:
+            t3 = self.tag_model.objects.create(name="One and Two?")
+        self.assertEqual(t3.slug, "one-and-two_1")
+        self.assertFalse(
+            any("REGEXP" in query["sql"] for query in ctx.captured_queries)
+        )
+
+    def test_slug_clash__retries(self):
+        "Check a number taken by another process is retried"
+        self.tag_model.objects.create(name="one and two")
+        self.tag_model.objects.create(name="One and Two!")
+        with mock.patch.object(
+            self.tag_model, "_next_slug_number", side_effect=[1, 2]
+        ) as mock_next:
+            t3 = self.tag_model.objects.create(name="One and Two?")
+        self.assertEqual(mock_next.call_count, 2)
+        self.assertEqual(t3.slug, "one-and-two_2")
+
+    def test_slug_clash__other_error_raised(self):
+        "Check an IntegrityError which is not a slug clash is raised"
+        self.tag_model.objects.create(name="one")
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                self.tag_model.objects.create(name="one")
+        self.assertEqual(
+            list(self.tag_model.objects.values_list("slug", flat=True)), ["one"]
+        )
+
     def test_tag_model_factory(self):
         "Check the tag model factory supports setting max lengths"
         TestModel = test_models.TagSlugShorterModel
@@ -950,6 +996,83 @@ class TagModelQuerySetTest(TagTestManager, TestCase):
             list(weighted.values_list("weight", flat=True)), [0, 0, 0, 3, 6, 3]
         )
 
+    def test_weight_log(self):
+        "Test weight() with a log scale spreads out lower counts"
+        for i in range(6):
+            self.model.objects.create(name="Test 3.%d" % i, initial_list="Eric")
+        for i in range(3):
+            self.model.objects.create(name="Test 4.%d" % i, initial_list="Frank")
+
+        # Counts are David=1, Frank=4, Eric=8
+        weighted = self.tag_model.objects.weight(0, 6)
+        self.assertEqual(
+            list(weighted.values_list("weight", flat=True)), [0, 0, 0, 0, 6, 3]
+        )
+        weighted = self.tag_model.objects.weight(0, 6, scale="log")
+        self.assertEqual(
+            list(weighted.values_list("weight", flat=True)), [0, 0, 0, 1, 6, 4]
+        )
+
+    def test_weight_scope_queryset(self):
+        "Test weight() can scale to the highest count in the queryset"
+        qs = self.tag_model.objects.filter(name__in=["David", "Frank"])
+        self.assertEqual(list(qs.weight(0, 6).values_list("weight", flat=True)), [3, 3])
+        self.assertEqual(
+            list(qs.weight(0, 6, scope="queryset").values_list("weight", flat=True)),
+            [6, 6],
+        )
+        self.assertEqual(
+            list(
+                qs.weight(0, 6, scale="log", scope="queryset").values_list(
+                    "weight", flat=True
+                )
+            ),
+            [6, 6],
+        )
+
+    def test_weight_scope_queryset__no_associated(self):
+        "Test weight() scoped to a queryset of tags which are not used"
+        qs = self.tag_model.objects.filter(name__in=["Adam", "Brian"])
+        self.assertEqual(
+            list(qs.weight(1, 6, scope="queryset").values_list("weight", flat=True)),
+            [1, 1],
+        )
+
+    def test_weight_invalid(self):
+        "Test weight() rejects unknown scales and scopes"
+        with self.assertRaisesMessage(ValueError, "Unknown weight scale 'x'"):
+            self.tag_model.objects.weight(scale="x")
+        with self.assertRaisesMessage(ValueError, "Unknown weight scope 'x'"):
+            self.tag_model.objects.weight(scope="x")
+
+    def test_weight_max_count_cached(self):
+        "Test weight() caches the max count until a count changes"
+        with mock.patch.object(tagulous_settings, "CACHE", "default"):
+            caches["default"].clear()
+            with self.assertNumQueries(2):
+                list(self.tag_model.objects.weight())
+            with self.assertNumQueries(1):
+                weighted = list(self.tag_model.objects.weight(0, 6))
+            self.assertEqual([tag.weight for tag in weighted], [0, 0, 0, 3, 6, 3])
+
+            # Changing a count invalidates the cache
+            self.model.objects.create(name="Test 3", initial_list="Eric, Frank")
+            with self.assertNumQueries(2):
+                weighted = list(self.tag_model.objects.weight(0, 6))
+            self.assertEqual([tag.weight for tag in weighted], [0, 0, 0, 2, 6, 4])
+
+    def test_weight_max_count_commit(self):
+        "Test the max count is invalidated again when a count change commits"
+        with mock.patch.object(tagulous_settings, "CACHE", "default"):
+            caches["default"].clear()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.model.objects.create(name="Test 3", initial_list="Eric, Frank")
+
+                # Another connection could cache the old max count before commit
+                list(self.tag_model.objects.weight())
+            with self.assertNumQueries(2):
+                list(self.tag_model.objects.weight())
+
     def test_to_string(self):
         "Check manager and queryset can be converted to a tag string"
         self.assertEqual(
@@ -995,6 +1118,106 @@ class TagModelQuerySetSimilarTest(TagTestManager, TestCase):
         similar = self.model.objects.similarly_tagged(t1, "tags")
         self.assertSequenceEqual(similar, [t3, t4, t2])
 
+    def test_queryset_similarly_tagged__annotated(self):
+        t1 = self.create(self.model, name="t1", singletag="one", tags="one, two")
+        self.create(self.model, name="t2", singletag="one", tags="two, three")
+        self.create(self.model, name="t3", singletag="one", tags="one, two")
+        similar = self.model.objects.similarly_tagged(t1, "tags")
+        self.assertEqual(
+            [(obj.name, obj.tagulous_similarity) for obj in similar],
+            [("t3", 2), ("t2", 1)],
+        )
+
+    def test_queryset_similarly_tagged__limit(self):
+        t1 = self.create(self.model, name="t1", singletag="one", tags="one, two")
+        self.create(self.model, name="t2", singletag="one", tags="two, three")
+        t3 = self.create(self.model, name="t3", singletag="one", tags="one, two")
+        similar = self.model.objects.similarly_tagged(t1, "tags", limit=1)
+        self.assertSequenceEqual(similar, [t3])
+        self.assertSequenceEqual(t1.tags.get_similar_objects(limit=1), [t3])
+
+    def test_queryset_similarly_tagged__min_score(self):
+        t1 = self.create(self.model, name="t1", singletag="one", tags="one, two")
+        self.create(self.model, name="t2", singletag="one", tags="two, three")
+        t3 = self.create(self.model, name="t3", singletag="one", tags="one, two")
+        similar = self.model.objects.similarly_tagged(t1, "tags", min_score=2)
+        self.assertSequenceEqual(similar, [t3])
+
+    def test_queryset_similarly_tagged__idf(self):
+        # "common" is on every object, so is worth less than "rare"
+        t1 = self.create(self.model, name="t1", singletag="one", tags="common, rare")
+        t2 = self.create(self.model, name="t2", singletag="one", tags="common, rare")
+        t3 = self.create(self.model, name="t3", singletag="one", tags="common, x, y")
+        t4 = self.create(self.model, name="t4", singletag="one", tags="common")
+        similar = list(self.model.objects.similarly_tagged(t1, "tags", score="idf"))
+        self.assertEqual(similar, [t2, t3, t4])
+        # Log of (4 objects + 1) / (tag count + 1) for each shared tag
+        self.assertAlmostEqual(similar[0].tagulous_similarity, math.log(5 / 3))
+        self.assertAlmostEqual(similar[1].tagulous_similarity, 0)
+
+        similar = self.model.objects.similarly_tagged(
+            t1, "tags", score="idf", min_score=0.5
+        )
+        self.assertSequenceEqual(similar, [t2])
+
+    def test_queryset_similarly_tagged__idf_cached(self):
+        t1 = self.create(self.model, name="t1", singletag="one", tags="common, rare")
+        self.create(self.model, name="t2", singletag="one", tags="common, rare")
+        table = self.model._meta.db_table
+        with mock.patch.object(tagulous_settings, "CACHE", "default"):
+            caches["default"].clear()
+            with CaptureQueriesContext(connection) as ctx:
+                list(self.model.objects.similarly_tagged(t1, "tags", score="idf"))
+                list(self.model.objects.similarly_tagged(t1, "tags", score="idf"))
+            counts = [
+                q
+                for q in ctx.captured_queries
+                if q["sql"].startswith("SELECT COUNT(*)") and table in q["sql"]
+            ]
+            self.assertEqual(len(counts), 1)
+
+            # Tagging another object changes the counts, so counts again
+            self.create(self.model, name="t3", singletag="one", tags="common")
+            similar = list(self.model.objects.similarly_tagged(t1, "tags", score="idf"))
+            self.assertAlmostEqual(similar[0].tagulous_similarity, math.log(4 / 3))
+
+    def test_queryset_similarly_tagged__idf_cached_objects(self):
+        t1 = self.create(self.model, name="t1", singletag="one", tags="common")
+        self.create(self.model, name="t2", singletag="one", tags="common")
+        with mock.patch.object(tagulous_settings, "CACHE", "default"):
+            caches["default"].clear()
+            similar = list(self.model.objects.similarly_tagged(t1, "tags", score="idf"))
+            self.assertAlmostEqual(similar[0].tagulous_similarity, math.log(3 / 3))
+
+            # Creating an untagged object changes no tag counts, but the total
+            t3 = self.create(self.model, name="t3")
+            similar = list(self.model.objects.similarly_tagged(t1, "tags", score="idf"))
+            self.assertAlmostEqual(similar[0].tagulous_similarity, math.log(4 / 3))
+
+            t3.delete()
+            similar = list(self.model.objects.similarly_tagged(t1, "tags", score="idf"))
+            self.assertAlmostEqual(similar[0].tagulous_similarity, math.log(3 / 3))
+
+    def test_queryset_similarly_tagged__jaccard(self):
+        t1 = self.create(self.model, name="t1", singletag="one", tags="one, two")
+        t2 = self.create(self.model, name="t2", singletag="one", tags="two, three")
+        t3 = self.create(self.model, name="t3", singletag="one", tags="one, two, three")
+        t4 = self.create(self.model, name="t4", singletag="one", tags="one")
+        similar = self.model.objects.similarly_tagged(t1, "tags", score="jaccard")
+        self.assertEqual(
+            [(obj, round(obj.tagulous_similarity, 3)) for obj in similar],
+            [(t3, 0.667), (t4, 0.5), (t2, 0.333)],
+        )
+        similar = self.model.objects.similarly_tagged(
+            t1, "tags", score="jaccard", min_score=0.5
+        )
+        self.assertSequenceEqual(similar, [t3, t4])
+
+    def test_queryset_similarly_tagged__invalid_score(self):
+        t1 = self.create(self.model, name="t1", singletag="one", tags="one")
+        with self.assertRaisesMessage(ValueError, "Unknown similarity score 'x'"):
+            self.model.objects.similarly_tagged(t1, "tags", score="x")
+
     def test_singletagfield_get_similar_objects__finds_other(self):
         t1 = self.create(self.model, name="t1", singletag="one", tags="one")
         t2 = self.create(self.model, name="t2", singletag="one", tags="two")
@@ -1021,6 +1244,23 @@ class TagModelQuerySetSimilarTest(TagTestManager, TestCase):
         similar_t2 = t2.singletag.get_similar_objects()
         self.assertSequenceEqual(similar_t2, [])
 
+    def test_singletagfield_get_similar_objects__not_from_field(self):
+        self.create(self.model, name="t1", singletag="one", tags="one")
+        tag = self.model.singletag.tag_model.objects.get(name="one")
+        with self.assertRaises(AttributeError) as cm:
+            tag.get_similar_objects()
+        self.assertEqual(
+            str(cm.exception),
+            "get_similar_objects() is only available on a tag retrieved from a "
+            "SingleTagField",
+        )
+
+    def test_singletagfield_get_similar_objects__pickle(self):
+        t1 = self.create(self.model, name="t1", singletag="one", tags="one")
+        tag = pickle.loads(pickle.dumps(t1.singletag))
+        self.assertEqual(tag, "one")
+        self.assertNotIn("_tagulous_source", tag.__dict__)
+
     # TagField related manager uses queryset.similarly_tagged, so these tests just need
     # to check instance and field_name are being correctly detected and passed
 
@@ -0,0 +1,146 @@
+"""
+Tagulous test: Tag usage
+
+Modules tested:
+    tagulous.models.usage
+    tagulous.contrib.counts
+"""
+
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from tagulous.contrib.counts.models import TagUsage
+from tagulous.models.usage import compact_usage, get_bucket
+from tests.lib import TagTestManager
+from tests.tagulous_tests_app import models as test_models
+
+
+class UsageTest(TagTestManager, TestCase):
+    """
+    Test usage is recorded for tag models with the track_usage option
+    """
+
+    manage_models = [test_models.UsageTest]
+
+    def setUpExtra(self):
+        self.model = test_models.UsageTest
+        self.tag_model = self.model.tags.tag_model
+        self.now = timezone.now()
+        patcher = mock.patch("django.utils.timezone.now", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_usage(self, tag_model):
+        return {
+            (int(tag_pk), bucket): delta
+            for tag_pk, bucket, delta in TagUsage.objects.filter(
+                tag_model=tag_model._meta.label
+            ).values_list("tag_pk", "bucket", "delta")
+        }
+
+    def test_tagfield(self):
+        "Check TagField adds and removals are recorded in the current period"
+        t1 = self.create(self.model, name="Test 1", tags="red, blue")
+        self.create(self.model, name="Test 2", tags="red")
+        red = self.tag_model.objects.get(name="red")
+        blue = self.tag_model.objects.get(name="blue")
+        t1.tags.remove("blue")
+        bucket = get_bucket(self.now, 300)
+        self.assertEqual(
+            self.get_usage(self.tag_model),
+            {(red.pk, bucket): 2, (blue.pk, bucket): 0},
+        )
+
+    def test_singletag(self):
+        "Check SingleTagField changes are recorded"
+        tag_model = self.model.singletag.tag_model
+        t1 = self.create(self.model, name="Test 1", singletag="Mr")
+        self.create(self.model, name="Test 2", singletag="Mr")
+        mr = tag_model.objects.get(name="Mr")
+        t1.singletag = "Mrs"
+        t1.save()
+        mrs = tag_model.objects.get(name="Mrs")
+        bucket = get_bucket(self.now, 300)
+        self.assertEqual(
+            self.get_usage(tag_model),
+            {(mr.pk, bucket): 1, (mrs.pk, bucket): 1},
+        )
+
+    def test_not_tracked(self):
+        "Check usage is not recorded without the option"
+        self.create(test_models.SimpleMixedTest, name="Test 1", tags="red")
+        self.assertFalse(TagUsage.objects.exists())
+
+    def test_trending(self):
+        "Check trending() ranks tags by their change in the window"
+        t1 = self.create(self.model, name="Test 1", tags="red")
+        self.now += datetime.timedelta(hours=2)
+        t1.tags = "red, blue"
+        t1.save()
+        self.create(self.model, name="Test 2", tags="blue, green")
+        self.create(self.model, name="Test 3", tags="red")
+        self.assertEqual(
+            list(self.tag_model.objects.trending(3600).values_list("name", "trend")),
+            [("blue", 2), ("green", 1), ("red", 1)],
+        )
+        self.assertEqual(
+            list(
+                self.tag_model.objects.trending(
+                    datetime.timedelta(hours=3)
+                ).values_list("name", "trend")
+            ),
+            [("blue", 2), ("red", 2), ("green", 1)],
+        )
+
+    def test_trending_one_query(self):
+        "Check trending() uses one query"
+        self.create(self.model, name="Test 1", tags="red, blue")
+        with CaptureQueriesContext(connection) as ctx:
+            list(self.tag_model.objects.trending())
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_trending_from_usage(self):
+        "Check trending() finds tags from the usage in the window"
+        self.create(self.model, name="Test 1", tags="red, blue")
+        self.tag_model.objects.create(name="green")
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(
+                list(self.tag_model.objects.trending().values_list("name", flat=True)),
+                ["blue", "red"],
+            )
+        sql = ctx.captured_queries[0]["sql"]
+        self.assertIn("IN (SELECT", sql)
+        self.assertIn("HAVING", sql)
+
+    def test_compact(self):
+        "Check old usage is merged into larger periods and the oldest removed"
+        # Keep the tag when unused, so its usage can go up and down
+        self.create(self.model, name="Test 0", tags="red")
+        red = self.tag_model.objects.get(name="red")
+        start = get_bucket(self.now, 3600)
+        TagUsage.objects.all().delete()
+        t1 = self.create(self.model, name="Test 1")
+        for minutes, tags in ((0, "red"), (5, ""), (10, "red"), (60 * 24 * 2, "")):
+            self.now = start + datetime.timedelta(minutes=minutes)
+            t1.tags = tags
+            t1.save()
+        self.assertEqual(TagUsage.objects.count(), 4)
+
+        out = StringIO()
+        call_command("tagulous_compact_usage", stdout=out)
+        self.assertEqual(out.getvalue(), "Merged 2 usage rows\n")
+        self.assertEqual(
+            self.get_usage(self.tag_model),
+            {(red.pk, start): 1, (red.pk, get_bucket(self.now, 300)): -1},
+        )
+
+        self.now += datetime.timedelta(days=1)
+        compact_usage(max_age=86400)
+        self.assertEqual(TagUsage.objects.count(), 1)
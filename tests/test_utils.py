@@ -6,8 +6,11 @@ Modules tested:
     tagulous.utils
 """
 
+from unittest import mock
+
 from django.test import TestCase
 
+from tagulous import settings as tag_settings
 from tagulous import utils as tag_utils
 
 # ##############################################################################
@@ -183,6 +186,26 @@ class UtilsParseTagsTest(TestCase):
         self.assertEqual(tags[0], '"adam" brian"')
         self.assertEqual(tags[1], "chris")
 
+    def test_quotes_escaped_odd(self):
+        tags = tag_utils.parse_tags('"""adam""" brian')
+        self.assertEqual(len(tags), 2)
+        self.assertEqual(tags[0], '"adam"')
+        self.assertEqual(tags[1], "brian")
+
+    def test_quotes_comma_delim_inner_quotes(self):
+        """
+        Tests quotes followed by spaces when delimiter is comma
+        """
+        tags = tag_utils.parse_tags('adam, "brian"  "chris"')
+        self.assertEqual(len(tags), 2)
+        self.assertEqual(tags[0], "adam")
+        self.assertEqual(tags[1], 'brian"  "chris')
+
+    def test_quotes_long(self):
+        names = ["tag %04d" % i for i in range(1000)]
+        tags = tag_utils.parse_tags(" ".join('"%s"' % name for name in names))
+        self.assertEqual(tags, names)
+
     def test_empty_tag(self):
         tags = tag_utils.parse_tags('"adam" , , brian , ')
         self.assertEqual(len(tags), 2)
@@ -220,6 +243,69 @@ class UtilsParseTagsTest(TestCase):
         self.assertEqual(tags[1], "brian chris")
 
 
+class UtilsParseTagsCacheTest(TestCase):
+    "Test utils.parse_tags with the parse cache"
+
+    def setUp(self):
+        patcher = mock.patch.object(tag_settings, "PARSE_CACHE_SIZE", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tag_utils.parse_cache_clear()
+        self.addCleanup(tag_utils.parse_cache_clear)
+
+    def test_disabled(self):
+        with mock.patch.object(tag_settings, "PARSE_CACHE_SIZE", 0):
+            self.assertEqual(tag_utils.parse_tags("adam, brian"), ["adam", "brian"])
+            self.assertIsNone(tag_utils.parse_cache_info())
+
+    def test_hit(self):
+        tags = tag_utils.parse_tags('"adam", brian')
+        self.assertEqual(tags, ["adam", "brian"])
+        tags = tag_utils.parse_tags('"adam", brian')
+        self.assertEqual(tags, ["adam", "brian"])
+        info = tag_utils.parse_cache_info()
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.maxsize, 2)
+
+    def test_keyed_by_space_delimiter(self):
+        self.assertEqual(tag_utils.parse_tags("adam brian"), ["adam", "brian"])
+        self.assertEqual(
+            tag_utils.parse_tags("adam brian", space_delimiter=False), ["adam brian"]
+        )
+        self.assertEqual(tag_utils.parse_cache_info().misses, 2)
+
+    def test_result_is_copy(self):
+        tags = tag_utils.parse_tags("adam, brian")
+        tags.append("chris")
+        self.assertEqual(tag_utils.parse_tags("adam, brian"), ["adam", "brian"])
+
+    def test_limit(self):
+        tag_utils.parse_tags("adam,brian,chris")
+        with self.assertRaises(ValueError) as cm:
+            tag_utils.parse_tags("adam,brian,chris", 1)
+        self.assertEqual(str(cm.exception), "This field can only have 1 argument")
+        self.assertEqual(tag_utils.parse_cache_info().hits, 1)
+
+    def test_evicts(self):
+        tag_utils.parse_tags("adam")
+        tag_utils.parse_tags("brian")
+        tag_utils.parse_tags("chris")
+        tag_utils.parse_tags("adam")
+        info = tag_utils.parse_cache_info()
+        self.assertEqual(info.hits, 0)
+        self.assertEqual(info.misses, 4)
+        self.assertEqual(info.currsize, 2)
+
+    def test_resized(self):
+        tag_utils.parse_tags("adam")
+        with mock.patch.object(tag_settings, "PARSE_CACHE_SIZE", 10):
+            tag_utils.parse_tags("adam")
+            info = tag_utils.parse_cache_info()
+        self.assertEqual(info.maxsize, 10)
+        self.assertEqual(info.misses, 1)
+
+
 # ##############################################################################
 # ###### utils.render_tags
 # ##############################################################################
@@ -331,3 +331,52 @@ class AutocompleteViewTest(TagTestManager, TestCase):
         else:
             self.assertEqual(len(data["results"]), 0)
             self.assertEqual(data["more"], False)
+
+    def test_label(self):
+        "Test autocomplete view looking up the tag model by label"
+        tag_model = self.test_model.autocomplete_view.tag_model
+        for i in range(10):
+            tag_model.objects.create(name="tag%02d" % i)
+
+        response = client.get(
+            reverse(
+                "tagulous_tests_app-label",
+                kwargs={"label": tag_model._meta.label_lower},
+            ),
+            {"q": "tag0"},
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(get_response_content(response))
+        self.assertEqual(data["results"], ["tag%02d" % i for i in range(10)])
+
+    def test_label_login(self):
+        "Test autocomplete_label_login view"
+        tag_model = self.test_model.autocomplete_view.tag_model
+        tag_model.objects.create(name="tag00")
+        url = reverse(
+            "tagulous_tests_app-label-login",
+            kwargs={"label": tag_model._meta.label_lower},
+        )
+
+        response = client.get(url)
+        self.assertEqual(response.status_code, 302)
+
+        User.objects.create_user("test", "test@example.com", "password")
+        client.login(username="test", password="password")
+        response = client.get(url)
+        client.logout()
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(get_response_content(response))
+        self.assertEqual(data["results"], ["tag00"])
+
+    def test_label_not_tag_model(self):
+        "Test autocomplete view by label refuses models which aren't tag models"
+        response = client.get(
+            reverse("tagulous_tests_app-label", kwargs={"label": "auth.user"})
+        )
+        self.assertEqual(response.status_code, 404)
+
+        response = client.get(
+            reverse("tagulous_tests_app-label", kwargs={"label": "auth.missing"})
+        )
+        self.assertEqual(response.status_code, 404)